@@ -0,0 +1,225 @@
+"""Offline benchmarks for the bot's data structures.
+
+    python bench.py snapshot [--sizes 100000 1000000]
+    python bench.py reconcile [--members 200000] [--workers 4]
+    python bench.py render [--channels 2000] [--members 20000]
+
+Nothing here talks to Discord; inputs are synthetic.
+"""
+import argparse
+import asyncio
+import gc
+import random
+import string
+import time
+import tracemalloc
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+
+import discord
+
+from main import (NICK_BATCH_SIZE, ExcludedChannelsView, LogChannelView, MemberSnapshot, TagView, bot,
+                  compute_nick_batch, display_resolver)
+
+
+def synthetic_members(count: int, tag_roles: int = 40, seed: int = 1) -> list[tuple[int, int, str | None]]:
+    rng = random.Random(seed)
+    role_ids = [rng.getrandbits(60) for _ in range(tag_roles)]
+    members = []
+    for _ in range(count):
+        member_id = rng.getrandbits(63)
+        role_id = rng.choice(role_ids) if rng.random() < 0.7 else 0
+        nick = "".join(rng.choices(string.ascii_letters, k=rng.randint(4, 16))) if rng.random() < 0.6 else None
+        members.append((member_id, role_id, nick))
+    return members
+
+
+def measure(build):
+    gc.collect()
+    tracemalloc.start()
+    started = time.perf_counter()
+    result = build()
+    elapsed = time.perf_counter() - started
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, size, elapsed
+
+
+def bench_snapshot(sizes: list[int], lookups: int = 100_000):
+    print(f"{'members':>9} {'structure':<16} {'memory':>10} {'B/member':>9} {'build':>8} {'lookup':>9} {'blob':>10}")
+    for count in sizes:
+        members = synthetic_members(count)
+        probe = [m[0] for m in random.Random(2).choices(members, k=lookups)]
+
+        baseline, base_size, base_build = measure(lambda: {m[0]: (m[1], m[2]) for m in members})
+        started = time.perf_counter()
+        for member_id in probe:
+            baseline.get(member_id)
+        base_lookup = (time.perf_counter() - started) / lookups
+        print(f"{count:>9} {'dict[int,tuple]':<16} {base_size / 2**20:>8.1f}MB {base_size / count:>9.1f} "
+              f"{base_build:>7.2f}s {base_lookup * 1e9:>7.0f}ns {'-':>10}")
+        del baseline
+
+        snapshot, snap_size, snap_build = measure(lambda: MemberSnapshot.build(members))
+        started = time.perf_counter()
+        for member_id in probe:
+            snapshot.get(member_id)
+        snap_lookup = (time.perf_counter() - started) / lookups
+        blob = snapshot.to_bytes()
+        assert MemberSnapshot.from_bytes(blob).get(probe[0]) == snapshot.get(probe[0])
+        print(f"{count:>9} {'MemberSnapshot':<16} {snap_size / 2**20:>8.1f}MB {snap_size / count:>9.1f} "
+              f"{snap_build:>7.2f}s {snap_lookup * 1e9:>7.0f}ns {len(blob) / 2**20:>8.1f}MB")
+
+
+def synthetic_batches(count: int, tag_roles: int = 40, seed: int = 1):
+    """Packed (member_id, nick, name, role_ids) batches as nickname_changes builds them."""
+    rng = random.Random(seed)
+    role_ids = [rng.getrandbits(60) for _ in range(tag_roles * 2)]
+    tagged = role_ids[:tag_roles]
+    spec = ("[", "] ", "prefix", "name", (("(", ") ", "prefix"),),
+            {r: f"Alliance{i}" for i, r in enumerate(tagged)}, {r: (i, r) for i, r in enumerate(tagged)})
+    batches = []
+    for start in range(0, count, NICK_BATCH_SIZE):
+        ids, nicks, names, roles, offsets = array("Q"), [], [], array("Q"), array("I", [0])
+        for _ in range(min(NICK_BATCH_SIZE, count - start)):
+            ids.append(rng.getrandbits(63))
+            name = "".join(rng.choices(string.ascii_letters, k=rng.randint(4, 16)))
+            nicks.append(rng.choice([name, f"[Alliance{rng.randrange(tag_roles)}] {name}", f"(Old) {name}"]))
+            names.append(name)
+            roles.extend(rng.sample(role_ids, rng.randint(0, 3)))
+            offsets.append(len(roles))
+        batches.append((ids, nicks, names, roles, offsets))
+    return spec, batches
+
+
+async def max_stall(work) -> tuple[float, float]:
+    """Run ``work()`` while a 1 ms ticker measures the longest the loop went unserved."""
+    stall = 0.0
+    done = False
+
+    async def ticker():
+        nonlocal stall
+        last = time.perf_counter()
+        while not done:
+            await asyncio.sleep(0.001)
+            now = time.perf_counter()
+            stall = max(stall, now - last)
+            last = now
+
+    task = asyncio.create_task(ticker())
+    await asyncio.sleep(0.01)  # Ticker is running before the work starts
+    started = time.perf_counter()
+    await work()
+    elapsed = time.perf_counter() - started
+    done = True
+    await task
+    return elapsed, stall
+
+
+def bench_reconcile(count: int, workers: int):
+    spec, batches = synthetic_batches(count)
+
+    async def inline():
+        for batch in batches:
+            compute_nick_batch(spec, *batch)
+
+    async def pooled(pool):
+        loop = asyncio.get_running_loop()
+        futures = []
+        for batch in batches:
+            futures.append(loop.run_in_executor(pool, compute_nick_batch, spec, *batch))
+            await asyncio.sleep(0)
+        await asyncio.gather(*futures)
+
+    async def run():
+        print(f"{'mode':<12} {'members':>9} {'total':>8} {'members/s':>10} {'max loop stall':>15}")
+        elapsed, stall = await max_stall(inline)
+        print(f"{'inline':<12} {count:>9} {elapsed:>7.2f}s {count / elapsed:>10.0f} {stall * 1000:>12.1f} ms")
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            await asyncio.get_running_loop().run_in_executor(pool, compute_nick_batch, spec, *batches[0])  # Warm up
+            elapsed, stall = await max_stall(lambda: pooled(pool))
+        print(f"{f'{workers} workers':<12} {count:>9} {elapsed:>7.2f}s {count / elapsed:>10.0f} {stall * 1000:>12.1f} ms")
+
+    asyncio.run(run())
+
+
+def synthetic_guild(channels: int, members: int, categories: int = 50, roles: int = 100, seed: int = 1) -> discord.Guild:
+    rng = random.Random(seed)
+    guild_id = 1 << 40
+    word = lambda: "".join(rng.choices(string.ascii_lowercase, k=rng.randint(4, 12)))  # noqa: E731
+    role_data = [{"id": str(guild_id), "name": "@everyone", "permissions": "0", "position": 0}]
+    role_data += [{"id": str(guild_id + i), "name": word(), "permissions": "0", "position": i} for i in range(1, roles + 1)]
+    category_ids = [guild_id + 1000 + i for i in range(categories)]
+    channel_data = [{"id": str(c), "type": 4, "name": word(), "position": i} for i, c in enumerate(category_ids)]
+    channel_data += [
+        {"id": str(guild_id + 10_000 + i), "type": rng.choice((0, 0, 2)), "name": word(), "position": i,
+         "parent_id": str(rng.choice(category_ids)), "bitrate": 64000, "user_limit": 0}
+        for i in range(channels - categories)
+    ]
+    member_data = [
+        {"user": {"id": str(guild_id + 100_000 + i), "username": word(), "discriminator": "0", "avatar": None},
+         "roles": [str(guild_id + r) for r in rng.sample(range(1, roles + 1), rng.randint(0, 3))],
+         "joined_at": None, "deaf": False, "mute": False, "flags": 0}
+        for i in range(members)
+    ]
+    return discord.Guild(data={
+        "id": str(guild_id), "name": "bench", "roles": role_data, "channels": channel_data,
+        "members": member_data, "member_count": members,
+    }, state=bot._connection)
+
+
+def bench_render(channels: int, members: int, renders: int = 50):
+    guild = synthetic_guild(channels, members)
+    ids = [c.id for c in guild.channels]
+    excluded_ids = random.Random(3).sample(ids, 25)
+    tag_ids = [r.id for r in guild.roles[1:26]]
+    screens = {
+        "excluded": lambda page: ExcludedChannelsView(
+            guild, display_resolver.channels(guild, excluded_ids), display_resolver.channels(guild, excluded_ids), page
+        ),
+        "log_channel": lambda page: LogChannelView(guild, page),
+        "tags": lambda page: TagView(guild, display_resolver.roles(guild, tag_ids)),
+    }
+
+    async def run():
+        print(f"{len(guild.channels)} channels, {len(guild.categories)} categories, "
+              f"{len(guild.roles)} roles, {len(guild.members)} members")
+        print(f"{'screen':<12} {'cold ms':>9} {'warm ms':>9} {'speedup':>8}")
+        for name, render in screens.items():
+            started = time.perf_counter()
+            for i in range(renders):
+                display_resolver.clear()
+                render(i % 10)
+            cold = (time.perf_counter() - started) / renders
+            started = time.perf_counter()
+            for i in range(renders):
+                render(i % 10)
+            warm = (time.perf_counter() - started) / renders
+            print(f"{name:<12} {cold * 1000:>9.2f} {warm * 1000:>9.2f} {cold / warm:>7.1f}x")
+
+    asyncio.run(run())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="bench", required=True)
+    snapshot = sub.add_parser("snapshot", help="MemberSnapshot memory, build and lookup cost")
+    snapshot.add_argument("--sizes", type=int, nargs="+", default=[100_000, 1_000_000])
+    reconcile = sub.add_parser("reconcile", help="Nickname diff inline vs in a process pool, with event loop stalls")
+    reconcile.add_argument("--members", type=int, default=200_000)
+    reconcile.add_argument("--workers", type=int, default=4)
+    render = sub.add_parser("render", help="Settings screen render time with cold and warm display caches")
+    render.add_argument("--channels", type=int, default=2000)
+    render.add_argument("--members", type=int, default=20_000)
+    args = parser.parse_args()
+
+    if args.bench == "snapshot":
+        bench_snapshot(args.sizes)
+    elif args.bench == "reconcile":
+        bench_reconcile(args.members, args.workers)
+    elif args.bench == "render":
+        bench_render(args.channels, args.members)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,35 +1,284 @@
 import discord
-#import re
+import asyncio
+import functools
+import hashlib
+import re
+import json
 import logging
+import logging.handlers
+import queue
+import random
+import time
 from discord import app_commands, SelectOption
-from discord.ui import View, Modal, TextInput, Select
+from discord.ext import tasks
+from discord.ui import View, Modal, TextInput
+import aiohttp
 import aiosqlite
+try:
+    import asyncpg
+except ImportError:  # Only needed with DATABASE_URL
+    asyncpg = None
+import atexit
+import contextlib
 import os
+import signal
+import struct
+import sys
+import zlib
+from abc import ABC, abstractmethod
+from array import array
+from bisect import bisect_left
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from collections.abc import AsyncIterator, Iterable, Iterator
 from datetime import datetime, timezone
 from dotenv import load_dotenv
 
 load_dotenv()
 TOKEN = os.getenv("DISCORD_TOKEN")
-DB_PATH = "/app/data/bot.db"
+DB_PATH = os.getenv("DB_PATH", "/app/data/bot.db")
+DATABASE_URL = os.getenv("DATABASE_URL")
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+# Sharding: SHARD_COUNT shards in total, of which this process runs SHARD_IDS
+# (comma-separated, default all). Unset runs a single unsharded connection.
+SHARD_COUNT = int(os.getenv("SHARD_COUNT", "0"))
+SHARD_IDS = [int(shard_id) for shard_id in os.getenv("SHARD_IDS", "").split(",") if shard_id.strip()]
 
 intents = discord.Intents.default()
 intents.members = True
 
-bot = discord.Client(intents=intents)
+if SHARD_COUNT:
+    bot = discord.AutoShardedClient(intents=intents, shard_count=SHARD_COUNT, shard_ids=SHARD_IDS or None)
+else:
+    bot = discord.Client(intents=intents)
 tree = app_commands.CommandTree(bot)
 
 # ────────────────────────────────────────────────
 #                  LOGGING SETUP
 # ────────────────────────────────────────────────
 
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s [%(levelname)s] %(message)s",
-    datefmt="%Y-%m-%d %H:%M:%S"
-)
+# Records are queued from the event loop and formatted/written by a listener
+# thread, so a burst of role events never blocks on stderr.
+#
+#   LOG_LEVEL          minimum level (default INFO)
+#   LOG_FORMAT         "json" (default) or "text"
+#   LOG_SAMPLE_RATES   per-action sampling for INFO logs, e.g.
+#                      "nickname_updated=0.1,role_change=0.05"
+
+LOG_FIELDS = ("guild_id", "member_id", "action", "latency_ms")
+
+
+def log_fields(action: str, guild_id: int | None = None, member_id: int | None = None,
+               latency_ms: float | None = None) -> dict:
+    """Build the ``extra`` mapping for a structured log record."""
+    return {"action": action, "guild_id": guild_id, "member_id": member_id, "latency_ms": latency_ms}
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for field in LOG_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = round(value, 2) if field == "latency_ms" else value
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """Drop a fraction of INFO-and-below records per action. Warnings and errors always pass."""
+
+    def __init__(self, rates: dict[str, float]):
+        super().__init__()
+        self.rates = rates
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.INFO:
+            return True
+        rate = self.rates.get(getattr(record, "action", None))
+        return rate is None or random.random() < rate
+
+
+class LoopQueueHandler(logging.handlers.QueueHandler):
+    """Queue records with only the cheap %-interpolation done on the calling thread."""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def parse_sample_rates(raw: str) -> dict[str, float]:
+    rates = {}
+    for part in raw.split(","):
+        action, _, rate = part.partition("=")
+        if action.strip() and rate.strip():
+            rates[action.strip()] = max(0.0, min(1.0, float(rate)))
+    return rates
+
+
+def setup_logging() -> logging.handlers.QueueListener:
+    stream = logging.StreamHandler()
+    if os.getenv("LOG_FORMAT", "json").lower() == "text":
+        stream.setFormatter(logging.Formatter("%(asctime)s [%(levelname)s] %(message)s", "%Y-%m-%d %H:%M:%S"))
+    else:
+        stream.setFormatter(JsonFormatter())
+
+    log_queue = queue.SimpleQueue()
+    handler = LoopQueueHandler(log_queue)
+    handler.addFilter(SamplingFilter(parse_sample_rates(os.getenv("LOG_SAMPLE_RATES", ""))))
+
+    root = logging.getLogger()
+    root.handlers[:] = [handler]
+    root.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
+
+    listener = logging.handlers.QueueListener(log_queue, stream, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
+
+
+log_listener = setup_logging()
 logger = logging.getLogger("roles-bot")
 
 
+# ────────────────────────────────────────────────
+#                  PROFILING
+# ────────────────────────────────────────────────
+
+# Opt-in with PROFILE=1. Event handlers, component/modal callbacks, view construction
+# and DB helpers are timed; asyncio debug mode reports callbacks that block the
+# loop for longer than PROFILE_SLOW_CALLBACK seconds. Dump the slowest entries
+# with /profile_report or `kill -USR1 <pid>`.
+PROFILE_ENABLED = os.getenv("PROFILE", "").lower() in ("1", "true", "yes")
+PROFILE_SLOW_CALLBACK = float(os.getenv("PROFILE_SLOW_CALLBACK", "0.1"))
+PROFILE_TOP_N = int(os.getenv("PROFILE_TOP_N", "10"))
+INTERACTION_BUDGET = 3.0  # seconds Discord waits for an interaction response
+
+
+class TimingStat:
+    __slots__ = ("count", "total", "max", "over_budget")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.over_budget = 0
+
+
+class Profiler:
+    def __init__(self):
+        self.stats: dict[tuple[str, str], TimingStat] = {}
+
+    def record(self, kind: str, name: str, elapsed: float):
+        stat = self.stats.get((kind, name))
+        if stat is None:
+            stat = self.stats[(kind, name)] = TimingStat()
+        stat.count += 1
+        stat.total += elapsed
+        stat.max = max(stat.max, elapsed)
+        if elapsed > INTERACTION_BUDGET:
+            stat.over_budget += 1
+
+    def top(self, n: int, kinds: tuple[str, ...]) -> list[tuple[str, str, TimingStat]]:
+        rows = [(kind, name, stat) for (kind, name), stat in self.stats.items() if kind in kinds]
+        rows.sort(key=lambda row: row[2].max, reverse=True)
+        return rows[:n]
+
+    def report(self, n: int = PROFILE_TOP_N) -> str:
+        sections = (
+            ("Handlers", ("event", "view", "modal")),
+            ("View construction", ("view_init",)),
+            ("DB calls", ("db",)),
+        )
+        lines = []
+        for title, kinds in sections:
+            lines.append(f"**{title}** (max / avg ms, calls, >3s)")
+            rows = self.top(n, kinds)
+            lines.extend(
+                f"`{name}` {stat.max * 1000:.1f} / {stat.total / stat.count * 1000:.1f} ms, "
+                f"{stat.count}x, {stat.over_budget} slow"
+                for _, name, stat in rows
+            )
+            if not rows:
+                lines.append("No samples")
+        return "\n".join(lines)
+
+
+profiler = Profiler()
+
+
+def timed_call(func, kind: str, name: str):
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await func(*args, **kwargs)
+        finally:
+            profiler.record(kind, name, time.perf_counter() - started)
+    return wrapper
+
+
+def timed(kind: str):
+    """Time an async function under PROFILE=1; a no-op otherwise."""
+    def decorator(func):
+        return timed_call(func, kind, func.__name__) if PROFILE_ENABLED else func
+    return decorator
+
+
+class TimedView(View):
+    """View base that times the view's construction under PROFILE=1."""
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        if PROFILE_ENABLED and "__init__" in cls.__dict__:
+            init = cls.__init__
+
+            @functools.wraps(init)
+            def timed_init(self, *args, **kw):
+                started = time.perf_counter()
+                init(self, *args, **kw)
+                profiler.record("view_init", cls.__name__, time.perf_counter() - started)
+            cls.__init__ = timed_init
+
+
+class TimedModal(Modal):
+    """Modal base that times on_submit under PROFILE=1."""
+
+    def __init__(self, *args, **kwargs):
+        # Dismissed modals would otherwise stay in the view store forever
+        kwargs.setdefault("timeout", 900)
+        super().__init__(*args, **kwargs)
+        if PROFILE_ENABLED:
+            self.on_submit = timed_call(self.on_submit, "modal", type(self).__name__)
+
+
+def enable_profiling(loop: asyncio.AbstractEventLoop):
+    loop.set_debug(True)
+    loop.slow_callback_duration = PROFILE_SLOW_CALLBACK
+    try:
+        loop.add_signal_handler(
+            signal.SIGUSR1,
+            lambda: logger.warning("Profile report\n%s", profiler.report(), extra=log_fields("profile_report"))
+        )
+    except (NotImplementedError, AttributeError):
+        pass  # No SIGUSR1 on this platform; use /profile_report
+    logger.info(
+        "Profiling enabled | slow callback threshold %.3fs", PROFILE_SLOW_CALLBACK,
+        extra=log_fields("profile_enabled")
+    )
+
+
 async def log_to_channel(guild: discord.Guild, message: str, color: int = 0x5865f2):
     """Send a log embed to the configured log channel for this guild."""
     channel_id = await get_log_channel_id(guild.id)
@@ -46,7 +295,7 @@ async def log_to_channel(guild: discord.Guild, message: str, color: int = 0x5865
         )
         await channel.send(embed=embed)
     except Exception as e:
-        logger.error(f"Failed to send log to channel: {e}")
+        logger.error("Failed to send log to channel: %s", e, extra=log_fields("log_channel_failed", guild.id))
 
 
 # Log colors
@@ -56,766 +305,3106 @@ LOG_BLUE   = 0x3498db   # informational / bulk actions
 LOG_YELLOW = 0xf1c40f   # skipped / excluded
 
 
+# ────────────────────────────────────────────────
+#                  EVENT TRACING
+# ────────────────────────────────────────────────
+
+# Opt-in with TRACE_PATH=/path/to/trace.jsonl. Member joins, member updates and
+# channel updates are appended as JSON lines for offline replay with replay.py.
+# The first event seen from a guild is preceded by a "guild" record holding its
+# roles, channels, members and tag config. IDs go through a keyed hash and every
+# word of a name is swapped for letters of the same length, so the trace holds no
+# real identities but nicknames and tags keep their shape. Set TRACE_SALT to get
+# the same IDs across recordings; otherwise a random salt is used per process.
+TRACE_PATH = os.getenv("TRACE_PATH", "")
+TRACE_WORD = re.compile(r"\w+")
+
+
+class TraceAnonymizer:
+    def __init__(self, salt: bytes):
+        self.salt = salt[:64]
+        self.words: dict[str, str] = {}
+
+    def _digest(self, value: str, size: int) -> bytes:
+        return hashlib.blake2b(value.encode(), key=self.salt, digest_size=size).digest()
+
+    def id(self, value: int | None) -> str | None:
+        if value is None:
+            return None
+        return str(int.from_bytes(self._digest(str(value), 8), "big") >> 1 or 1)
+
+    def _word(self, match: re.Match) -> str:
+        word = match.group()
+        fake = self.words.get(word)
+        if fake is None:
+            digest = self._digest(word, min(len(word), 64)) * (len(word) // 64 + 1)
+            fake = self.words[word] = "".join(chr(97 + b % 26) for b in digest[:len(word)])
+        return fake
+
+    def text(self, value: str | None) -> str | None:
+        return TRACE_WORD.sub(self._word, value) if value else value
+
+    def role(self, role: discord.Role) -> dict:
+        return {
+            "id": self.id(role.id),
+            "name": self.text(role.name),
+            "position": role.position,
+            "permissions": str(role.permissions.value),
+        }
+
+    def member(self, member: discord.Member) -> dict:
+        return {
+            "user": {
+                "id": self.id(member.id),
+                "username": self.text(member.name),
+                "global_name": self.text(member.global_name),
+                "discriminator": "0",
+                "avatar": None,
+                "bot": member.bot,
+            },
+            "nick": self.text(member.nick),
+            "roles": [self.id(r.id) for r in member.roles if not r.is_default()],
+            "flags": 0,
+        }
+
+    def channel(self, channel: discord.abc.GuildChannel) -> dict:
+        data = {
+            "id": self.id(channel.id),
+            "type": channel.type.value,
+            "name": self.text(channel.name),
+            "position": channel.position,
+            "parent_id": self.id(channel.category_id),
+            "nsfw": getattr(channel, "nsfw", False),
+        }
+        # Type-specific fields discord.py requires to rebuild the channel on replay
+        if isinstance(channel, discord.VoiceChannel | discord.StageChannel):
+            data.update(bitrate=channel.bitrate, user_limit=channel.user_limit, rtc_region=channel.rtc_region)
+        if isinstance(channel, discord.TextChannel | discord.ForumChannel):
+            data.update(topic=self.text(channel.topic), rate_limit_per_user=channel.slowmode_delay)
+        return data | {
+            "permission_overwrites": [
+                {
+                    "id": self.id(target.id),
+                    "type": 0 if isinstance(target, discord.Role) else 1,
+                    "allow": str(allow.value),
+                    "deny": str(deny.value),
+                }
+                for target, overwrite in channel.overwrites.items()
+                for allow, deny in (overwrite.pair(),)
+            ],
+        }
+
+
+class TraceRecorder:
+    """Writes anonymized event records through a queue listener thread, like the logs."""
+
+    def __init__(self, path: str, salt: bytes):
+        self.anon = TraceAnonymizer(salt)
+        self.started = time.monotonic()
+        self.guilds: set[int] = set()
+
+        file = logging.FileHandler(path, encoding="utf-8")
+        file.setFormatter(logging.Formatter("%(message)s"))
+        trace_queue = queue.SimpleQueue()
+        self.logger = logging.getLogger("roles-bot.trace")
+        self.logger.propagate = False
+        self.logger.setLevel(logging.INFO)
+        self.logger.handlers[:] = [LoopQueueHandler(trace_queue)]
+        listener = logging.handlers.QueueListener(trace_queue, file)
+        listener.start()
+        atexit.register(listener.stop)
+
+    def write(self, t: float, event: str, guild_id: int, **payload):
+        record = {"t": round(t, 4), "event": event, "guild_id": self.anon.id(guild_id), **payload}
+        self.logger.info("%s", json.dumps(record, ensure_ascii=False, separators=(",", ":")))
+
+    async def record(self, event: str, guild: discord.Guild, **payload):
+        t = time.monotonic() - self.started
+        if guild.id not in self.guilds:
+            self.guilds.add(guild.id)
+            await self.record_guild(t, guild)
+        self.write(t, event, guild.id, **payload)
+
+    async def record_guild(self, t: float, guild: discord.Guild):
+        anon = self.anon
+        # Build the discord-side payload before awaiting so it matches time t
+        payload = {
+            "id": anon.id(guild.id),
+            "name": anon.text(guild.name),
+            "member_count": guild.member_count,
+            "roles": [anon.role(r) for r in guild.roles],
+            "channels": [anon.channel(c) for c in guild.channels],
+            "members": [anon.member(m) for m in guild.members],
+        }
+        config = await get_guild_config(guild.id) or {}
+        labels = await get_tag_labels(guild.id)
+        self.write(t, "guild", guild.id, guild=payload, config={
+            "prefix": config.get("prefix"),
+            "suffix": config.get("suffix"),
+            "position": config.get("position"),
+            "truncate": config.get("truncate"),
+            "log_channel_id": anon.id(config.get("log_channel_id")),
+            "formats": await get_tag_formats(guild.id),
+            "tag_roles": {anon.id(role_id): [anon.text(a), anon.text(e)] for role_id, (a, e) in labels.items()},
+            "excluded_channels": [anon.id(i) for i in await get_excluded_channel_ids(guild.id)],
+            "excluded_categories": [anon.id(i) for i in await get_excluded_category_ids(guild.id)],
+        })
+
+    async def member_join(self, member: discord.Member):
+        await self.record("member_join", member.guild, member=self.anon.member(member))
+
+    async def member_update(self, member: discord.Member):
+        await self.record("member_update", member.guild, member=self.anon.member(member))
+
+    async def channel_update(self, channel: discord.abc.GuildChannel):
+        await self.record("channel_update", channel.guild, channel=self.anon.channel(channel))
+
+
+trace_recorder = TraceRecorder(TRACE_PATH, os.getenv("TRACE_SALT", "").encode() or os.urandom(16)) if TRACE_PATH else None
+
+
+# ────────────────────────────────────────────────
+#                  API CALLS
+# ────────────────────────────────────────────────
+
+# Member and channel edits go through api_call(). Failures are classified:
+# missing permissions, unknown objects and other 4xx are permanent and raised at
+# once; 429s that escape discord.py, 5xx and network errors are retried up to
+# API_MAX_RETRIES times with full-jitter exponential backoff.
+#
+# Bulk work (refreshes, syncs) is paced from the X-RateLimit headers discord.py
+# tracks per bucket: when a bucket is down to API_BULK_RESERVE requests, bulk
+# calls wait for its reset so live events keep some headroom. Transient failures
+# also double a per-bucket delay for bulk calls, which halves on each success.
+# Counters are logged every API_STATS_INTERVAL seconds when anything happened.
+API_MAX_RETRIES = int(os.getenv("API_MAX_RETRIES", "2"))
+API_BACKOFF_BASE = float(os.getenv("API_BACKOFF_BASE", "0.5"))
+API_BULK_RESERVE = int(os.getenv("API_BULK_RESERVE", "1"))
+API_STATS_INTERVAL = float(os.getenv("API_STATS_INTERVAL", "300"))
+API_MAX_SLOWDOWN = 10.0
+
+
+def is_transient(error: Exception) -> bool:
+    if isinstance(error, (discord.RateLimited, discord.DiscordServerError)):
+        return True
+    if isinstance(error, discord.HTTPException):
+        return error.status == 429 or error.status >= 500
+    return isinstance(error, (aiohttp.ClientError, asyncio.TimeoutError, ConnectionError))
+
+
+def describe_error(error: Exception) -> str:
+    if isinstance(error, discord.Forbidden):
+        return "Missing permissions"
+    if isinstance(error, discord.NotFound):
+        return "No longer exists"
+    return f"{error} ({'transient' if is_transient(error) else 'permanent'})"
+
+
+def member_route(member: discord.Member) -> discord.http.Route:
+    return discord.http.Route("PATCH", "/guilds/{guild_id}/members/{user_id}", guild_id=member.guild.id, user_id=member.id)
+
+
+def channel_route(channel: discord.abc.GuildChannel) -> discord.http.Route:
+    return discord.http.Route("PATCH", "/channels/{channel_id}", channel_id=channel.id)
+
+
+class RateLimitCounter(logging.Filter):
+    """Counts the 429s discord.py retries internally, which never reach our code."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if isinstance(record.msg, str) and record.msg.startswith(("We are being rate limited", "Global rate limit")):
+            api_limiter.stats["429_handled"] += 1
+        return True
+
+
+class ApiLimiter:
+    def __init__(self, max_retries: int, backoff_base: float, bulk_reserve: int):
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.bulk_reserve = bulk_reserve
+        self.slowdown: dict[str, float] = {}
+        self.stats: Counter[str] = Counter()
+
+    @staticmethod
+    def bucket(route: discord.http.Route):
+        """discord.py's rate limit state for a route, once it has seen the headers."""
+        bucket_hash = getattr(bot.http, "_bucket_hashes", {}).get(route.key)
+        if bucket_hash is None:
+            return None
+        return getattr(bot.http, "_buckets", {}).get(f"{bucket_hash}:{route.major_parameters}")
+
+    async def pace(self, route: discord.http.Route, key: str):
+        ratelimit = self.bucket(route)
+        if ratelimit is not None and ratelimit.expires and ratelimit.remaining <= self.bulk_reserve:
+            wait = ratelimit.expires - asyncio.get_running_loop().time()
+            if wait > 0:
+                self.stats["bulk_waits"] += 1
+                await asyncio.sleep(wait)
+        delay = self.slowdown.get(key)
+        if delay:
+            await asyncio.sleep(delay)
+
+    def _slow_down(self, key: str):
+        self.slowdown[key] = min(API_MAX_SLOWDOWN, max(self.backoff_base, self.slowdown.get(key, 0) * 2))
+
+    def _speed_up(self, key: str):
+        delay = self.slowdown.get(key)
+        if delay is not None:
+            if delay < 0.05:
+                del self.slowdown[key]
+            else:
+                self.slowdown[key] = delay / 2
+
+    async def call(self, kind: str, route: discord.http.Route, request, bulk: bool = False):
+        """Run ``request()`` with retries for transient errors; permanent errors are raised at once."""
+        key = f"{route.key}:{route.major_parameters}"
+        for attempt in range(self.max_retries + 1):
+            if bulk:
+                await self.pace(route, key)
+            self.stats[f"{kind}.calls"] += 1
+            try:
+                result = await request()
+            except Exception as e:
+                if not is_transient(e):
+                    self.stats[f"{kind}.permanent"] += 1
+                    raise
+                status = getattr(e, "status", None)
+                self.stats[f"{kind}.{'429' if status == 429 else '5xx' if status else 'network'}"] += 1
+                self._slow_down(key)
+                if attempt == self.max_retries:
+                    self.stats[f"{kind}.gave_up"] += 1
+                    raise
+                retry_after = getattr(e, "retry_after", None)
+                delay = retry_after if retry_after else random.uniform(0, self.backoff_base * 2 ** attempt)
+                self.stats[f"{kind}.retries"] += 1
+                logger.warning(
+                    "Retrying %s in %.2fs (attempt %d/%d): %s", kind, delay, attempt + 1, self.max_retries, e,
+                    extra=log_fields("api_retry")
+                )
+                await asyncio.sleep(delay)
+            else:
+                self._speed_up(key)
+                return result
+
+    def log_stats(self):
+        if not self.stats:
+            return
+        logger.info(
+            "API stats | %s | %d buckets slowed",
+            ", ".join(f"{name}={count}" for name, count in sorted(self.stats.items())), len(self.slowdown),
+            extra=log_fields("api_stats")
+        )
+        self.stats.clear()
+
+
+api_limiter = ApiLimiter(API_MAX_RETRIES, API_BACKOFF_BASE, API_BULK_RESERVE)
+logging.getLogger("discord.http").addFilter(RateLimitCounter())
+
+
+@tasks.loop(seconds=API_STATS_INTERVAL or 300)
+async def api_stats_report():
+    api_limiter.log_stats()
+
+
 # ────────────────────────────────────────────────
 #                  DATABASE
 # ────────────────────────────────────────────────
 
-async def init_db():
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute("""
-            CREATE TABLE IF NOT EXISTS guilds (
-                guild_id        INTEGER PRIMARY KEY,
-                staff_role_id   INTEGER,
-                tag_prefix      TEXT DEFAULT '[',
-                tag_suffix      TEXT DEFAULT '] ',
-                log_channel_id  INTEGER,
-                created_at      DATETIME DEFAULT CURRENT_TIMESTAMP
+# The bot talks to storage through the Storage interface. SQLite (one file at
+# DB_PATH) is the default; set DATABASE_URL=postgresql://... to share state
+# between shard processes (SHARD_COUNT/SHARD_IDS).
+
+class Storage(ABC):
+    """Repository interface for all persisted per-guild configuration."""
+
+    @abstractmethod
+    async def init(self):
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+    @abstractmethod
+    async def ensure_guild(self, guild_id: int):
+        raise NotImplementedError
+
+    @abstractmethod
+    async def get_guild_config(self, guild_id: int) -> dict | None:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def set_staff_role(self, guild_id: int, role_id: int):
+        raise NotImplementedError
+
+    @abstractmethod
+    async def set_tag_format(self, guild_id: int, prefix: str, suffix: str, position: str, truncate: str):
+        raise NotImplementedError
+
+    @abstractmethod
+    async def get_tag_formats(self, guild_id: int) -> list[tuple[str, str, str]]:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def set_log_channel(self, guild_id: int, channel_id: int | None):
+        raise NotImplementedError
+
+    @abstractmethod
+    async def get_log_channel_id(self, guild_id: int) -> int | None:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def add_tag_role(self, guild_id: int, role_id: int):
+        raise NotImplementedError
+
+    @abstractmethod
+    async def remove_tag_role(self, guild_id: int, role_id: int):
+        raise NotImplementedError
+
+    @abstractmethod
+    async def set_tag_label(self, guild_id: int, role_id: int, abbreviation: str | None, emoji: str | None) -> bool:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def get_tag_labels(self, guild_id: int) -> dict[int, tuple[str | None, str | None]]:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def add_excluded(self, table: str, guild_id: int, object_id: int):
+        raise NotImplementedError
+
+    @abstractmethod
+    async def remove_excluded(self, table: str, guild_id: int, object_id: int):
+        raise NotImplementedError
+
+    @abstractmethod
+    async def get_excluded_ids(self, table: str, guild_id: int) -> set[int]:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def save_member_snapshot(self, guild_id: int, data: bytes):
+        raise NotImplementedError
+
+    @abstractmethod
+    async def load_member_snapshot(self, guild_id: int) -> bytes | None:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def mark_guild_removed(self, guild_id: int):
+        raise NotImplementedError
+
+    @abstractmethod
+    async def reconcile_guilds(self, present: set[int], shard_count: int = 1,
+                               shard_ids: Iterable[int] = (0,)) -> tuple[int, int]:
+        """Mark stored guilds the bot is no longer in as removed and restore the rest.
+
+        Only guilds on ``shard_ids`` out of ``shard_count`` are considered, so a
+        shard never marks another shard's guilds. Returns (marked, restored) counts.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    async def purge_removed_guilds(self, grace_seconds: float, limit: int) -> list[int]:
+        """Delete up to ``limit`` guilds removed more than ``grace_seconds`` ago, with their rows."""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def maintain(self, vacuum: bool):
+        raise NotImplementedError
+
+    @abstractmethod
+    async def stats(self) -> dict:
+        """Database size in bytes, row counts per table and guilds awaiting purge."""
+        raise NotImplementedError
+
+
+# Exclusion tables and their id column
+EXCLUSION_TABLES = {
+    "excluded_channels": "channel_id",
+    "excluded_categories": "category_id",
+}
+GUILD_TABLES = ("tag_roles", "excluded_channels", "excluded_categories", "tag_formats", "member_snapshots")
+
+
+class SqliteStorage(Storage):
+    def __init__(self, path: str):
+        self.path = path
+
+    @contextlib.asynccontextmanager
+    async def _connect(self):
+        async with aiosqlite.connect(self.path) as db:
+            # Per connection, and off by default; ON DELETE CASCADE depends on it
+            await db.execute("PRAGMA foreign_keys = ON")
+            yield db
+
+    async def init(self):
+        async with self._connect() as db:
+            await db.execute("""
+                CREATE TABLE IF NOT EXISTS guilds (
+                    guild_id        INTEGER PRIMARY KEY,
+                    staff_role_id   INTEGER,
+                    tag_prefix      TEXT DEFAULT '[',
+                    tag_suffix      TEXT DEFAULT '] ',
+                    tag_position    TEXT DEFAULT 'prefix',
+                    tag_truncate    TEXT DEFAULT 'name',
+                    log_channel_id  INTEGER,
+                    created_at      DATETIME DEFAULT CURRENT_TIMESTAMP,
+                    removed_at      DATETIME
+                )
+            """)
+            await db.execute("""
+                CREATE TABLE IF NOT EXISTS tag_roles (
+                    id          INTEGER PRIMARY KEY AUTOINCREMENT,
+                    guild_id    INTEGER NOT NULL,
+                    role_id     INTEGER NOT NULL,
+                    abbreviation TEXT,
+                    emoji       TEXT,
+                    UNIQUE(guild_id, role_id),
+                    FOREIGN KEY(guild_id) REFERENCES guilds(guild_id) ON DELETE CASCADE
+                )
+            """)
+            await db.execute("""
+                CREATE TABLE IF NOT EXISTS excluded_channels (
+                    id          INTEGER PRIMARY KEY AUTOINCREMENT,
+                    guild_id    INTEGER NOT NULL,
+                    channel_id  INTEGER NOT NULL,
+                    UNIQUE(guild_id, channel_id),
+                    FOREIGN KEY(guild_id) REFERENCES guilds(guild_id) ON DELETE CASCADE
+                )
+            """)
+            await db.execute("""
+                CREATE TABLE IF NOT EXISTS excluded_categories (
+                    id          INTEGER PRIMARY KEY AUTOINCREMENT,
+                    guild_id    INTEGER NOT NULL,
+                    category_id INTEGER NOT NULL,
+                    UNIQUE(guild_id, category_id),
+                    FOREIGN KEY(guild_id) REFERENCES guilds(guild_id) ON DELETE CASCADE
+                )
+            """)
+            await db.execute("""
+                CREATE TABLE IF NOT EXISTS tag_formats (
+                    id          INTEGER PRIMARY KEY AUTOINCREMENT,
+                    guild_id    INTEGER NOT NULL,
+                    prefix      TEXT NOT NULL,
+                    suffix      TEXT NOT NULL,
+                    position    TEXT NOT NULL,
+                    UNIQUE(guild_id, prefix, suffix, position),
+                    FOREIGN KEY(guild_id) REFERENCES guilds(guild_id) ON DELETE CASCADE
+                )
+            """)
+            await db.execute("""
+                CREATE TABLE IF NOT EXISTS member_snapshots (
+                    guild_id    INTEGER PRIMARY KEY,
+                    data        BLOB NOT NULL,
+                    taken_at    DATETIME DEFAULT CURRENT_TIMESTAMP,
+                    FOREIGN KEY(guild_id) REFERENCES guilds(guild_id) ON DELETE CASCADE
+                )
+            """)
+            # Add columns if upgrading from older DB
+            for statement in (
+                "ALTER TABLE guilds ADD COLUMN log_channel_id INTEGER",
+                "ALTER TABLE guilds ADD COLUMN tag_position TEXT DEFAULT 'prefix'",
+                "ALTER TABLE guilds ADD COLUMN tag_truncate TEXT DEFAULT 'name'",
+                "ALTER TABLE tag_roles ADD COLUMN abbreviation TEXT",
+                "ALTER TABLE tag_roles ADD COLUMN emoji TEXT",
+                "ALTER TABLE guilds ADD COLUMN removed_at DATETIME",
+            ):
+                try:
+                    await db.execute(statement)
+                except Exception:
+                    pass  # Column already exists
+            await db.commit()
+
+    async def ensure_guild(self, guild_id: int):
+        async with self._connect() as db:
+            await db.execute(
+                "INSERT INTO guilds (guild_id) VALUES (?) ON CONFLICT(guild_id) DO UPDATE SET removed_at = NULL",
+                (guild_id,)
             )
-        """)
-        await db.execute("""
-            CREATE TABLE IF NOT EXISTS tag_roles (
-                id          INTEGER PRIMARY KEY AUTOINCREMENT,
-                guild_id    INTEGER NOT NULL,
-                role_id     INTEGER NOT NULL,
-                UNIQUE(guild_id, role_id),
-                FOREIGN KEY(guild_id) REFERENCES guilds(guild_id) ON DELETE CASCADE
+            await db.commit()
+
+    async def get_guild_config(self, guild_id: int) -> dict | None:
+        async with self._connect() as db:
+            async with db.execute(
+                "SELECT staff_role_id, tag_prefix, tag_suffix, log_channel_id, tag_position, tag_truncate "
+                "FROM guilds WHERE guild_id = ?",
+                (guild_id,)
+            ) as cur:
+                row = await cur.fetchone()
+                if row:
+                    return {
+                        "staff_role_id": row[0],
+                        "prefix": row[1],
+                        "suffix": row[2],
+                        "log_channel_id": row[3],
+                        "position": row[4] or "prefix",
+                        "truncate": row[5] or "name"
+                    }
+        return None
+
+    async def set_staff_role(self, guild_id: int, role_id: int):
+        async with self._connect() as db:
+            await db.execute(
+                "INSERT INTO guilds (guild_id, staff_role_id) VALUES (?, ?) "
+                "ON CONFLICT(guild_id) DO UPDATE SET staff_role_id = excluded.staff_role_id",
+                (guild_id, role_id)
             )
-        """)
-        await db.execute("""
-            CREATE TABLE IF NOT EXISTS excluded_channels (
-                id          INTEGER PRIMARY KEY AUTOINCREMENT,
-                guild_id    INTEGER NOT NULL,
-                channel_id  INTEGER NOT NULL,
-                UNIQUE(guild_id, channel_id),
-                FOREIGN KEY(guild_id) REFERENCES guilds(guild_id) ON DELETE CASCADE
+            await db.commit()
+
+    async def set_tag_format(self, guild_id: int, prefix: str, suffix: str, position: str, truncate: str):
+        async with self._connect() as db:
+            async with db.execute(
+                "SELECT tag_prefix, tag_suffix, tag_position FROM guilds WHERE guild_id = ?", (guild_id,)
+            ) as cur:
+                previous = await cur.fetchone()
+            formats = [(prefix, suffix, position)]
+            if previous:
+                formats.append((previous[0], previous[1], previous[2] or "prefix"))
+            await db.execute(
+                "INSERT INTO guilds (guild_id, tag_prefix, tag_suffix, tag_position, tag_truncate) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(guild_id) DO UPDATE SET tag_prefix = excluded.tag_prefix, tag_suffix = excluded.tag_suffix, "
+                "tag_position = excluded.tag_position, tag_truncate = excluded.tag_truncate",
+                (guild_id, prefix, suffix, position, truncate)
             )
-        """)
-        await db.execute("""
-            CREATE TABLE IF NOT EXISTS excluded_categories (
-                id          INTEGER PRIMARY KEY AUTOINCREMENT,
-                guild_id    INTEGER NOT NULL,
-                category_id INTEGER NOT NULL,
-                UNIQUE(guild_id, category_id),
-                FOREIGN KEY(guild_id) REFERENCES guilds(guild_id) ON DELETE CASCADE
+            await db.executemany(
+                "INSERT OR IGNORE INTO tag_formats (guild_id, prefix, suffix, position) VALUES (?, ?, ?, ?)",
+                [(guild_id, *fmt) for fmt in formats]
             )
-        """)
-        # Add log_channel_id column if upgrading from older DB
-        try:
-            await db.execute("ALTER TABLE guilds ADD COLUMN log_channel_id INTEGER")
-        except Exception:
-            pass  # Column already exists
-        await db.commit()
+            await db.commit()
 
+    async def get_tag_formats(self, guild_id: int) -> list[tuple[str, str, str]]:
+        async with self._connect() as db:
+            cur = await db.execute(
+                "SELECT prefix, suffix, position FROM tag_formats WHERE guild_id = ?", (guild_id,)
+            )
+            return [tuple(row) async for row in cur]
+
+    async def set_log_channel(self, guild_id: int, channel_id: int | None):
+        async with self._connect() as db:
+            await db.execute(
+                "INSERT INTO guilds (guild_id, log_channel_id) VALUES (?, ?) "
+                "ON CONFLICT(guild_id) DO UPDATE SET log_channel_id = excluded.log_channel_id",
+                (guild_id, channel_id)
+            )
+            await db.commit()
+
+    async def get_log_channel_id(self, guild_id: int) -> int | None:
+        async with self._connect() as db:
+            async with db.execute(
+                "SELECT log_channel_id FROM guilds WHERE guild_id = ?", (guild_id,)
+            ) as cur:
+                row = await cur.fetchone()
+                return row[0] if row else None
+
+    async def add_tag_role(self, guild_id: int, role_id: int):
+        async with self._connect() as db:
+            await db.execute(
+                "INSERT OR IGNORE INTO tag_roles (guild_id, role_id) VALUES (?, ?)",
+                (guild_id, role_id)
+            )
+            await db.commit()
 
-async def get_guild_config(guild_id: int) -> dict | None:
-    async with aiosqlite.connect(DB_PATH) as db:
-        async with db.execute(
-            "SELECT staff_role_id, tag_prefix, tag_suffix, log_channel_id FROM guilds WHERE guild_id = ?",
-            (guild_id,)
-        ) as cur:
-            row = await cur.fetchone()
-            if row:
-                return {
-                    "staff_role_id": row[0],
-                    "prefix": row[1],
-                    "suffix": row[2],
-                    "log_channel_id": row[3]
-                }
-    return None
+    async def remove_tag_role(self, guild_id: int, role_id: int):
+        async with self._connect() as db:
+            await db.execute(
+                "DELETE FROM tag_roles WHERE guild_id = ? AND role_id = ?",
+                (guild_id, role_id)
+            )
+            await db.commit()
 
+    async def set_tag_label(self, guild_id: int, role_id: int, abbreviation: str | None, emoji: str | None) -> bool:
+        async with self._connect() as db:
+            cur = await db.execute(
+                "UPDATE tag_roles SET abbreviation = ?, emoji = ? WHERE guild_id = ? AND role_id = ?",
+                (abbreviation, emoji, guild_id, role_id)
+            )
+            await db.commit()
+            return cur.rowcount > 0
 
-async def set_staff_role(guild_id: int, role_id: int):
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute(
-            "INSERT OR REPLACE INTO guilds (guild_id, staff_role_id) VALUES (?, ?)",
-            (guild_id, role_id)
+    async def get_tag_labels(self, guild_id: int) -> dict[int, tuple[str | None, str | None]]:
+        async with self._connect() as db:
+            cur = await db.execute(
+                "SELECT role_id, abbreviation, emoji FROM tag_roles WHERE guild_id = ?", (guild_id,)
+            )
+            return {row[0]: (row[1], row[2]) async for row in cur}
+
+    async def add_excluded(self, table: str, guild_id: int, object_id: int):
+        async with self._connect() as db:
+            await db.execute(
+                f"INSERT OR IGNORE INTO {table} (guild_id, {EXCLUSION_TABLES[table]}) VALUES (?, ?)",
+                (guild_id, object_id)
+            )
+            await db.commit()
+
+    async def remove_excluded(self, table: str, guild_id: int, object_id: int):
+        async with self._connect() as db:
+            await db.execute(
+                f"DELETE FROM {table} WHERE guild_id = ? AND {EXCLUSION_TABLES[table]} = ?",
+                (guild_id, object_id)
+            )
+            await db.commit()
+
+    async def get_excluded_ids(self, table: str, guild_id: int) -> set[int]:
+        async with self._connect() as db:
+            cur = await db.execute(f"SELECT {EXCLUSION_TABLES[table]} FROM {table} WHERE guild_id = ?", (guild_id,))
+            return {row[0] async for row in cur}
+
+    async def save_member_snapshot(self, guild_id: int, data: bytes):
+        async with self._connect() as db:
+            await db.execute(
+                "INSERT INTO member_snapshots (guild_id, data, taken_at) VALUES (?, ?, CURRENT_TIMESTAMP) "
+                "ON CONFLICT(guild_id) DO UPDATE SET data = excluded.data, taken_at = excluded.taken_at",
+                (guild_id, data)
+            )
+            await db.commit()
+
+    async def load_member_snapshot(self, guild_id: int) -> bytes | None:
+        async with self._connect() as db:
+            async with db.execute("SELECT data FROM member_snapshots WHERE guild_id = ?", (guild_id,)) as cur:
+                row = await cur.fetchone()
+                return row[0] if row else None
+
+    async def mark_guild_removed(self, guild_id: int):
+        async with self._connect() as db:
+            await db.execute(
+                "UPDATE guilds SET removed_at = COALESCE(removed_at, CURRENT_TIMESTAMP) WHERE guild_id = ?", (guild_id,)
+            )
+            await db.commit()
+
+    async def reconcile_guilds(self, present: set[int], shard_count: int = 1,
+                               shard_ids: Iterable[int] = (0,)) -> tuple[int, int]:
+        shard_ids = set(shard_ids)
+        async with self._connect() as db:
+            cur = await db.execute("SELECT guild_id, removed_at IS NOT NULL FROM guilds")
+            stored = {row[0]: row[1] async for row in cur}
+            gone = [
+                (guild_id,) for guild_id, removed in stored.items()
+                if guild_id not in present and not removed and (guild_id >> 22) % shard_count in shard_ids
+            ]
+            back = [(guild_id,) for guild_id in present if stored.get(guild_id, 1)]
+            await db.executemany("UPDATE guilds SET removed_at = CURRENT_TIMESTAMP WHERE guild_id = ?", gone)
+            await db.executemany(
+                "INSERT INTO guilds (guild_id) VALUES (?) ON CONFLICT(guild_id) DO UPDATE SET removed_at = NULL", back
+            )
+            await db.commit()
+            return len(gone), len(back)
+
+    async def purge_removed_guilds(self, grace_seconds: float, limit: int) -> list[int]:
+        async with self._connect() as db:
+            cur = await db.execute(
+                "SELECT guild_id FROM guilds WHERE removed_at <= datetime('now', ?) LIMIT ?",
+                (f"-{int(grace_seconds)} seconds", limit)
+            )
+            guild_ids = [row[0] async for row in cur]
+            await db.executemany("DELETE FROM guilds WHERE guild_id = ?", [(guild_id,) for guild_id in guild_ids])
+            await db.commit()
+            return guild_ids
+
+    async def maintain(self, vacuum: bool):
+        async with self._connect() as db:
+            # Rows orphaned while foreign keys were not enforced
+            for table in GUILD_TABLES:
+                await db.execute(f"DELETE FROM {table} WHERE guild_id NOT IN (SELECT guild_id FROM guilds)")
+            await db.commit()
+            await db.execute("ANALYZE")
+            if vacuum:
+                await db.execute("VACUUM")
+
+    async def stats(self) -> dict:
+        async with self._connect() as db:
+            tables = {}
+            for table in ("guilds", *GUILD_TABLES):
+                async with db.execute(f"SELECT COUNT(*) FROM {table}") as cur:
+                    tables[table] = (await cur.fetchone())[0]
+            async with db.execute("SELECT COUNT(*) FROM guilds WHERE removed_at IS NOT NULL") as cur:
+                pending = (await cur.fetchone())[0]
+            async with db.execute("SELECT page_count * page_size FROM pragma_page_count(), pragma_page_size()") as cur:
+                size = (await cur.fetchone())[0]
+        return {"size": size, "tables": tables, "pending_purge": pending}
+
+
+class PostgresStorage(Storage):
+    """asyncpg-backed storage with a connection pool, for multi-process deployments.
+
+    Config writes are announced on a NOTIFY channel so every process drops its
+    cached formatter for that guild. If the LISTEN connection drops it is
+    re-opened with backoff, and since notifications sent in the gap are lost,
+    all cached formatters are dropped once it is back.
+    """
+
+    NOTIFY_CHANNEL = "rolebot_config"
+
+    def __init__(self, dsn: str, min_size: int = 1, max_size: int = 10):
+        self.dsn = dsn
+        self.min_size = min_size
+        self.max_size = max_size
+        self.pool = None
+        self._listener = None
+        self._relisten: asyncio.Task | None = None
+        self._closing = False
+
+    async def init(self):
+        if asyncpg is None:
+            raise RuntimeError("DATABASE_URL is set but asyncpg is not installed")
+        if self.pool:
+            return
+        self.pool = await asyncpg.create_pool(self.dsn, min_size=self.min_size, max_size=self.max_size)
+        async with self.pool.acquire() as conn:
+            await conn.execute("""
+                CREATE TABLE IF NOT EXISTS guilds (
+                    guild_id        BIGINT PRIMARY KEY,
+                    staff_role_id   BIGINT,
+                    tag_prefix      TEXT DEFAULT '[',
+                    tag_suffix      TEXT DEFAULT '] ',
+                    tag_position    TEXT DEFAULT 'prefix',
+                    tag_truncate    TEXT DEFAULT 'name',
+                    log_channel_id  BIGINT,
+                    created_at      TIMESTAMPTZ DEFAULT now(),
+                    removed_at      TIMESTAMPTZ
+                );
+                ALTER TABLE guilds ADD COLUMN IF NOT EXISTS removed_at TIMESTAMPTZ;
+                CREATE TABLE IF NOT EXISTS tag_roles (
+                    id          BIGSERIAL PRIMARY KEY,
+                    guild_id    BIGINT NOT NULL REFERENCES guilds(guild_id) ON DELETE CASCADE,
+                    role_id     BIGINT NOT NULL,
+                    abbreviation TEXT,
+                    emoji       TEXT,
+                    UNIQUE(guild_id, role_id)
+                );
+                CREATE TABLE IF NOT EXISTS excluded_channels (
+                    id          BIGSERIAL PRIMARY KEY,
+                    guild_id    BIGINT NOT NULL REFERENCES guilds(guild_id) ON DELETE CASCADE,
+                    channel_id  BIGINT NOT NULL,
+                    UNIQUE(guild_id, channel_id)
+                );
+                CREATE TABLE IF NOT EXISTS excluded_categories (
+                    id          BIGSERIAL PRIMARY KEY,
+                    guild_id    BIGINT NOT NULL REFERENCES guilds(guild_id) ON DELETE CASCADE,
+                    category_id BIGINT NOT NULL,
+                    UNIQUE(guild_id, category_id)
+                );
+                CREATE TABLE IF NOT EXISTS tag_formats (
+                    id          BIGSERIAL PRIMARY KEY,
+                    guild_id    BIGINT NOT NULL REFERENCES guilds(guild_id) ON DELETE CASCADE,
+                    prefix      TEXT NOT NULL,
+                    suffix      TEXT NOT NULL,
+                    position    TEXT NOT NULL,
+                    UNIQUE(guild_id, prefix, suffix, position)
+                );
+                CREATE TABLE IF NOT EXISTS member_snapshots (
+                    guild_id    BIGINT PRIMARY KEY REFERENCES guilds(guild_id) ON DELETE CASCADE,
+                    data        BYTEA NOT NULL,
+                    taken_at    TIMESTAMPTZ DEFAULT now()
+                );
+            """)
+        await self._listen()
+
+    async def _listen(self):
+        self._listener = await asyncpg.connect(self.dsn)
+        self._listener.add_termination_listener(self._on_listener_lost)
+        await self._listener.add_listener(self.NOTIFY_CHANNEL, self._on_notify)
+
+    def _on_listener_lost(self, _conn):
+        if self._closing or (self._relisten and not self._relisten.done()):
+            return
+        logger.warning("Config listener connection lost — reconnecting", extra=log_fields("db_listen"))
+        self._relisten = spawn(self._reconnect_listener(), "db_relisten")
+
+    async def _reconnect_listener(self, max_delay: float = 60.0):
+        delay = 1.0
+        while not self._closing:
+            try:
+                await self._listen()
+            except (OSError, asyncpg.PostgresError) as e:
+                logger.warning("Config listener reconnect failed: %s", e, extra=log_fields("db_listen"))
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, max_delay)
+                continue
+            _tag_formatters.clear()  # Invalidations sent while disconnected were missed
+            logger.info("Config listener reconnected", extra=log_fields("db_listen"))
+            return
+
+    async def close(self):
+        self._closing = True
+        if self._relisten:
+            self._relisten.cancel()
+        if self._listener:
+            await self._listener.close()
+        if self.pool:
+            await self.pool.close()
+
+    def _on_notify(self, _conn, _pid, _channel, payload: str):
+        invalidate_tag_formatter(int(payload))
+
+    async def _notify(self, conn, guild_id: int):
+        await conn.execute("SELECT pg_notify($1, $2)", self.NOTIFY_CHANNEL, str(guild_id))
+
+    async def ensure_guild(self, guild_id: int):
+        await self.pool.execute(
+            "INSERT INTO guilds (guild_id) VALUES ($1) ON CONFLICT (guild_id) DO UPDATE SET removed_at = NULL", guild_id
+        )
+
+    async def get_guild_config(self, guild_id: int) -> dict | None:
+        row = await self.pool.fetchrow(
+            "SELECT staff_role_id, tag_prefix, tag_suffix, log_channel_id, tag_position, tag_truncate "
+            "FROM guilds WHERE guild_id = $1",
+            guild_id
+        )
+        if not row:
+            return None
+        return {
+            "staff_role_id": row[0],
+            "prefix": row[1],
+            "suffix": row[2],
+            "log_channel_id": row[3],
+            "position": row[4] or "prefix",
+            "truncate": row[5] or "name"
+        }
+
+    async def set_staff_role(self, guild_id: int, role_id: int):
+        await self.pool.execute(
+            "INSERT INTO guilds (guild_id, staff_role_id) VALUES ($1, $2) "
+            "ON CONFLICT (guild_id) DO UPDATE SET staff_role_id = excluded.staff_role_id",
+            guild_id, role_id
+        )
+
+    async def set_tag_format(self, guild_id: int, prefix: str, suffix: str, position: str, truncate: str):
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                previous = await conn.fetchrow(
+                    "SELECT tag_prefix, tag_suffix, tag_position FROM guilds WHERE guild_id = $1 FOR UPDATE", guild_id
+                )
+                await conn.execute(
+                    "INSERT INTO guilds (guild_id, tag_prefix, tag_suffix, tag_position, tag_truncate) "
+                    "VALUES ($1, $2, $3, $4, $5) "
+                    "ON CONFLICT (guild_id) DO UPDATE SET tag_prefix = excluded.tag_prefix, "
+                    "tag_suffix = excluded.tag_suffix, tag_position = excluded.tag_position, "
+                    "tag_truncate = excluded.tag_truncate",
+                    guild_id, prefix, suffix, position, truncate
+                )
+                formats = [(prefix, suffix, position)]
+                if previous:
+                    formats.append((previous[0], previous[1], previous[2] or "prefix"))
+                await conn.executemany(
+                    "INSERT INTO tag_formats (guild_id, prefix, suffix, position) VALUES ($1, $2, $3, $4) "
+                    "ON CONFLICT DO NOTHING",
+                    [(guild_id, *fmt) for fmt in formats]
+                )
+                await self._notify(conn, guild_id)
+
+    async def get_tag_formats(self, guild_id: int) -> list[tuple[str, str, str]]:
+        rows = await self.pool.fetch("SELECT prefix, suffix, position FROM tag_formats WHERE guild_id = $1", guild_id)
+        return [tuple(row) for row in rows]
+
+    async def set_log_channel(self, guild_id: int, channel_id: int | None):
+        await self.pool.execute(
+            "INSERT INTO guilds (guild_id, log_channel_id) VALUES ($1, $2) "
+            "ON CONFLICT (guild_id) DO UPDATE SET log_channel_id = excluded.log_channel_id",
+            guild_id, channel_id
+        )
+
+    async def get_log_channel_id(self, guild_id: int) -> int | None:
+        return await self.pool.fetchval("SELECT log_channel_id FROM guilds WHERE guild_id = $1", guild_id)
+
+    async def add_tag_role(self, guild_id: int, role_id: int):
+        async with self.pool.acquire() as conn:
+            await conn.execute(
+                "INSERT INTO tag_roles (guild_id, role_id) VALUES ($1, $2) ON CONFLICT DO NOTHING",
+                guild_id, role_id
+            )
+            await self._notify(conn, guild_id)
+
+    async def remove_tag_role(self, guild_id: int, role_id: int):
+        async with self.pool.acquire() as conn:
+            await conn.execute("DELETE FROM tag_roles WHERE guild_id = $1 AND role_id = $2", guild_id, role_id)
+            await self._notify(conn, guild_id)
+
+    async def set_tag_label(self, guild_id: int, role_id: int, abbreviation: str | None, emoji: str | None) -> bool:
+        async with self.pool.acquire() as conn:
+            status = await conn.execute(
+                "UPDATE tag_roles SET abbreviation = $1, emoji = $2 WHERE guild_id = $3 AND role_id = $4",
+                abbreviation, emoji, guild_id, role_id
+            )
+            await self._notify(conn, guild_id)
+        return status != "UPDATE 0"
+
+    async def get_tag_labels(self, guild_id: int) -> dict[int, tuple[str | None, str | None]]:
+        rows = await self.pool.fetch("SELECT role_id, abbreviation, emoji FROM tag_roles WHERE guild_id = $1", guild_id)
+        return {row[0]: (row[1], row[2]) for row in rows}
+
+    async def add_excluded(self, table: str, guild_id: int, object_id: int):
+        await self.pool.execute(
+            f"INSERT INTO {table} (guild_id, {EXCLUSION_TABLES[table]}) VALUES ($1, $2) ON CONFLICT DO NOTHING",
+            guild_id, object_id
+        )
+
+    async def remove_excluded(self, table: str, guild_id: int, object_id: int):
+        await self.pool.execute(
+            f"DELETE FROM {table} WHERE guild_id = $1 AND {EXCLUSION_TABLES[table]} = $2",
+            guild_id, object_id
+        )
+
+    async def get_excluded_ids(self, table: str, guild_id: int) -> set[int]:
+        rows = await self.pool.fetch(f"SELECT {EXCLUSION_TABLES[table]} FROM {table} WHERE guild_id = $1", guild_id)
+        return {row[0] for row in rows}
+
+    async def save_member_snapshot(self, guild_id: int, data: bytes):
+        await self.pool.execute(
+            "INSERT INTO member_snapshots (guild_id, data, taken_at) VALUES ($1, $2, now()) "
+            "ON CONFLICT (guild_id) DO UPDATE SET data = excluded.data, taken_at = excluded.taken_at",
+            guild_id, data
         )
-        await db.commit()
 
+    async def load_member_snapshot(self, guild_id: int) -> bytes | None:
+        return await self.pool.fetchval("SELECT data FROM member_snapshots WHERE guild_id = $1", guild_id)
+
+    async def mark_guild_removed(self, guild_id: int):
+        await self.pool.execute(
+            "UPDATE guilds SET removed_at = COALESCE(removed_at, now()) WHERE guild_id = $1", guild_id
+        )
 
-async def set_log_channel(guild_id: int, channel_id: int):
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute(
-            "INSERT INTO guilds (guild_id, log_channel_id) VALUES (?, ?) "
-            "ON CONFLICT(guild_id) DO UPDATE SET log_channel_id = excluded.log_channel_id",
-            (guild_id, channel_id)
+    async def reconcile_guilds(self, present: set[int], shard_count: int = 1,
+                               shard_ids: Iterable[int] = (0,)) -> tuple[int, int]:
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                gone = await conn.fetchval(
+                    "WITH gone AS (UPDATE guilds SET removed_at = now() "
+                    "WHERE removed_at IS NULL AND NOT guild_id = ANY($1::bigint[]) "
+                    "AND (guild_id >> 22) % $2 = ANY($3::bigint[]) RETURNING 1) "
+                    "SELECT COUNT(*) FROM gone",
+                    list(present), shard_count, list(shard_ids)
+                )
+                back = await conn.fetchval(
+                    "WITH back AS (INSERT INTO guilds (guild_id) SELECT unnest($1::bigint[]) "
+                    "ON CONFLICT (guild_id) DO UPDATE SET removed_at = NULL WHERE guilds.removed_at IS NOT NULL "
+                    "RETURNING 1) SELECT COUNT(*) FROM back",
+                    list(present)
+                )
+        return gone, back
+
+    async def purge_removed_guilds(self, grace_seconds: float, limit: int) -> list[int]:
+        rows = await self.pool.fetch(
+            "DELETE FROM guilds WHERE guild_id IN ("
+            "SELECT guild_id FROM guilds WHERE removed_at <= now() - make_interval(secs => $1) LIMIT $2"
+            ") RETURNING guild_id",
+            float(grace_seconds), limit
         )
-        await db.commit()
+        return [row[0] for row in rows]
+
+    async def maintain(self, vacuum: bool):
+        tables = ", ".join(("guilds", *GUILD_TABLES))
+        await self.pool.execute(f"VACUUM (ANALYZE) {tables}" if vacuum else f"ANALYZE {tables}")
+
+    async def stats(self) -> dict:
+        async with self.pool.acquire() as conn:
+            tables = {}
+            size = 0
+            for table in ("guilds", *GUILD_TABLES):
+                tables[table] = await conn.fetchval(f"SELECT COUNT(*) FROM {table}")
+                size += await conn.fetchval("SELECT pg_total_relation_size($1::regclass)", table)
+            pending = await conn.fetchval("SELECT COUNT(*) FROM guilds WHERE removed_at IS NOT NULL")
+        return {"size": size, "tables": tables, "pending_purge": pending}
+
+
+def create_storage() -> Storage:
+    if DATABASE_URL:
+        return PostgresStorage(DATABASE_URL, max_size=DB_POOL_SIZE)
+    return SqliteStorage(DB_PATH)
+
+
+storage = create_storage()
+
+
+@timed("db")
+async def init_db():
+    await storage.init()
+
 
+async def close_db():
+    await storage.close()
 
+
+@timed("db")
+async def ensure_guild(guild_id: int):
+    await storage.ensure_guild(guild_id)
+
+
+@timed("db")
+async def get_guild_config(guild_id: int) -> dict | None:
+    return await storage.get_guild_config(guild_id)
+
+
+@timed("db")
+async def set_staff_role(guild_id: int, role_id: int):
+    await storage.set_staff_role(guild_id, role_id)
+    invalidate_tag_formatter(guild_id)
+
+
+@timed("db")
+async def set_tag_format(guild_id: int, prefix: str, suffix: str, position: str, truncate: str):
+    """Store the guild's tag format and remember it so old tags can still be stripped."""
+    await storage.set_tag_format(guild_id, prefix, suffix, position, truncate)
+    invalidate_tag_formatter(guild_id)
+
+
+@timed("db")
+async def get_tag_formats(guild_id: int) -> list[tuple[str, str, str]]:
+    return await storage.get_tag_formats(guild_id)
+
+
+@timed("db")
+async def set_log_channel(guild_id: int, channel_id: int | None):
+    await storage.set_log_channel(guild_id, channel_id)
+
+
+@timed("db")
 async def get_log_channel_id(guild_id: int) -> int | None:
-    async with aiosqlite.connect(DB_PATH) as db:
-        async with db.execute(
-            "SELECT log_channel_id FROM guilds WHERE guild_id = ?", (guild_id,)
-        ) as cur:
-            row = await cur.fetchone()
-            return row[0] if row else None
+    return await storage.get_log_channel_id(guild_id)
 
 
+@timed("db")
 async def add_tag_role(guild_id: int, role_id: int):
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute(
-            "INSERT OR IGNORE INTO tag_roles (guild_id, role_id) VALUES (?, ?)",
-            (guild_id, role_id)
-        )
-        await db.commit()
+    await storage.add_tag_role(guild_id, role_id)
+    invalidate_tag_formatter(guild_id)
 
 
+@timed("db")
 async def remove_tag_role(guild_id: int, role_id: int):
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute(
-            "DELETE FROM tag_roles WHERE guild_id = ? AND role_id = ?",
-            (guild_id, role_id)
-        )
-        await db.commit()
+    await storage.remove_tag_role(guild_id, role_id)
+    invalidate_tag_formatter(guild_id)
+
+
+@timed("db")
+async def set_tag_label(guild_id: int, role_id: int, abbreviation: str | None, emoji: str | None) -> bool:
+    """Set the abbreviation/emoji shown for a tag role. Returns False if the role is not a tag role."""
+    updated = await storage.set_tag_label(guild_id, role_id, abbreviation, emoji)
+    invalidate_tag_formatter(guild_id)
+    return updated
+
 
+@timed("db")
+async def get_tag_labels(guild_id: int) -> dict[int, tuple[str | None, str | None]]:
+    return await storage.get_tag_labels(guild_id)
 
+
+@timed("db")
 async def get_tag_role_ids(guild_id: int) -> set[int]:
-    async with aiosqlite.connect(DB_PATH) as db:
-        cur = await db.execute("SELECT role_id FROM tag_roles WHERE guild_id = ?", (guild_id,))
-        return {row[0] async for row in cur}
+    return set(await storage.get_tag_labels(guild_id))
 
 
+@timed("db")
 async def add_excluded_channel(guild_id: int, channel_id: int):
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute(
-            "INSERT OR IGNORE INTO excluded_channels (guild_id, channel_id) VALUES (?, ?)",
-            (guild_id, channel_id)
-        )
-        await db.commit()
+    await storage.add_excluded("excluded_channels", guild_id, channel_id)
 
 
+@timed("db")
 async def remove_excluded_channel(guild_id: int, channel_id: int):
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute(
-            "DELETE FROM excluded_channels WHERE guild_id = ? AND channel_id = ?",
-            (guild_id, channel_id)
-        )
-        await db.commit()
+    await storage.remove_excluded("excluded_channels", guild_id, channel_id)
 
 
+@timed("db")
 async def get_excluded_channel_ids(guild_id: int) -> set[int]:
-    async with aiosqlite.connect(DB_PATH) as db:
-        cur = await db.execute("SELECT channel_id FROM excluded_channels WHERE guild_id = ?", (guild_id,))
-        return {row[0] async for row in cur}
+    return await storage.get_excluded_ids("excluded_channels", guild_id)
 
 
+@timed("db")
 async def add_excluded_category(guild_id: int, category_id: int):
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute(
-            "INSERT OR IGNORE INTO excluded_categories (guild_id, category_id) VALUES (?, ?)",
-            (guild_id, category_id)
-        )
-        await db.commit()
+    await storage.add_excluded("excluded_categories", guild_id, category_id)
 
 
+@timed("db")
 async def remove_excluded_category(guild_id: int, category_id: int):
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute(
-            "DELETE FROM excluded_categories WHERE guild_id = ? AND category_id = ?",
-            (guild_id, category_id)
-        )
-        await db.commit()
+    await storage.remove_excluded("excluded_categories", guild_id, category_id)
 
 
+@timed("db")
 async def get_excluded_category_ids(guild_id: int) -> set[int]:
-    async with aiosqlite.connect(DB_PATH) as db:
-        cur = await db.execute("SELECT category_id FROM excluded_categories WHERE guild_id = ?", (guild_id,))
-        return {row[0] async for row in cur}
+    return await storage.get_excluded_ids("excluded_categories", guild_id)
+
+
+@timed("db")
+async def save_member_snapshot(guild_id: int, data: bytes):
+    await storage.save_member_snapshot(guild_id, data)
+
+
+@timed("db")
+async def load_member_snapshot(guild_id: int) -> bytes | None:
+    return await storage.load_member_snapshot(guild_id)
+
+
+@timed("db")
+async def mark_guild_removed(guild_id: int):
+    await storage.mark_guild_removed(guild_id)
+
+
+@timed("db")
+async def reconcile_guilds(present: set[int], shard_count: int = 1, shard_ids: Iterable[int] = (0,)) -> tuple[int, int]:
+    return await storage.reconcile_guilds(present, shard_count, shard_ids)
+
+
+@timed("db")
+async def purge_removed_guilds(grace_seconds: float, limit: int) -> list[int]:
+    return await storage.purge_removed_guilds(grace_seconds, limit)
+
+
+@timed("db")
+async def maintain_db(vacuum: bool):
+    await storage.maintain(vacuum)
+
+
+@timed("db")
+async def get_db_stats() -> dict:
+    return await storage.stats()
 
 
 # ────────────────────────────────────────────────
 #                  NICKNAME LOGIC
 # ────────────────────────────────────────────────
 
-async def get_active_tag_role(member: discord.Member) -> discord.Role | None:
-    config = await get_guild_config(member.guild.id)
+NICK_MAX = 32
+TAG_POSITIONS = ("prefix", "suffix")
+TAG_TRUNCATE_MODES = ("name", "tag", "ellipsis")
+
+
+def format_tag_label(role_name: str, abbreviation: str | None, emoji: str | None) -> str:
+    text = abbreviation or role_name
+    return f"{emoji} {text}" if emoji else text
+
+
+class TagFormatter:
+    """A guild's tag format compiled into a renderer and a stripper.
+
+    The stripper recognizes every format the guild has ever used, so a single
+    pass over members migrates nicknames from any old format to the current one.
+    Tag and name are always separated by whitespace, and tags are matched up to
+    a closing text followed by that separator, so labels may contain the closing
+    text. A member's own current tag is removed exactly before any pattern runs.
+    """
+
+    __slots__ = ("prefix", "suffix", "position", "truncate", "labels", "history", "_open", "_close", "_lead", "_trail")
+
+    def __init__(self, prefix: str, suffix: str, position: str, truncate: str,
+                 labels: dict[int, tuple[str | None, str | None]], history: list[tuple[str, str, str]]):
+        self.position = position if position in TAG_POSITIONS else "prefix"
+        self.prefix = prefix
+        # Without a separator there is no telling where the tag ends and the name starts
+        self.suffix = suffix if self.position == "suffix" or suffix[-1:].isspace() else f"{suffix} "
+        self.truncate = truncate if truncate in TAG_TRUNCATE_MODES else "name"
+        self.labels = labels
+        self.history = tuple(tuple(fmt) for fmt in history)
+        self._open = prefix.strip()
+        self._close = suffix.strip()
+
+        leading, trailing, legacy = [], [], []
+        for fmt in {*history, (prefix, suffix, self.position)}:
+            open_, close = fmt[0].strip(), fmt[1].strip()
+            if not open_ and not close:
+                continue  # Nothing to anchor on
+            if fmt[2] == "suffix":
+                trailing.append(self._trail_pattern(open_, close))
+            else:
+                leading.append(self._lead_pattern(open_, close))
+                if close and not fmt[1][-1:].isspace():
+                    # Rendered without a separator before it was required
+                    legacy.append(self._legacy_pattern(open_, close))
+        # Anchored patterns first, so the unanchored legacy ones only catch what they miss
+        leading += legacy
+        self._lead = re.compile(rf"^(?:\s*(?:{'|'.join(leading)}))+\s*") if leading else None
+        self._trail = re.compile(rf"(?:(?:^|\s+)(?:{'|'.join(trailing)}))+$") if trailing else None
+
+    @staticmethod
+    def _lead_pattern(open_: str, close: str) -> str:
+        body = ".*?" if close else r"\S+"
+        return rf"{re.escape(open_)}{body}{re.escape(close)}(?=\s|$)"
+
+    @staticmethod
+    def _trail_pattern(open_: str, close: str) -> str:
+        body = ".*?" if open_ and close else r"\S+?" if close else r"\S+"
+        return rf"{re.escape(open_)}{body}{re.escape(close)}"
+
+    @staticmethod
+    def _legacy_pattern(open_: str, close: str) -> str:
+        close_re = re.escape(close)
+        return rf"{re.escape(open_)}(?:(?!{close_re}).)*?{close_re}"
+
+    def label_for(self, role: discord.Role) -> str:
+        return format_tag_label(role.name, *self.labels.get(role.id, (None, None)))
+
+    def tag_role(self, member: discord.Member) -> discord.Role | None:
+        for role in member.roles:
+            if role.id in self.labels:
+                return role
+        return None
+
+    def strip(self, nick: str) -> str:
+        if self._lead:
+            nick = self._lead.sub("", nick, count=1)
+        if self._trail:
+            nick = self._trail.sub("", nick, count=1)
+        return nick.strip()
+
+    def _compose(self, label: str, name: str) -> str:
+        if self.position == "suffix":
+            return f"{name} {self._open}{label}{self._close}"
+        return f"{self.prefix}{label}{self.suffix}{name}"
+
+    def render(self, label: str, name: str) -> str:
+        proposed = self._compose(label, name)
+        if len(proposed) <= NICK_MAX:
+            return proposed
+        overhead = len(proposed) - len(label) - len(name)
+        if self.truncate == "tag":
+            avail = NICK_MAX - overhead - len(name)
+            if avail > 0:
+                return self._compose(label[:avail].rstrip(), name)
+        avail = NICK_MAX - overhead - len(label)
+        if self.truncate == "ellipsis" and avail > 1:
+            return self._compose(label, f"{name[:avail - 1].rstrip()}…")
+        return self._compose(label, name[:max(avail, 0)].rstrip())[:NICK_MAX]
+
+    def expected(self, current: str, label: str | None, fallback: str = "") -> str:
+        """The nickname for ``current`` with ``label`` (or no tag when None).
+
+        ``fallback`` is the member's own name, used when nothing is left of the
+        nick once the tags are stripped; an empty nick would reset it instead.
+        """
+        if label is not None:
+            tag = self._compose(label, "")
+            if self.position == "suffix" and current.endswith(tag):
+                current = current[:-len(tag)]
+            elif self.position == "prefix" and current.startswith(tag):
+                current = current[len(tag):]
+        name = self.strip(current) or fallback
+        return self.render(label, name).strip() if label is not None else name
+
+    def expected_nick(self, member: discord.Member) -> str:
+        role = self.tag_role(member)
+        return self.expected(
+            member.nick or member.display_name, self.label_for(role) if role else None, member.global_name or member.name
+        )
+
+    def worker_spec(self, guild: discord.Guild) -> tuple:
+        """Everything compute_nick_batch needs, as plain picklable data."""
+        roles = [role for role_id in self.labels if (role := guild.get_role(role_id))]
+        return (
+            self.prefix, self.suffix, self.position, self.truncate, self.history,
+            {role.id: self.label_for(role) for role in roles},
+            {role.id: (role.position, role.id) for role in roles},  # member.roles order
+        )
+
+
+_tag_formatters: dict[int, TagFormatter] = {}
+
+
+def invalidate_tag_formatter(guild_id: int):
+    _tag_formatters.pop(guild_id, None)
+
+
+async def get_tag_formatter(guild_id: int) -> TagFormatter | None:
+    """Return the compiled formatter for a guild, building it on first use."""
+    formatter = _tag_formatters.get(guild_id)
+    if formatter:
+        return formatter
+    config = await get_guild_config(guild_id)
     if not config:
         return None
-    allowed_ids = await get_tag_role_ids(member.guild.id)
-    for role in member.roles:
-        if role.id in allowed_ids:
-            return role
-    return None
+    formatter = TagFormatter(
+        config["prefix"] if config["prefix"] is not None else "[",
+        config["suffix"] if config["suffix"] is not None else "] ",
+        config["position"],
+        config["truncate"],
+        await get_tag_labels(guild_id),
+        await get_tag_formats(guild_id)
+    )
+    _tag_formatters[guild_id] = formatter
+    return formatter
 
 
-async def update_nickname(member: discord.Member, reason: str = "Tag update", force: bool = False):
+async def update_nickname(member: discord.Member, reason: str = "Tag update", force: bool = False, bulk: bool = False):
     if member.bot:
         return False
 
-    config = await get_guild_config(member.guild.id)
-    if not config:
+    formatter = await get_tag_formatter(member.guild.id)
+    if not formatter:
         return False
 
-    current = member.nick or member.display_name
-
-    # Strip ALL existing tags
-    while current.startswith(config["prefix"]):
-        suffix_pos = current.find(config["suffix"])
-        if suffix_pos == -1:
-            break
-        current = current[suffix_pos + len(config["suffix"]):].lstrip()
-
-    # ── FIRST-RUN CLEANUP ─────────────────────────────────────────────────
-    # Catches any [Whatever] prefix set manually with a different format.
-    # Remove after running Refresh All once successfully.
-    # current = re.sub(r"^\[.*?\]\s*", "", current).strip()
-    # ── END FIRST-RUN CLEANUP ─────────────────────────────────────────────
-
-    tag_role = await get_active_tag_role(member)
-
-    if tag_role:
-        proposed = f"{config['prefix']}{tag_role.name}{config['suffix']}{current}"
-        if len(proposed) > 32:
-            avail = 32 - (len(tag_role.name) + len(config["prefix"]) + len(config["suffix"]))
-            proposed = f"{config['prefix']}{tag_role.name}{config['suffix']}{current[:avail].rstrip()}"
-        new_nick = proposed
-    else:
-        new_nick = current
+    new_nick = formatter.expected_nick(member)
 
     if new_nick != (member.nick or member.display_name):
+        started = time.perf_counter()
         try:
-            await member.edit(nick=new_nick[:32], reason=reason)
-            logger.info(f"Nickname updated | {member} | '{member.nick or member.display_name}' → '{new_nick}' | Reason: {reason}")
+            await api_limiter.call(
+                "member_edit", member_route(member), lambda: member.edit(nick=new_nick[:NICK_MAX], reason=reason), bulk
+            )
+            logger.info(
+                "Nickname updated | %s | '%s' → '%s' | Reason: %s", member, member.nick or member.display_name, new_nick, reason,
+                extra=log_fields("nickname_updated", member.guild.id, member.id, (time.perf_counter() - started) * 1000)
+            )
             await log_to_channel(
                 member.guild,
                 f"✏️ **Nickname Updated**\n"
                 f"**User:** {member.mention}\n"
                 f"**Before:** `{member.nick or member.display_name}`\n"
-                f"**After:** `{new_nick[:32]}`\n"
+                f"**After:** `{new_nick[:NICK_MAX]}`\n"
                 f"**Reason:** {reason}",
                 LOG_GREEN
             )
             return True
-        except Exception as e:
-            logger.error(f"Nickname update failed | {member} | {e}")
+        except (discord.HTTPException, aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.error(
+                "Nickname update failed | %s | %s", member, describe_error(e),
+                extra=log_fields("nickname_failed", member.guild.id, member.id, (time.perf_counter() - started) * 1000)
+            )
             await log_to_channel(
                 member.guild,
                 f"⚠️ **Nickname Update Failed**\n"
                 f"**User:** {member.mention}\n"
-                f"**Error:** {e}",
+                f"**Error:** {describe_error(e)}",
                 LOG_RED
             )
     return False
 
 
-# ────────────────────────────────────────────────
-#                  CATEGORY SYNC LOGIC
-# ────────────────────────────────────────────────
+# ────────────────────────────────────────────────
+#                  NICKNAME WORKERS
+# ────────────────────────────────────────────────
+
+# Reconciling a large guild means stripping, resolving and rendering a nickname
+# for every member. From NICK_POOL_THRESHOLD members up, that pure work runs in
+# a pool of NICK_WORKERS processes (0 keeps it inline), so heartbeats and
+# interactions are not starved. The loop only packs compact batches of
+# (member_id, nick, name, role_ids) and gets back the members whose nickname must change.
+NICK_WORKERS = int(os.getenv("NICK_WORKERS", str(min(4, os.cpu_count() or 1))))
+NICK_POOL_THRESHOLD = int(os.getenv("NICK_POOL_THRESHOLD", "20000"))
+NICK_BATCH_SIZE = 5000
+
+_nick_pool: ProcessPoolExecutor | None = None
+
+
+def nick_pool() -> ProcessPoolExecutor:
+    global _nick_pool
+    if _nick_pool is None:
+        _nick_pool = ProcessPoolExecutor(max_workers=NICK_WORKERS)
+        atexit.register(_nick_pool.shutdown, cancel_futures=True)
+    return _nick_pool
+
+
+@functools.lru_cache(maxsize=8)
+def _worker_formatter(prefix: str, suffix: str, position: str, truncate: str,
+                      history: tuple[tuple[str, str, str], ...]) -> TagFormatter:
+    return TagFormatter(prefix, suffix, position, truncate, {}, list(history))
+
+
+def expected_batch(spec: tuple, member_ids: array, currents: list[str], names: list[str], role_ids: array,
+                   offsets: array) -> Iterator[tuple[int, int, str, str]]:
+    """Yield (member_id, tag_role_id or 0, current nick, expected nick) for a packed batch.
+
+    Only touches plain data, so it can run in a worker process: ``spec`` comes from
+    TagFormatter.worker_spec and member i's roles are role_ids[offsets[i]:offsets[i + 1]].
+    """
+    *fmt, labels, ranks = spec
+    formatter = _worker_formatter(*fmt)
+    for i, member_id in enumerate(member_ids):
+        tagged = [r for r in role_ids[offsets[i]:offsets[i + 1]] if r in labels]
+        role_id = min(tagged, key=ranks.__getitem__) if tagged else 0
+        current = currents[i]
+        label = labels[role_id] if role_id else None
+        yield member_id, role_id, current, formatter.expected(current, label, names[i])[:NICK_MAX]
+
+
+def compute_nick_batch(spec: tuple, member_ids: array, currents: list[str], names: list[str], role_ids: array,
+                       offsets: array) -> list[tuple[int, str]]:
+    """Return (member_id, nick) for each member in the batch whose nickname must change."""
+    return [
+        (member_id, expected)
+        for member_id, _, current, expected in expected_batch(spec, member_ids, currents, names, role_ids, offsets)
+        if expected != current
+    ]
+
+
+def pack_members(members: list[discord.Member]) -> tuple[array, list[str], list[str], array, array]:
+    member_ids = array("Q")
+    currents = []
+    names = []
+    role_ids = array("Q")
+    offsets = array("I", [0])
+    for member in members:
+        member_ids.append(member.id)
+        currents.append(member.nick or member.display_name)
+        names.append(member.global_name or member.name)
+        role_ids.extend(member._roles)  # Raw ID array; member.roles builds and sorts Role objects
+        offsets.append(len(role_ids))
+    return member_ids, currents, names, role_ids, offsets
+
+
+async def pack_batches(
+    members: list[discord.Member]
+) -> AsyncIterator[tuple[array, list[str], list[str], array, array]]:
+    for start in range(0, len(members), NICK_BATCH_SIZE):
+        yield pack_members(members[start:start + NICK_BATCH_SIZE])
+        await asyncio.sleep(0)  # Let gateway traffic through between batches
+
+
+async def nickname_changes(guild: discord.Guild, formatter: TagFormatter,
+                           members: list[discord.Member]) -> list[tuple[discord.Member, str]]:
+    """Members whose nickname differs from what the formatter expects, with the expected nickname."""
+    if NICK_WORKERS > 0 and len(members) >= NICK_POOL_THRESHOLD:
+        started = time.perf_counter()
+        spec = formatter.worker_spec(guild)
+        loop = asyncio.get_running_loop()
+        futures = []
+        try:
+            async for batch in pack_batches(members):
+                futures.append(loop.run_in_executor(nick_pool(), compute_nick_batch, spec, *batch))
+            results = await asyncio.gather(*futures)
+        except (BrokenProcessPool, OSError) as e:
+            logger.warning("Nickname worker pool failed, computing inline: %s", e, extra=log_fields("nick_workers", guild.id))
+        else:
+            changes = [
+                (member, nick) for batch in results for member_id, nick in batch
+                if (member := guild.get_member(member_id)) is not None
+            ]
+            logger.info(
+                "Nickname diff | %s | %d members, %d to change, %d batches", guild.name, len(members), len(changes),
+                len(futures), extra=log_fields("nick_workers", guild.id, latency_ms=(time.perf_counter() - started) * 1000)
+            )
+            return changes
+
+    changes = []
+    for member in members:
+        expected = formatter.expected_nick(member)[:NICK_MAX]
+        if expected != (member.nick or member.display_name):
+            changes.append((member, expected))
+    return changes
+
+
+# ────────────────────────────────────────────────
+#                  MEMBER SNAPSHOTS
+# ────────────────────────────────────────────────
+
+# A compact per-guild record of which tag role and nickname each member carries
+# once reconciled, used for reconciliation and diffing. At ~14 bytes per member plus nickname
+# text it is an order of magnitude smaller than a dict of discord objects.
+
+SNAPSHOT_MAGIC = b"RBS1"
+SNAPSHOT_HEADER = struct.Struct("<4sIII")  # magic, members, tag roles, pooled nicknames
+
+
+def _le(arr: array) -> array:
+    """Arrays are stored little-endian regardless of host byte order."""
+    if sys.byteorder == "big":
+        arr = array(arr.typecode, arr)
+        arr.byteswap()
+    return arr
+
+
+class MemberSnapshot:
+    """Sorted member IDs with a parallel tag index and pooled nickname strings.
+
+    ``member_ids`` is a sorted ``array('Q')``; ``tags[i]`` indexes ``tag_role_ids``
+    (0 = no tag) and ``nicks[i]`` indexes the nickname pool (0 = no nickname).
+    Nicknames are deduplicated and stored as one UTF-8 buffer with offsets.
+    """
+
+    __slots__ = ("member_ids", "tags", "nicks", "tag_role_ids", "pool", "offsets")
+
+    def __init__(self, member_ids: array, tags: array, nicks: array, tag_role_ids: array, pool: bytes, offsets: array):
+        self.member_ids = member_ids
+        self.tags = tags
+        self.nicks = nicks
+        self.tag_role_ids = tag_role_ids
+        self.pool = pool
+        self.offsets = offsets
+
+    @classmethod
+    def build(cls, entries: Iterable[tuple[int, int | None, str | None]]) -> "MemberSnapshot":
+        """Build from ``(member_id, tag_role_id, nick)`` tuples in any order."""
+        rows = sorted(entries)
+        tag_slots: dict[int, int] = {}
+        nick_slots: dict[str, int] = {}
+        tag_role_ids = array("Q")
+        pool = bytearray()
+        offsets = array("I", [0])
+        member_ids = array("Q")
+        tags = array("H")
+        nicks = array("I")
+        for member_id, tag_role_id, nick in rows:
+            member_ids.append(member_id)
+            if tag_role_id:
+                slot = tag_slots.get(tag_role_id)
+                if slot is None:
+                    tag_role_ids.append(tag_role_id)
+                    slot = tag_slots[tag_role_id] = len(tag_role_ids)
+                tags.append(slot)
+            else:
+                tags.append(0)
+            if nick:
+                slot = nick_slots.get(nick)
+                if slot is None:
+                    pool += nick.encode()
+                    offsets.append(len(pool))
+                    slot = nick_slots[nick] = len(offsets) - 1
+                nicks.append(slot)
+            else:
+                nicks.append(0)
+        return cls(member_ids, tags, nicks, tag_role_ids, bytes(pool), offsets)
+
+    def __len__(self) -> int:
+        return len(self.member_ids)
+
+    def _nick(self, slot: int) -> str | None:
+        if not slot:
+            return None
+        return self.pool[self.offsets[slot - 1]:self.offsets[slot]].decode()
+
+    def _entry(self, index: int) -> tuple[int | None, str | None]:
+        tag = self.tags[index]
+        return (self.tag_role_ids[tag - 1] if tag else None), self._nick(self.nicks[index])
+
+    def find(self, member_id: int) -> int | None:
+        index = bisect_left(self.member_ids, member_id)
+        if index < len(self.member_ids) and self.member_ids[index] == member_id:
+            return index
+        return None
+
+    def get(self, member_id: int) -> tuple[int | None, str | None] | None:
+        """Return ``(tag_role_id, nick)`` for a member, or None if not in the snapshot."""
+        index = self.find(member_id)
+        return None if index is None else self._entry(index)
+
+    def diff(self, newer: "MemberSnapshot") -> Iterator[tuple[int, tuple | None, tuple | None]]:
+        """Yield ``(member_id, before, after)`` for members that joined, left or changed."""
+        i = j = 0
+        old_ids, new_ids = self.member_ids, newer.member_ids
+        while i < len(old_ids) or j < len(new_ids):
+            if j >= len(new_ids) or (i < len(old_ids) and old_ids[i] < new_ids[j]):
+                yield old_ids[i], self._entry(i), None
+                i += 1
+            elif i >= len(old_ids) or new_ids[j] < old_ids[i]:
+                yield new_ids[j], None, newer._entry(j)
+                j += 1
+            else:
+                before, after = self._entry(i), newer._entry(j)
+                if before != after:
+                    yield old_ids[i], before, after
+                i += 1
+                j += 1
+
+    @property
+    def nbytes(self) -> int:
+        arrays = (self.member_ids, self.tags, self.nicks, self.tag_role_ids, self.offsets)
+        return sum(a.itemsize * len(a) for a in arrays) + len(self.pool)
+
+    def to_bytes(self) -> bytes:
+        header = SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, len(self.member_ids), len(self.tag_role_ids), len(self.offsets) - 1)
+        body = b"".join(
+            _le(a).tobytes() for a in (self.member_ids, self.tags, self.nicks, self.tag_role_ids, self.offsets)
+        )
+        return zlib.compress(header + body + self.pool, 1)
+
+    @classmethod
+    def from_bytes(cls, blob: bytes) -> "MemberSnapshot":
+        data = zlib.decompress(blob)
+        magic, members, tag_roles, nick_count = SNAPSHOT_HEADER.unpack_from(data)
+        if magic != SNAPSHOT_MAGIC:
+            raise ValueError("Not a member snapshot")
+        pos = SNAPSHOT_HEADER.size
+        parts = []
+        for typecode, count in (("Q", members), ("H", members), ("I", members), ("Q", tag_roles), ("I", nick_count + 1)):
+            arr = array(typecode)
+            end = pos + arr.itemsize * count
+            arr.frombytes(data[pos:end])
+            parts.append(_le(arr))
+            pos = end
+        return cls(*parts[:4], data[pos:], parts[4])
+
+
+_member_snapshots: dict[int, MemberSnapshot] = {}
+
+
+def build_snapshot(spec: tuple, batches: list[tuple], previous: MemberSnapshot | None,
+                   failed: frozenset[int] = frozenset()) -> tuple[bytes, int | None]:
+    """Serialized snapshot of the tag and nickname each packed member carries, and how
+    many members differ from ``previous``. Runs in the nickname worker pool for large guilds.
+
+    Members in ``failed`` keep the nickname they have; everyone else was just set to the
+    expected one, which the member cache may not show yet.
+    """
+    snapshot = MemberSnapshot.build(
+        (member_id, role_id, current if member_id in failed else expected)
+        for batch in batches for member_id, role_id, current, expected in expected_batch(spec, *batch)
+    )
+    changed = None if previous is None else sum(1 for _ in previous.diff(snapshot))
+    return snapshot.to_bytes(), changed
+
+
+async def take_member_snapshot(guild: discord.Guild, failed: Iterable[int] = ()) -> int | None:
+    """Record the guild's current tags and nicknames, in memory and in the DB.
+
+    ``failed`` are members whose nickname update just failed. Returns how many members'
+    tag or nickname changed since the previous snapshot, or None if there was none.
+    """
+    formatter = await get_tag_formatter(guild.id)
+    if not formatter:
+        return None
+    members = [m for m in guild.members if not m.bot]
+    batches = [batch async for batch in pack_batches(members)]
+    args = (formatter.worker_spec(guild), batches, await get_member_snapshot(guild.id), frozenset(failed))
+    result = None
+    if NICK_WORKERS > 0 and len(members) >= NICK_POOL_THRESHOLD:
+        try:
+            result = await asyncio.get_running_loop().run_in_executor(nick_pool(), build_snapshot, *args)
+        except (BrokenProcessPool, OSError) as e:
+            logger.warning("Nickname worker pool failed, snapshotting inline: %s", e, extra=log_fields("snapshot", guild.id))
+    blob, changed = result or build_snapshot(*args)
+    _member_snapshots[guild.id] = MemberSnapshot.from_bytes(blob)
+    await save_member_snapshot(guild.id, blob)
+    return changed
+
+
+async def get_member_snapshot(guild_id: int) -> MemberSnapshot | None:
+    snapshot = _member_snapshots.get(guild_id)
+    if snapshot is None:
+        blob = await load_member_snapshot(guild_id)
+        if blob:
+            snapshot = _member_snapshots[guild_id] = MemberSnapshot.from_bytes(blob)
+    return snapshot
+
+
+# ────────────────────────────────────────────────
+#                  CATEGORY SYNC LOGIC
+# ────────────────────────────────────────────────
+
+async def sync_channel(channel: discord.abc.GuildChannel, category: discord.CategoryChannel, reason: str) -> bool:
+    started = time.perf_counter()
+    try:
+        await api_limiter.call(
+            "channel_edit", channel_route(channel), lambda: channel.edit(sync_permissions=True, reason=reason), bulk=True
+        )
+        logger.info(
+            "Synced #%s → category '%s'", channel.name, category.name,
+            extra=log_fields("channel_synced", category.guild.id, latency_ms=(time.perf_counter() - started) * 1000)
+        )
+        await log_to_channel(
+            category.guild,
+            f"🔒 **Channel Synced**\n"
+            f"**Channel:** #{channel.name}\n"
+            f"**Category:** {category.name}\n"
+            f"**Reason:** {reason}",
+            LOG_GREEN
+        )
+        return True
+    except (discord.HTTPException, aiohttp.ClientError, asyncio.TimeoutError) as e:
+        logger.error(
+            "Failed to sync #%s: %s", channel.name, describe_error(e),
+            extra=log_fields("channel_sync_failed", category.guild.id)
+        )
+        if not is_transient(e):
+            drift_detector.mark_failed(channel)  # Drift resyncs would only fail the same way
+        await log_to_channel(
+            category.guild,
+            f"⚠️ **Channel Sync Failed**\n"
+            f"**Channel:** #{channel.name}\n"
+            f"**Error:** {describe_error(e)}",
+            LOG_RED
+        )
+        return False
+
+
+async def sync_category_channels(category: discord.CategoryChannel, excluded_ids: set[int],
+                                 reason: str = "Category permission sync", progress: "JobProgress | None" = None):
+    synced = 0
+    skipped = 0
+    for channel in category.channels:
+        changed = failed = False
+        if channel.id in excluded_ids:
+            logger.info(
+                "Skipping excluded channel #%s in %s", channel.name, category.name,
+                extra=log_fields("channel_sync_skipped", category.guild.id)
+            )
+            skipped += 1
+        elif not channel.permissions_synced:
+            changed = await sync_channel(channel, category, reason)
+            failed = not changed
+            synced += changed
+        if progress and not await progress.advance(changed, failed):
+            break
+    return synced, skipped
+
+
+async def sync_all_categories(guild: discord.Guild, reason: str = "Full category sync",
+                              progress: "JobProgress | None" = None):
+    excluded_channel_ids = await get_excluded_channel_ids(guild.id)
+    excluded_category_ids = await get_excluded_category_ids(guild.id)
+    total_synced = 0
+    total_skipped = 0
+    for category in guild.categories:
+        if progress and progress.cancelled:
+            break
+        if category.id in excluded_category_ids:
+            logger.info("Skipping excluded category: %s", category.name, extra=log_fields("category_sync_skipped", guild.id))
+            total_skipped += len(category.channels)
+            if progress:
+                await progress.advance(count=len(category.channels))
+            continue
+        synced, skipped = await sync_category_channels(category, excluded_channel_ids, reason, progress)
+        total_synced += synced
+        total_skipped += skipped
+    return total_synced, total_skipped
+
+
+# ────────────────────────────────────────────────
+#                  PAGINATION HELPER
+# ────────────────────────────────────────────────
+
+PAGE_SIZE = 20
+
+
+def paginate(items: list, page: int) -> tuple[list, int, int]:
+    """Return one page of items, the clamped page number and the page count."""
+    total_pages = max(1, (len(items) + PAGE_SIZE - 1) // PAGE_SIZE)
+    page = max(0, min(page, total_pages - 1))
+    start = page * PAGE_SIZE
+    return items[start:start + PAGE_SIZE], page, total_pages
+
+
+# ────────────────────────────────────────────────
+#                  BACKGROUND WORK
+# ────────────────────────────────────────────────
+
+# Strong references so pending tasks are not garbage collected mid-run
+background_tasks: set[asyncio.Task] = set()
+
+
+def spawn(coro, name: str) -> asyncio.Task:
+    task = asyncio.create_task(coro, name=name)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+
+def finish_in_background(interaction: discord.Interaction, work, failure: str, action: str) -> asyncio.Task:
+    """Run a settings change's DB write and log sends after the interaction has been answered.
+
+    Callbacks validate and respond first so they stay inside Discord's 3 second
+    window; if the deferred work fails the user is told through a followup.
+    """
+    async def runner():
+        try:
+            await work
+        except Exception as e:
+            logger.error("%s: %s", failure, e, extra=log_fields(action, interaction.guild_id, interaction.user.id))
+            try:
+                await interaction.followup.send(f"⚠️ {failure}", ephemeral=True)
+            except discord.HTTPException:
+                pass
+    return spawn(runner(), f"{action}:{interaction.id}")
+
+
+class JobQueue(ABC):
+    """Deduplicated FIFO of jobs drained one at a time by a background worker.
+
+    Keys are ``(guild_id, ...)`` tuples; a job whose key is already waiting in the
+    queue is dropped. A key is released as soon as its job starts, so a submit
+    during the run queues a fresh job that sees the newer state.
+    """
+
+    name = "job_queue"
+
+    def __init__(self):
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.pending: set[tuple] = set()
+        self.worker: asyncio.Task | None = None
+
+    def put(self, key: tuple, job) -> bool:
+        if key in self.pending:
+            return False
+        self.pending.add(key)
+        self.queue.put_nowait((key, job))
+        if self.worker is None or self.worker.done():
+            self.worker = spawn(self._run(), self.name)
+        return True
+
+    async def _run(self):
+        while True:
+            key, job = await self.queue.get()
+            self.pending.discard(key)
+            try:
+                await self.process(job)
+            except Exception as e:
+                logger.error("Background job failed | %s | %s", self.name, e, extra=log_fields(self.name, key[0]))
+            finally:
+                self.queue.task_done()
+
+    @abstractmethod
+    async def process(self, job):
+        raise NotImplementedError
+
+
+# ────────────────────────────────────────────────
+#                  JOB PROGRESS
+# ────────────────────────────────────────────────
+
+# Long jobs (bulk refresh, category sync, targeted refresh) report through a
+# JobProgress: a status embed with Pause/Resume and Cancel buttons, edited every
+# PROGRESS_INTERVAL seconds, or sooner once another PROGRESS_STEP of the job is
+# done, but never more than once per PROGRESS_MIN_INTERVAL. Edits are awaited in
+# the job loop, so the floor keeps small fast jobs from being paced by the
+# webhook edit rate limit. The embed
+# starts as an ephemeral followup. Interaction tokens die after 15 minutes, so
+# before that, or as soon as an edit fails, it moves to a message in the channel
+# the job was started from.
+PROGRESS_INTERVAL = 2.0
+PROGRESS_MIN_INTERVAL = 1.0
+PROGRESS_STEP = 0.01
+TOKEN_LIFETIME = 14 * 60  # seconds; hand over a minute before Discord's limit
+
+running_jobs: dict[int, "JobProgress"] = {}
+
+
+def format_duration(seconds: float) -> str:
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02}:{seconds:02}" if hours else f"{minutes}:{seconds:02}"
+
+
+class JobProgress:
+    def __init__(self, title: str, guild: discord.Guild, total: int, interaction: discord.Interaction | None = None,
+                 detail: str = "", changed_label: str = "Updated"):
+        self.id = random.getrandbits(32)
+        self.title = title
+        self.guild = guild
+        self.total = total
+        self.interaction = interaction
+        self.detail = detail
+        self.changed_label = changed_label
+        self.processed = self.changed = self.failed = 0
+        self.cancelled = False
+        self.resumed = asyncio.Event()
+        self.resumed.set()
+        self.message: discord.Message | None = None
+        self.in_channel = False
+        self.started = time.monotonic()
+        self.paused_total = 0.0
+        self.paused_at: float | None = None
+        self.last_publish = 0.0
+        self.last_processed = 0
+        running_jobs[self.id] = self
+
+    @property
+    def active_time(self) -> float:
+        paused = self.paused_total + (time.monotonic() - self.paused_at if self.paused_at else 0)
+        return time.monotonic() - self.started - paused
+
+    @property
+    def paused(self) -> bool:
+        return not self.resumed.is_set()
+
+    async def advance(self, changed: bool = False, failed: bool = False, count: int = 1, wait: bool = True) -> bool:
+        """Count processed items; blocks while paused (unless ``wait`` is False) and returns False once cancelled."""
+        self.processed += count
+        self.changed += changed
+        self.failed += failed
+        since = time.monotonic() - self.last_publish
+        if since >= PROGRESS_INTERVAL or (
+                since >= PROGRESS_MIN_INTERVAL and self.processed - self.last_processed >= self.total * PROGRESS_STEP):
+            await self.publish()
+        if wait and not self.resumed.is_set():
+            await self.resumed.wait()
+        return not self.cancelled
+
+    def pause(self):
+        if self.resumed.is_set() and not self.cancelled:
+            self.resumed.clear()
+            self.paused_at = time.monotonic()
+
+    def resume(self):
+        if self.paused_at is not None:
+            self.paused_total += time.monotonic() - self.paused_at
+            self.paused_at = None
+        self.resumed.set()
+
+    def cancel(self):
+        self.cancelled = True
+        self.resume()
+
+    def embed(self, done: bool = False) -> discord.Embed:
+        if done:
+            state, color = ("Cancelled", LOG_YELLOW) if self.cancelled else ("Complete", LOG_GREEN)
+        else:
+            state, color = ("Paused", LOG_YELLOW) if not self.resumed.is_set() else ("Running", LOG_BLUE)
+        elapsed = self.active_time
+        rate = self.processed / elapsed if elapsed > 0 else 0.0
+        lines = [self.detail] if self.detail else []
+        lines.append(f"**Progress:** {self.processed}/{self.total} ({self.processed / max(self.total, 1):.0%})")
+        lines.append(f"**{self.changed_label}:** {self.changed} · **Failed:** {self.failed}")
+        if done:
+            lines.append(f"**Took:** {format_duration(elapsed)} · **Rate:** {rate:.1f}/s")
+        else:
+            eta = format_duration((self.total - self.processed) / rate) if rate else "—"
+            lines.append(f"**Rate:** {rate:.1f}/s · **ETA:** {eta}")
+        return discord.Embed(
+            title=f"{self.title} — {state}",
+            description="\n".join(lines),
+            color=color,
+            timestamp=datetime.now(timezone.utc)
+        )
+
+    def controls(self) -> TimedView:
+        view = TimedView(timeout=None)
+        toggle = "resume" if not self.resumed.is_set() else "pause"
+        view.add_item(JobControlButton(self.guild.id, self.id, toggle))
+        view.add_item(JobControlButton(self.guild.id, self.id, "cancel"))
+        return view
+
+    async def publish(self, done: bool = False):
+        self.last_publish = time.monotonic()
+        self.last_processed = self.processed
+        if self.interaction is None:
+            return
+        embed, view = self.embed(done), None if done else self.controls()
+        token_age = (discord.utils.utcnow() - self.interaction.created_at).total_seconds()
+        if not self.in_channel and token_age > TOKEN_LIFETIME:
+            await self._move_to_channel(embed, view, handover=True)
+            return
+        try:
+            if self.message is None:
+                self.message = await self.interaction.followup.send(embed=embed, view=view, ephemeral=True, wait=True)
+            else:
+                await self.message.edit(embed=embed, view=view)
+        except discord.HTTPException as e:
+            if self.in_channel:
+                logger.warning("Job status update failed | %s | %s", self.title, e, extra=log_fields("job_progress", self.guild.id))
+            else:
+                await self._move_to_channel(embed, view)
+
+    async def _move_to_channel(self, embed: discord.Embed, view: TimedView | None, handover: bool = False):
+        self.in_channel = True
+        channel = self.interaction.channel
+        if handover and self.message is not None and channel is not None:
+            try:
+                await self.message.edit(
+                    embed=discord.Embed(description=f"Status continues in {channel.mention}.", color=LOG_BLUE), view=None
+                )
+            except discord.HTTPException:
+                pass
+        self.message = None
+        if channel is None:
+            return
+        try:
+            self.message = await channel.send(embed=embed, view=view)
+        except discord.HTTPException as e:
+            logger.warning(
+                "No channel to report job status in | %s | %s", self.title, e,
+                extra=log_fields("job_progress", self.guild.id)
+            )
+
+    async def finish(self):
+        running_jobs.pop(self.id, None)
+        await self.publish(done=True)
+
+
+# ────────────────────────────────────────────────
+#                  TARGETED REFRESH
+# ────────────────────────────────────────────────
+
+# Adding or removing a tag role only affects members who hold that role, so
+# instead of a whole-guild refresh a job walks role.members. Jobs run one at a
+# time on a background worker, paced to REFRESH_EDITS_PER_SECOND nickname edits.
+# The worker is shared by every guild, so a paused job hands it back and the
+# rest of its members are requeued on resume; one left paused for
+# JOB_PAUSE_TIMEOUT seconds is cancelled.
+REFRESH_EDITS_PER_SECOND = float(os.getenv("REFRESH_EDITS_PER_SECOND", "2"))
+JOB_PAUSE_TIMEOUT = 30 * 60
+
+
+class RefreshJob:
+    __slots__ = ("guild", "role_id", "reason", "interaction", "members", "progress", "started")
+
+    def __init__(self, guild: discord.Guild, role_id: int, reason: str, interaction: discord.Interaction | None):
+        self.guild = guild
+        self.role_id = role_id
+        self.reason = reason
+        self.interaction = interaction
+        self.members: deque[discord.Member] = deque()  # Still to check, once started
+        self.progress: JobProgress | None = None
+        self.started = 0.0
+
+    @property
+    def key(self) -> tuple[int, int]:
+        return self.guild.id, self.role_id
+
+
+class RefreshQueue(JobQueue):
+    name = "role_refresh"
+
+    def __init__(self, edits_per_second: float):
+        super().__init__()
+        self.interval = 1 / edits_per_second if edits_per_second > 0 else 0
+
+    def submit(self, guild: discord.Guild, role_id: int, reason: str,
+               interaction: discord.Interaction | None = None) -> bool:
+        """Queue a refresh of one role's members. Returns False if one is already queued."""
+        job = RefreshJob(guild, role_id, reason, interaction)
+        return self.put(job.key, job)
+
+    async def process(self, job: RefreshJob):
+        role = job.guild.get_role(job.role_id)
+        mention = f"<@&{job.role_id}>"
+        if job.progress is None:
+            if role is None or await get_tag_formatter(job.guild.id) is None:
+                return
+            job.members.extend(m for m in role.members if not m.bot)
+            job.started = time.perf_counter()
+            job.progress = JobProgress(
+                "Refreshing nicknames", job.guild, len(job.members), job.interaction, f"**Role:** {mention}"
+            )
+            await job.progress.publish()
+        progress = job.progress
+
+        while job.members and not progress.cancelled:
+            if progress.paused:
+                spawn(self._requeue_on_resume(job), f"{self.name}:paused:{progress.id}")
+                return
+            member = job.members.popleft()
+            changed = failed = False
+            # Tag roles may change while the job runs; always compare against the current config
+            formatter = await get_tag_formatter(job.guild.id)
+            if formatter is None:
+                break
+            if formatter.expected_nick(member) != (member.nick or member.display_name):
+                changed = await update_nickname(member, job.reason, bulk=True)
+                failed = not changed
+                await asyncio.sleep(self.interval)
+            await progress.advance(changed, failed, wait=False)
+
+        await progress.finish()
+        logger.info(
+            "Role refresh | %s | %s | %d/%d members, %d changed, %d failed%s", job.guild.name,
+            role.name if role else job.role_id, progress.processed, progress.total, progress.changed, progress.failed,
+            " (cancelled)" if progress.cancelled else "",
+            extra=log_fields("role_refresh", job.guild.id, latency_ms=(time.perf_counter() - job.started) * 1000)
+        )
+        await log_to_channel(
+            job.guild,
+            f"🔄 **Tag Role Refresh**{' (cancelled)' if progress.cancelled else ''}\n"
+            f"**Role:** {mention}\n"
+            f"**Members checked:** {progress.processed}/{progress.total}\n"
+            f"**Nicknames updated:** {progress.changed}\n"
+            f"**Failed:** {progress.failed}",
+            LOG_BLUE
+        )
+
+
+    async def _requeue_on_resume(self, job: RefreshJob):
+        try:
+            await asyncio.wait_for(job.progress.resumed.wait(), JOB_PAUSE_TIMEOUT)
+        except asyncio.TimeoutError:
+            job.progress.cancel()  # Finishes the job so its status message is closed
+        # Own key: a fresh submit for the same role may be queued meanwhile
+        self.put((*job.key, job.progress.id), job)
+
+
+refresh_queue = RefreshQueue(REFRESH_EDITS_PER_SECOND)
+
+
+# ────────────────────────────────────────────────
+#                  NICKNAME ENFORCEMENT
+# ────────────────────────────────────────────────
+
+# A member who renames themselves can drop or forge their tag. Nick edits are
+# checked against the formatter's expected nickname (a cached regex pass, no DB
+# read) and mismatches are corrected through a paced queue. A member corrected
+# less than NICK_ENFORCE_COOLDOWN seconds ago is not corrected again straight
+# away; one deferred check runs when the cooldown ends, so someone who keeps
+# editing their nick costs at most one edit per cooldown.
+NICK_ENFORCE_PER_SECOND = float(os.getenv("NICK_ENFORCE_PER_SECOND", "1"))
+NICK_ENFORCE_COOLDOWN = float(os.getenv("NICK_ENFORCE_COOLDOWN", "300"))
+
+
+class NickEnforcer(JobQueue):
+    name = "nick_enforce"
+
+    def __init__(self, edits_per_second: float, cooldown: float):
+        super().__init__()
+        self.interval = 1 / edits_per_second if edits_per_second > 0 else 0
+        self.cooldown = cooldown
+        self.last_corrected: dict[tuple[int, int], float] = {}
+        self.deferred: dict[tuple[int, int], asyncio.TimerHandle] = {}
+
+    def check(self, member: discord.Member, formatter: TagFormatter) -> bool:
+        """Queue a correction if the member's nick doesn't match. Returns True if it was queued."""
+        if member.bot or formatter.expected_nick(member)[:NICK_MAX] == (member.nick or member.display_name):
+            return False
+        key = (member.guild.id, member.id)
+        if key in self.deferred:
+            return False
+        remaining = self.last_corrected.get(key, -self.cooldown) + self.cooldown - time.monotonic()
+        if remaining > 0:
+            logger.info(
+                "Nickname enforcement on cooldown | %s | recheck in %.0fs", member, remaining,
+                extra=log_fields("nick_enforce_cooldown", member.guild.id, member.id)
+            )
+            self.deferred[key] = asyncio.get_running_loop().call_later(remaining, self._recheck, member.guild, member.id)
+            return False
+        return self.put(key, member)
+
+    def _recheck(self, guild: discord.Guild, member_id: int):
+        self.deferred.pop((guild.id, member_id), None)
+        member = guild.get_member(member_id)
+        if member is not None:
+            self.put((guild.id, member_id), member)
+
+    async def process(self, member: discord.Member):
+        member = member.guild.get_member(member.id)  # Latest state; they may have left
+        formatter = await get_tag_formatter(member.guild.id) if member else None
+        if formatter is None or formatter.expected_nick(member)[:NICK_MAX] == (member.nick or member.display_name):
+            return
+        now = time.monotonic()
+        self.last_corrected[(member.guild.id, member.id)] = now
+        if len(self.last_corrected) > 10_000:
+            self.last_corrected = {k: t for k, t in self.last_corrected.items() if now - t < self.cooldown}
+        await update_nickname(member, "Nickname enforcement", bulk=True)
+        await asyncio.sleep(self.interval)
+
+
+nick_enforcer = NickEnforcer(NICK_ENFORCE_PER_SECOND, NICK_ENFORCE_COOLDOWN)
+
+
+# ────────────────────────────────────────────────
+#                  PERMISSION DRIFT
+# ────────────────────────────────────────────────
+
+# Each channel's overwrites are reduced to one order-independent hash, cached
+# and kept current by channel events. A child channel has drifted when its hash
+# differs from its category's. Child updates are checked as they happen, and a
+# periodic scan (every DRIFT_SCAN_MINUTES, 0 disables) only compares cached
+# hashes. Drifted channels are resynced through a paced background queue.
+# A resync that fails permanently (missing permissions, the bot's role too low)
+# is not retried until the channel or category overwrites change, or the guild's
+# roles do.
+DRIFT_SCAN_MINUTES = float(os.getenv("DRIFT_SCAN_MINUTES", "30"))
+RESYNC_EDITS_PER_SECOND = 1.0
+
+
+def overwrite_hash(channel: discord.abc.GuildChannel) -> int:
+    """Order-independent hash of a channel's permission overwrites."""
+    return hash(frozenset(
+        (target.id, isinstance(target, discord.Role), allow.value, deny.value)
+        for target, overwrite in channel.overwrites.items()
+        for allow, deny in (overwrite.pair(),)
+    ))
+
+
+class DriftDetector:
+    def __init__(self):
+        self.hashes: dict[int, int] = {}
+        # guild_id -> channel_id -> (channel hash, category hash) a resync failed on
+        self.failed: dict[int, dict[int, tuple[int, int]]] = {}
+
+    def update(self, channel: discord.abc.GuildChannel) -> int:
+        value = self.hashes[channel.id] = overwrite_hash(channel)
+        return value
+
+    def hash_of(self, channel: discord.abc.GuildChannel) -> int:
+        value = self.hashes.get(channel.id)
+        return self.update(channel) if value is None else value
+
+    def forget(self, channel_id: int):
+        self.hashes.pop(channel_id, None)
+
+    def mark_failed(self, channel: discord.abc.GuildChannel):
+        self.failed.setdefault(channel.guild.id, {})[channel.id] = (
+            self.hash_of(channel), self.hash_of(channel.category)
+        )
+
+    def forgive(self, guild_id: int):
+        self.failed.pop(guild_id, None)
+
+    def is_blocked(self, channel: discord.abc.GuildChannel) -> bool:
+        """Whether a resync already failed permanently with the current overwrites."""
+        failed = self.failed.get(channel.guild.id)
+        pair = failed and failed.get(channel.id)
+        if not pair:
+            return False
+        if pair == (self.hash_of(channel), self.hash_of(channel.category)):
+            return True
+        del failed[channel.id]
+        return False
+
+    def is_drifted(self, channel: discord.abc.GuildChannel) -> bool:
+        return channel.category is not None and self.hash_of(channel) != self.hash_of(channel.category)
+
+    def drifted(self, guild: discord.Guild) -> list[discord.abc.GuildChannel]:
+        channels = []
+        for category in guild.categories:
+            parent = self.hash_of(category)
+            channels.extend(c for c in category.channels if self.hash_of(c) != parent and not self.is_blocked(c))
+        return channels
+
+
+drift_detector = DriftDetector()
+
+
+class ResyncJob:
+    __slots__ = ("guild", "channel_id", "reason")
+
+    def __init__(self, guild: discord.Guild, channel_id: int, reason: str):
+        self.guild = guild
+        self.channel_id = channel_id
+        self.reason = reason
+
+
+class ResyncQueue(JobQueue):
+    name = "channel_resync"
+
+    def __init__(self, edits_per_second: float):
+        super().__init__()
+        self.interval = 1 / edits_per_second if edits_per_second > 0 else 0
+
+    def submit(self, channel: discord.abc.GuildChannel, reason: str) -> bool:
+        """Queue a resync of one channel. Returns False if it is already queued."""
+        return self.put((channel.guild.id, channel.id), ResyncJob(channel.guild, channel.id, reason))
+
+    async def process(self, job: ResyncJob):
+        channel = job.guild.get_channel(job.channel_id)
+        # It may have been resynced, moved or deleted while queued
+        if channel is None or not drift_detector.is_drifted(channel) or drift_detector.is_blocked(channel):
+            return
+        await sync_channel(channel, channel.category, job.reason)
+        await asyncio.sleep(self.interval)
+
+
+resync_queue = ResyncQueue(RESYNC_EDITS_PER_SECOND)
+
+
+@tasks.loop(minutes=DRIFT_SCAN_MINUTES or 30)
+async def drift_scan():
+    for guild in bot.guilds:
+        drifted = drift_detector.drifted(guild)
+        if not drifted:
+            continue
+        excluded_ids = await get_excluded_channel_ids(guild.id)
+        excluded_cat_ids = await get_excluded_category_ids(guild.id)
+        drifted = [c for c in drifted if c.id not in excluded_ids and c.category.id not in excluded_cat_ids]
+        queued = sum(resync_queue.submit(c, "Drift scan: channel out of sync with category") for c in drifted)
+        if drifted:
+            logger.info(
+                "Drift scan | %s | %d drifted, %d queued", guild.name, len(drifted), queued,
+                extra=log_fields("drift_scan", guild.id)
+            )
+
+
+@drift_scan.before_loop
+async def before_drift_scan():
+    await bot.wait_until_ready()
+
+
+# ────────────────────────────────────────────────
+#                  GUILD RETENTION
+# ────────────────────────────────────────────────
+
+# Leaving a guild (or finding it gone at startup) only marks its row removed, so
+# a kick-and-reinvite keeps the configuration. Rows still marked after
+# GUILD_GRACE_HOURS are purged with everything that references them, in batches
+# of PURGE_BATCH_SIZE, by a maintenance task that runs every DB_MAINTENANCE_HOURS
+# (0 disables) and also refreshes planner statistics. SQLite is vacuumed after a
+# purge or at least every VACUUM_INTERVAL.
+GUILD_GRACE_HOURS = float(os.getenv("GUILD_GRACE_HOURS", "72"))
+DB_MAINTENANCE_HOURS = float(os.getenv("DB_MAINTENANCE_HOURS", "24"))
+PURGE_BATCH_SIZE = 100
+VACUUM_INTERVAL = 7 * 24 * 3600  # seconds
+
+last_vacuum = 0.0
+
+
+def forget_guild(guild: discord.Guild):
+    """Drop everything held in memory for a guild the bot has left."""
+    invalidate_tag_formatter(guild.id)
+    _member_snapshots.pop(guild.id, None)
+    for channel in guild.channels:
+        drift_detector.forget(channel.id)
+    drift_detector.forgive(guild.id)
+    display_resolver.forget_guild(guild)
+    for key in [k for k in nick_enforcer.last_corrected if k[0] == guild.id]:
+        del nick_enforcer.last_corrected[key]
+    for key in [k for k in nick_enforcer.deferred if k[0] == guild.id]:
+        nick_enforcer.deferred.pop(key).cancel()
+    for job in list(running_jobs.values()):
+        if job.guild.id == guild.id:
+            job.cancel()
+
+
+@tasks.loop(hours=DB_MAINTENANCE_HOURS or 24)
+async def db_maintenance():
+    global last_vacuum
+    started = time.perf_counter()
+    purged = []
+    while True:
+        batch = await purge_removed_guilds(GUILD_GRACE_HOURS * 3600, PURGE_BATCH_SIZE)
+        purged.extend(batch)
+        if len(batch) < PURGE_BATCH_SIZE:
+            break
+        await asyncio.sleep(1)  # Let live queries in between batches
+    vacuum = bool(purged) or time.monotonic() - last_vacuum >= VACUUM_INTERVAL
+    await maintain_db(vacuum)
+    if vacuum:
+        last_vacuum = time.monotonic()
+    logger.info(
+        "DB maintenance | %d guild(s) purged | %s", len(purged), "vacuumed" if vacuum else "analyzed",
+        extra=log_fields("db_maintenance", latency_ms=(time.perf_counter() - started) * 1000)
+    )
+
+
+@db_maintenance.before_loop
+async def before_db_maintenance():
+    await bot.wait_until_ready()
+
+
+# ────────────────────────────────────────────────
+#                  COMPONENT ROUTING
+# ────────────────────────────────────────────────
+
+# Settings menus keep no per-user state in memory. Everything a component needs
+# (guild, screen, page, action) is encoded in its custom_id:
+#
+#   rb:<guild_id>:nav:<screen>:<page>[:<slot>]   NavButton    → render a screen
+#   rb:<guild_id>:do:<action>                     ActionButton → run a button action
+#   rb:<guild_id>:pick:<action>                   ChoiceSelect → run a select action
+#   rb:<guild_id>:job:<job_id>:<action>           JobControlButton → pause/resume/cancel a job
+#
+# The DynamicItem classes are registered once at startup, so menus keep
+# working across restarts and no View object outlives the render that built it.
+
+async def run_route(name: str, handler, *args):
+    if not PROFILE_ENABLED:
+        return await handler(*args)
+    started = time.perf_counter()
+    try:
+        return await handler(*args)
+    finally:
+        profiler.record("view", name, time.perf_counter() - started)
+
+
+async def is_staff(member: discord.Member) -> bool:
+    config = await get_guild_config(member.guild.id)
+    return bool(config and config.get("staff_role_id") and member.get_role(config["staff_role_id"]))
+
+
+async def may_use_settings(interaction: discord.Interaction, guild_id: int, action: str | None = None) -> bool:
+    """Settings components answer staff only, wherever the menu message ended up."""
+    if interaction.guild_id != guild_id:
+        return False
+    if await is_staff(interaction.user):
+        return True
+    if action == "staff_modal":
+        # Until a staff role is set, setting one is all the menu allows
+        config = await get_guild_config(guild_id)
+        return not (config and config.get("staff_role_id"))
+    return False
+
+
+class JobControlButton(discord.ui.DynamicItem[discord.ui.Button],
+                       template=r"rb:(?P<guild_id>\d+):job:(?P<job_id>\d+):(?P<action>pause|resume|cancel)"):
+    STYLES = {
+        "pause": ("Pause", discord.ButtonStyle.secondary),
+        "resume": ("Resume", discord.ButtonStyle.success),
+        "cancel": ("Cancel", discord.ButtonStyle.danger),
+    }
+
+    def __init__(self, guild_id: int, job_id: int, action: str):
+        label, style = self.STYLES[action]
+        super().__init__(discord.ui.Button(label=label, style=style, custom_id=f"rb:{guild_id}:job:{job_id}:{action}"))
+        self.guild_id = guild_id
+        self.job_id = job_id
+        self.action = action
+
+    @classmethod
+    async def from_custom_id(cls, interaction: discord.Interaction, item: discord.ui.Button, match: re.Match[str], /):
+        return cls(int(match["guild_id"]), int(match["job_id"]), match["action"])
+
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        # Status messages can end up in a public channel
+        return interaction.guild_id == self.guild_id and await is_staff(interaction.user)
+
+    async def callback(self, interaction: discord.Interaction):
+        job = running_jobs.get(self.job_id)
+        if job is None:
+            await interaction.response.edit_message(view=None)
+            return
+        getattr(job, self.action)()
+        logger.info(
+            "Job %s | %s | by %s", self.action, job.title, interaction.user,
+            extra=log_fields("job_control", interaction.guild_id, interaction.user.id)
+        )
+        await interaction.response.edit_message(embed=job.embed(), view=None if job.cancelled else job.controls())
+
+
+class NavButton(discord.ui.DynamicItem[discord.ui.Button],
+                template=r"rb:(?P<guild_id>\d+):nav:(?P<screen>[a-z_]+):(?P<page>\d+)(?::[a-z]+)?"):
+    def __init__(self, guild_id: int, screen: str, page: int = 0, *, label: str = "…",
+                 style: discord.ButtonStyle = discord.ButtonStyle.primary, slot: str | None = None,
+                 disabled: bool = False, row: int | None = None):
+        custom_id = f"rb:{guild_id}:nav:{screen}:{page}" + (f":{slot}" if slot else "")
+        super().__init__(discord.ui.Button(label=label, style=style, custom_id=custom_id, disabled=disabled), row=row)
+        self.guild_id = guild_id
+        self.screen = screen
+        self.page = page
+
+    @classmethod
+    async def from_custom_id(cls, interaction: discord.Interaction, item: discord.ui.Button, match: re.Match[str], /):
+        return cls(int(match["guild_id"]), match["screen"], int(match["page"]), label=item.label, style=item.style)
+
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        return await may_use_settings(interaction, self.guild_id)
+
+    async def callback(self, interaction: discord.Interaction):
+        await run_route(f"nav:{self.screen}", self._navigate, interaction)
+
+    async def _navigate(self, interaction: discord.Interaction):
+        embed, view = await SCREENS[self.screen](interaction.guild, self.page)
+        await interaction.response.edit_message(embed=embed, view=view)
+
+
+class ActionButton(discord.ui.DynamicItem[discord.ui.Button], template=r"rb:(?P<guild_id>\d+):do:(?P<action>[a-z_]+)"):
+    def __init__(self, guild_id: int, action: str, *, label: str = "…",
+                 style: discord.ButtonStyle = discord.ButtonStyle.secondary, row: int | None = None):
+        super().__init__(discord.ui.Button(label=label, style=style, custom_id=f"rb:{guild_id}:do:{action}"), row=row)
+        self.guild_id = guild_id
+        self.action = action
+
+    @classmethod
+    async def from_custom_id(cls, interaction: discord.Interaction, item: discord.ui.Button, match: re.Match[str], /):
+        return cls(int(match["guild_id"]), match["action"], label=item.label, style=item.style)
+
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        return self.action in BUTTON_ACTIONS and await may_use_settings(interaction, self.guild_id, self.action)
+
+    async def callback(self, interaction: discord.Interaction):
+        await run_route(f"do:{self.action}", BUTTON_ACTIONS[self.action], interaction)
+
+
+class ChoiceSelect(discord.ui.DynamicItem[discord.ui.Select], template=r"rb:(?P<guild_id>\d+):pick:(?P<action>[a-z_]+)"):
+    def __init__(self, guild_id: int, action: str, *, placeholder: str = "", options: list[SelectOption] | None = None,
+                 row: int | None = None):
+        super().__init__(
+            discord.ui.Select(
+                placeholder=placeholder,
+                custom_id=f"rb:{guild_id}:pick:{action}",
+                min_values=1,
+                max_values=1,
+                options=options or [SelectOption(label="None", value="none")]
+            ),
+            row=row
+        )
+        self.guild_id = guild_id
+        self.action = action
+
+    @classmethod
+    async def from_custom_id(cls, interaction: discord.Interaction, item: discord.ui.Select, match: re.Match[str], /):
+        return cls(int(match["guild_id"]), match["action"], placeholder=item.placeholder or "", options=item.options)
+
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        return self.action in SELECT_ACTIONS and await may_use_settings(interaction, self.guild_id)
+
+    async def callback(self, interaction: discord.Interaction):
+        handler, empty_message = SELECT_ACTIONS[self.action]
+        value = self.item.values[0]
+        if value == "none":
+            await interaction.response.send_message(empty_message, ephemeral=True)
+            return
+        await run_route(f"pick:{self.action}", handler, interaction, int(value))
+
+
+# ────────────────────────────────────────────────
+#                  DISPLAY RESOLVER
+# ────────────────────────────────────────────────
+
+# Screens resolve stored ID sets to roles and channels once per render, with a
+# single lookup per ID. What stays the same between renders is kept: each
+# guild's channel, category and role orderings, and the formatted option labels
+# in a small LRU (a category's label counts its channels, which is a scan of the
+# whole guild). Channel and role events drop the entries they affect; overwrite-
+# only channel edits, like the bot's own syncs, leave them alone.
+LABEL_CACHE_SIZE = 4096
+
+
+def channel_sort_key(channel: discord.abc.GuildChannel) -> tuple[str, str]:
+    return channel.category.name if channel.category else "", channel.name
+
+
+ORDERINGS = {
+    "channels": lambda guild: sorted(
+        (c for c in guild.channels if not isinstance(c, discord.CategoryChannel)), key=channel_sort_key
+    ),
+    "text": lambda guild: sorted(guild.text_channels, key=channel_sort_key),
+    "categories": lambda guild: guild.categories,
+    "roles": lambda guild: [
+        r for r in guild.roles
+        if r.name.strip() and len(r.name) <= 100 and not r.is_default() and not r.managed
+    ],
+}
+CHANNEL_ORDERINGS = ("channels", "text", "categories")
+
+
+class DisplayResolver:
+    def __init__(self, max_labels: int):
+        self.max_labels = max_labels
+        self.labels: OrderedDict[int, tuple[str, str]] = OrderedDict()
+        self.orders: dict[tuple[int, str], list] = {}
+
+    @staticmethod
+    def roles(guild: discord.Guild, role_ids: Iterable[int]) -> list[discord.Role]:
+        return [role for role_id in role_ids if (role := guild.get_role(role_id))]
+
+    @staticmethod
+    def channels(guild: discord.Guild, channel_ids: Iterable[int]) -> list[discord.abc.GuildChannel]:
+        return [channel for channel_id in channel_ids if (channel := guild.get_channel(channel_id))]
+
+    def ordered(self, guild: discord.Guild, kind: str) -> list:
+        """Channels, text channels, categories or assignable roles in display order."""
+        items = self.orders.get((guild.id, kind))
+        if items is None:
+            items = self.orders[(guild.id, kind)] = ORDERINGS[kind](guild)
+        return items
+
+    def label(self, channel: discord.abc.GuildChannel) -> tuple[str, str]:
+        """(label, description) for a channel or category select option."""
+        labels = self.labels.get(channel.id)
+        if labels is not None:
+            self.labels.move_to_end(channel.id)
+            return labels
+        if isinstance(channel, discord.CategoryChannel):
+            labels = channel.name[:100], f"{len(channel.channels)} channels"
+        else:
+            labels = f"#{channel.name}"[:100], f"Category: {channel.category.name if channel.category else 'None'}"[:100]
+        self.labels[channel.id] = labels
+        if len(self.labels) > self.max_labels:
+            self.labels.popitem(last=False)
+        return labels
+
+    def forget_channel(self, channel: discord.abc.GuildChannel):
+        """Drop a created, deleted or moved channel's label, its category's count and the guild's orderings."""
+        self.labels.pop(channel.id, None)
+        if channel.category_id:
+            self.labels.pop(channel.category_id, None)
+        for kind in CHANNEL_ORDERINGS:
+            self.orders.pop((channel.guild.id, kind), None)
+
+    def channel_updated(self, before: discord.abc.GuildChannel, after: discord.abc.GuildChannel):
+        if (before.name, before.category_id, before.position) == (after.name, after.category_id, after.position):
+            return
+        self.forget_channel(before)
+        self.forget_channel(after)
+        if isinstance(after, discord.CategoryChannel):
+            for channel in after.channels:  # Their descriptions name the category
+                self.labels.pop(channel.id, None)
+
+    def forget_roles(self, guild: discord.Guild):
+        self.orders.pop((guild.id, "roles"), None)
+
+    def forget_guild(self, guild: discord.Guild):
+        for channel in guild.channels:
+            self.labels.pop(channel.id, None)
+        for kind in ORDERINGS:
+            self.orders.pop((guild.id, kind), None)
+
+    def clear(self):
+        self.labels.clear()
+        self.orders.clear()
+
+
+display_resolver = DisplayResolver(LABEL_CACHE_SIZE)
+
+
+# ────────────────────────────────────────────────
+#                     VIEWS
+# ────────────────────────────────────────────────
+
+def channel_option(channel: discord.abc.GuildChannel) -> SelectOption:
+    label, description = display_resolver.label(channel)
+    return SelectOption(label=label, value=str(channel.id), description=description)
+
+
+def category_option(category: discord.CategoryChannel) -> SelectOption:
+    label, description = display_resolver.label(category)
+    return SelectOption(label=label, value=str(category.id), description=description)
+
+
+def pager(view: View, guild_id: int, screen: str, page: int, total_pages: int):
+    view.add_item(NavButton(guild_id, screen, max(page - 1, 0), label="◀ Prev", style=discord.ButtonStyle.grey,
+                            slot="prev", disabled=page == 0, row=4))
+    view.add_item(NavButton(guild_id, screen, min(page + 1, total_pages - 1), label="Next ▶",
+                            style=discord.ButtonStyle.grey, slot="next", disabled=page >= total_pages - 1, row=4))
+
+
+def back_button(guild_id: int, row: int | None = None) -> NavButton:
+    return NavButton(guild_id, "home", label="Back", style=discord.ButtonStyle.grey, slot="back", row=row)
+
+
+class HomeView(TimedView):
+    def __init__(self, guild_id: int):
+        super().__init__(timeout=None)
+        self.add_item(NavButton(guild_id, "staff", label="Staff Role"))
+        self.add_item(NavButton(guild_id, "tags", label="Tag Roles"))
+        self.add_item(ActionButton(guild_id, "tag_format", label="Tag Format", style=discord.ButtonStyle.primary))
+        self.add_item(NavButton(guild_id, "excluded", label="Excluded Channels"))
+        self.add_item(NavButton(guild_id, "log_channel", label="Log Channel"))
+        self.add_item(ActionButton(guild_id, "refresh_all", label="Refresh All"))
+        self.add_item(ActionButton(guild_id, "sync_categories", label="Sync Categories"))
+        self.add_item(ActionButton(guild_id, "close", label="Close", style=discord.ButtonStyle.danger))
+
+
+class StaffView(TimedView):
+    def __init__(self, guild_id: int):
+        super().__init__(timeout=None)
+        self.add_item(ActionButton(guild_id, "staff_modal", label="Set Staff Role", style=discord.ButtonStyle.green))
+        self.add_item(back_button(guild_id))
+
+
+class TagView(TimedView):
+    def __init__(self, guild: discord.Guild, current_roles: list[discord.Role]):
+        super().__init__(timeout=None)
+
+        roles = display_resolver.ordered(guild, "roles")[:25]
+        # One pass over the members instead of a role.members scan per role
+        shown = {role.id for role in roles}
+        counts = Counter(role_id for member in guild.members for role_id in member._roles if role_id in shown)
+        add_options = [
+            SelectOption(label=role.name, value=str(role.id), description=f"Members: {counts[role.id]}")
+            for role in roles
+        ] or [SelectOption(label="No roles to add", value="none")]
+        self.add_item(ChoiceSelect(guild.id, "tag_add", placeholder="Add role as tag...", options=add_options))
+
+        remove_options = [
+            SelectOption(label=role.name, value=str(role.id), description=f"Remove {role.name}")
+            for role in current_roles
+        ] or [SelectOption(label="No tag roles to remove", value="none")]
+        self.add_item(ChoiceSelect(guild.id, "tag_remove", placeholder="Remove tag role...", options=remove_options))
+
+        self.add_item(ActionButton(guild.id, "list_tags", label="List Current Tags", style=discord.ButtonStyle.blurple))
+        self.add_item(ActionButton(guild.id, "tag_label", label="Set Label", style=discord.ButtonStyle.blurple))
+        self.add_item(back_button(guild.id))
+
+
+class ExcludedChannelsView(TimedView):
+    def __init__(self, guild: discord.Guild, excluded_channels: list, excluded_cats: list, page: int = 0):
+        super().__init__(timeout=None)
+
+        paged_channels, page, total_pages = paginate(display_resolver.ordered(guild, "channels"), page)
+        self.add_item(ChoiceSelect(
+            guild.id, "exclude_channel",
+            placeholder=f"Exclude channel (page {page + 1}/{total_pages})...",
+            options=[channel_option(c) for c in paged_channels] or [SelectOption(label="No channels found", value="none")]
+        ))
+        self.add_item(ChoiceSelect(
+            guild.id, "include_channel",
+            placeholder="Remove channel exclusion...",
+            options=[channel_option(c) for c in excluded_channels[:25]]
+            or [SelectOption(label="No excluded channels", value="none")]
+        ))
+        self.add_item(ChoiceSelect(
+            guild.id, "exclude_category",
+            placeholder="Exclude entire category...",
+            options=[category_option(cat) for cat in display_resolver.ordered(guild, "categories")[:25]]
+            or [SelectOption(label="No categories found", value="none")]
+        ))
+        self.add_item(ChoiceSelect(
+            guild.id, "include_category",
+            placeholder="Remove category exclusion...",
+            options=[category_option(cat) for cat in excluded_cats[:25]]
+            or [SelectOption(label="No excluded categories", value="none")]
+        ))
+        pager(self, guild.id, "excluded", page, total_pages)
+        self.add_item(ActionButton(guild.id, "list_excluded", label="List All Exclusions",
+                                   style=discord.ButtonStyle.blurple, row=4))
+        self.add_item(back_button(guild.id, row=4))
+
+
+class LogChannelView(TimedView):
+    def __init__(self, guild: discord.Guild, page: int = 0):
+        super().__init__(timeout=None)
+
+        paged_channels, page, total_pages = paginate(display_resolver.ordered(guild, "text"), page)
+        self.add_item(ChoiceSelect(
+            guild.id, "log_channel",
+            placeholder=f"Select log channel (page {page + 1}/{total_pages})...",
+            options=[channel_option(c) for c in paged_channels] or [SelectOption(label="No channels found", value="none")]
+        ))
+        pager(self, guild.id, "log_channel", page, total_pages)
+        self.add_item(ActionButton(guild.id, "clear_log", label="Clear Log Channel", style=discord.ButtonStyle.red, row=4))
+        self.add_item(back_button(guild.id, row=4))
+
+
+# ── Screens ─────────────────────────────────────
+
+def home_embed(guild: discord.Guild) -> discord.Embed:
+    return discord.Embed(
+        title=f"⚙️ {guild.name} Settings",
+        description="Navigate using the buttons below:",
+        color=0x5865f2,
+        timestamp=datetime.now(timezone.utc)
+    )
+
+
+async def home_screen(guild: discord.Guild, page: int = 0):
+    return home_embed(guild), HomeView(guild.id)
+
+
+async def staff_screen(guild: discord.Guild, page: int = 0):
+    config = await get_guild_config(guild.id)
+    staff = f"<@&{config['staff_role_id']}>" if config and config.get('staff_role_id') else "Not set"
+    embed = discord.Embed(title="Staff Settings", description=f"Current: {staff}", color=0x2ecc71)
+    return embed, StaffView(guild.id)
+
+
+async def tags_screen(guild: discord.Guild, page: int = 0):
+    embed = discord.Embed(
+        title="Tag Roles",
+        description="Manage alliance tags",
+        color=0xe67e22,
+        timestamp=datetime.now(timezone.utc)
+    )
+    allowed_ids = await get_tag_role_ids(guild.id)
+    current_roles = display_resolver.roles(guild, allowed_ids)
+    return embed, TagView(guild, current_roles)
+
+
+async def excluded_screen(guild: discord.Guild, page: int = 0):
+    excluded_ids = await get_excluded_channel_ids(guild.id)
+    excluded_cat_ids = await get_excluded_category_ids(guild.id)
+    excluded_channels = display_resolver.channels(guild, excluded_ids)
+    excluded_cats = display_resolver.channels(guild, excluded_cat_ids)
+    embed = discord.Embed(
+        title="Sync Exclusions",
+        description="Exclude individual channels or entire categories from permission sync.",
+        color=0x9b59b6,
+        timestamp=datetime.now(timezone.utc)
+    )
+    return embed, ExcludedChannelsView(guild, excluded_channels, excluded_cats, page)
+
+
+async def log_channel_screen(guild: discord.Guild, page: int = 0):
+    config = await get_guild_config(guild.id)
+    current = f"<#{config['log_channel_id']}>" if config and config.get("log_channel_id") else "Not set"
+    embed = discord.Embed(
+        title="Log Channel",
+        description=f"Current log channel: {current}\n\nSelect a channel below to receive bot activity logs.",
+        color=0x1abc9c,
+        timestamp=datetime.now(timezone.utc)
+    )
+    return embed, LogChannelView(guild, page)
+
+
+SCREENS = {
+    "home": home_screen,
+    "staff": staff_screen,
+    "tags": tags_screen,
+    "excluded": excluded_screen,
+    "log_channel": log_channel_screen,
+}
+
+
+# ── Button actions ──────────────────────────────
+
+async def refresh_all(interaction: discord.Interaction):
+    await interaction.response.defer(ephemeral=True)
+    started = time.perf_counter()
+    guild = interaction.guild
+    formatter = await get_tag_formatter(guild.id)
+    members = [m for m in guild.members if not m.bot]
+    progress = JobProgress("Bulk nickname refresh", guild, len(members), interaction)
+    await progress.publish()
+    changes = await nickname_changes(guild, formatter, members) if formatter else []
+    await progress.advance(count=len(members) - len(changes))
+    failed = set()
+    for member, _ in changes:
+        changed = await update_nickname(member, "Bulk refresh", force=True, bulk=True)
+        if not changed:
+            failed.add(member.id)
+        if not await progress.advance(changed, not changed):
+            break
+    await progress.finish()
+    cancelled = " (cancelled)" if progress.cancelled else ""
+    # Only a completed pass is a trustworthy baseline for the next diff
+    drifted = await take_member_snapshot(guild, failed) if not progress.cancelled else None
+    logger.info(
+        "Bulk refresh | %s | %d nicknames updated, %d failed by %s%s", guild.name, progress.changed, progress.failed,
+        interaction.user, cancelled,
+        extra=log_fields("bulk_refresh", guild.id, interaction.user.id, (time.perf_counter() - started) * 1000)
+    )
+    await log_to_channel(
+        guild,
+        f"🔄 **Bulk Nickname Refresh**{cancelled}\n"
+        f"**Triggered by:** {interaction.user.mention}\n"
+        f"**Nicknames updated:** {progress.changed}\n"
+        f"**Failed:** {progress.failed}"
+        + (f"\n**Members changed since last refresh:** {drifted}" if drifted is not None else ""),
+        LOG_BLUE
+    )
+
+
+async def sync_categories(interaction: discord.Interaction):
+    await interaction.response.defer(ephemeral=True)
+    started = time.perf_counter()
+    total = sum(len(category.channels) for category in interaction.guild.categories)
+    progress = JobProgress("Category sync", interaction.guild, total, interaction, changed_label="Synced")
+    await progress.publish()
+    synced, skipped = await sync_all_categories(interaction.guild, "Manual category sync", progress)
+    progress.detail = f"**Skipped (excluded):** {skipped}"
+    await progress.finish()
+    logger.info(
+        "Manual category sync | %s | %d synced, %d skipped by %s%s", interaction.guild.name, synced, skipped,
+        interaction.user, " (cancelled)" if progress.cancelled else "",
+        extra=log_fields(
+            "manual_category_sync", interaction.guild.id, interaction.user.id, (time.perf_counter() - started) * 1000
+        )
+    )
+    await log_to_channel(
+        interaction.guild,
+        f"🔄 **Manual Category Sync**\n"
+        f"**Triggered by:** {interaction.user.mention}\n"
+        f"**Channels synced:** {synced}\n"
+        f"**Skipped (excluded):** {skipped}",
+        LOG_BLUE
+    )
+
+
+async def close_menu(interaction: discord.Interaction):
+    await interaction.response.defer()
+
+
+async def open_tag_format(interaction: discord.Interaction):
+    config = await get_guild_config(interaction.guild.id)
+    await interaction.response.send_modal(TagFormatModal(config))
+
+
+async def open_staff_modal(interaction: discord.Interaction):
+    try:
+        await interaction.response.send_modal(StaffModal())
+    except Exception as e:
+        logger.error("Modal send failed: %s", e, extra=log_fields("staff_modal", interaction.guild_id))
+        if not interaction.response.is_done():
+            await interaction.response.send_message("Failed to open modal.", ephemeral=True)
+
 
-async def sync_category_channels(category: discord.CategoryChannel, excluded_ids: set[int], reason: str = "Category permission sync"):
-    synced = 0
-    skipped = 0
-    for channel in category.channels:
-        if channel.id in excluded_ids:
-            logger.info(f"Skipping excluded channel #{channel.name} in {category.name}")
-            skipped += 1
-            continue
-        try:
-            if not channel.permissions_synced:
-                await channel.edit(sync_permissions=True, reason=reason)
-                logger.info(f"Synced #{channel.name} → category '{category.name}'")
-                await log_to_channel(
-                    category.guild,
-                    f"🔒 **Channel Synced**\n"
-                    f"**Channel:** #{channel.name}\n"
-                    f"**Category:** {category.name}\n"
-                    f"**Reason:** {reason}",
-                    LOG_GREEN
-                )
-                synced += 1
-        except Exception as e:
-            logger.error(f"Failed to sync #{channel.name}: {e}")
-            await log_to_channel(
-                category.guild,
-                f"⚠️ **Channel Sync Failed**\n"
-                f"**Channel:** #{channel.name}\n"
-                f"**Error:** {e}",
-                LOG_RED
-            )
-    return synced, skipped
+async def open_tag_label(interaction: discord.Interaction):
+    await interaction.response.send_modal(TagLabelModal())
 
 
-async def sync_all_categories(guild: discord.Guild, reason: str = "Full category sync"):
-    excluded_channel_ids = await get_excluded_channel_ids(guild.id)
-    excluded_category_ids = await get_excluded_category_ids(guild.id)
-    total_synced = 0
-    total_skipped = 0
-    for category in guild.categories:
-        if category.id in excluded_category_ids:
-            logger.info(f"Skipping excluded category: {category.name}")
-            total_skipped += len(category.channels)
-            continue
-        synced, skipped = await sync_category_channels(category, excluded_channel_ids, reason)
-        total_synced += synced
-        total_skipped += skipped
-    return total_synced, total_skipped
+async def list_tags(interaction: discord.Interaction):
+    allowed_ids = await get_tag_role_ids(interaction.guild.id)
+    roles = display_resolver.roles(interaction.guild, allowed_ids)
+    content = "Current tag roles:\n" + ("\n".join(f"- {r.name}" for r in roles) or "None set")
+    await interaction.response.send_message(content, ephemeral=True)
 
 
-# ────────────────────────────────────────────────
-#                  PAGINATION HELPER
-# ────────────────────────────────────────────────
+async def list_excluded(interaction: discord.Interaction):
+    excluded_ids = await get_excluded_channel_ids(interaction.guild.id)
+    excluded_cat_ids = await get_excluded_category_ids(interaction.guild.id)
+    channels = display_resolver.channels(interaction.guild, excluded_ids)
+    cats = display_resolver.channels(interaction.guild, excluded_cat_ids)
+    ch_list = "\n".join(f"- #{c.name}" for c in channels) or "None"
+    cat_list = "\n".join(f"- {c.name}" for c in cats) or "None"
+    await interaction.response.send_message(
+        f"**Excluded Channels:**\n{ch_list}\n\n**Excluded Categories:**\n{cat_list}",
+        ephemeral=True
+    )
 
-PAGE_SIZE = 20
 
+async def clear_log(interaction: discord.Interaction):
+    await interaction.response.send_message("✅ Log channel cleared. No logs will be sent.", ephemeral=True)
 
-def paginate_options(options: list[SelectOption], page: int) -> tuple[list[SelectOption], int]:
-    total_pages = max(1, (len(options) + PAGE_SIZE - 1) // PAGE_SIZE)
-    page = max(0, min(page, total_pages - 1))
-    start = page * PAGE_SIZE
-    return options[start:start + PAGE_SIZE], total_pages
+    async def work():
+        await set_log_channel(interaction.guild.id, None)
+        logger.info(
+            "Log channel cleared | %s | by %s", interaction.guild.name, interaction.user,
+            extra=log_fields("log_channel_cleared", interaction.guild.id, interaction.user.id)
+        )
+    finish_in_background(interaction, work(), "Failed to clear log channel.", "log_channel_cleared")
 
 
-# ────────────────────────────────────────────────
-#                     VIEWS
-# ────────────────────────────────────────────────
+BUTTON_ACTIONS = {
+    "refresh_all": refresh_all,
+    "sync_categories": sync_categories,
+    "close": close_menu,
+    "tag_format": open_tag_format,
+    "staff_modal": open_staff_modal,
+    "tag_label": open_tag_label,
+    "list_tags": list_tags,
+    "list_excluded": list_excluded,
+    "clear_log": clear_log,
+}
 
-class HomeView(View):
-    def __init__(self):
-        super().__init__(timeout=None)
 
-    @discord.ui.button(label="Staff Role", style=discord.ButtonStyle.primary, custom_id="home:staff")
-    async def staff_button(self, interaction: discord.Interaction, _):
-        config = await get_guild_config(interaction.guild.id)
-        staff = f"<@&{config['staff_role_id']}>" if config and config.get('staff_role_id') else "Not set"
-        embed = discord.Embed(title="Staff Settings", description=f"Current: {staff}", color=0x2ecc71)
-        await interaction.response.edit_message(embed=embed, view=StaffView())
+# ── Select actions ──────────────────────────────
 
-    @discord.ui.button(label="Tag Roles", style=discord.ButtonStyle.primary, custom_id="home:tags")
-    async def tags_button(self, interaction: discord.Interaction, _):
-        embed = discord.Embed(
-            title="Tag Roles",
-            description="Manage alliance tags",
-            color=0xe67e22,
-            timestamp=datetime.now(timezone.utc)
-        )
-        allowed_ids = await get_tag_role_ids(interaction.guild.id)
-        current_roles = [interaction.guild.get_role(rid) for rid in allowed_ids if interaction.guild.get_role(rid)]
-        await interaction.response.edit_message(embed=embed, view=TagView(interaction.guild, current_roles))
-
-    @discord.ui.button(label="Excluded Channels", style=discord.ButtonStyle.primary, custom_id="home:excluded")
-    async def excluded_button(self, interaction: discord.Interaction, _):
-        excluded_ids = await get_excluded_channel_ids(interaction.guild.id)
-        excluded_cat_ids = await get_excluded_category_ids(interaction.guild.id)
-        excluded_channels = [interaction.guild.get_channel(cid) for cid in excluded_ids if interaction.guild.get_channel(cid)]
-        excluded_cats = [interaction.guild.get_channel(cid) for cid in excluded_cat_ids if interaction.guild.get_channel(cid)]
-        embed = discord.Embed(
-            title="Sync Exclusions",
-            description="Exclude individual channels or entire categories from permission sync.",
-            color=0x9b59b6,
-            timestamp=datetime.now(timezone.utc)
-        )
-        await interaction.response.edit_message(embed=embed, view=ExcludedChannelsView(interaction.guild, excluded_channels, excluded_cats, page=0))
+async def set_log_channel_choice(interaction: discord.Interaction, channel_id: int):
+    channel = interaction.guild.get_channel(channel_id)
+    if not channel:
+        await interaction.response.send_message("Failed to set log channel.", ephemeral=True)
+        return
+    await interaction.response.send_message(f"✅ Log channel set to {channel.mention}", ephemeral=True)
 
-    @discord.ui.button(label="Log Channel", style=discord.ButtonStyle.primary, custom_id="home:log_channel")
-    async def log_channel_button(self, interaction: discord.Interaction, _):
-        config = await get_guild_config(interaction.guild.id)
-        current = f"<#{config['log_channel_id']}>" if config and config.get("log_channel_id") else "Not set"
-        embed = discord.Embed(
-            title="Log Channel",
-            description=f"Current log channel: {current}\n\nSelect a channel below to receive bot activity logs.",
-            color=0x1abc9c,
-            timestamp=datetime.now(timezone.utc)
-        )
-        await interaction.response.edit_message(embed=embed, view=LogChannelView(interaction.guild))
-
-    @discord.ui.button(label="Refresh All", style=discord.ButtonStyle.secondary, custom_id="home:refresh_all")
-    async def refresh_all(self, interaction: discord.Interaction, _):
-        await interaction.response.defer(ephemeral=True)
-        count = 0
-        for member in interaction.guild.members:
-            if await update_nickname(member, "Bulk refresh", force=True):
-                count += 1
-        logger.info(f"Bulk refresh | {interaction.guild.name} | {count} nicknames updated by {interaction.user}")
-        await log_to_channel(
-            interaction.guild,
-            f"🔄 **Bulk Nickname Refresh**\n"
-            f"**Triggered by:** {interaction.user.mention}\n"
-            f"**Nicknames updated:** {count}",
-            LOG_BLUE
+    async def work():
+        await set_log_channel(interaction.guild.id, channel.id)
+        logger.info(
+            "Log channel set | %s | #%s | by %s", interaction.guild.name, channel.name, interaction.user,
+            extra=log_fields("log_channel_set", interaction.guild.id, interaction.user.id)
         )
-        await interaction.followup.send(f"Updated {count} nicknames.", ephemeral=True)
-
-    @discord.ui.button(label="Sync Categories", style=discord.ButtonStyle.secondary, custom_id="home:sync_categories")
-    async def sync_categories(self, interaction: discord.Interaction, _):
-        await interaction.response.defer(ephemeral=True)
-        synced, skipped = await sync_all_categories(interaction.guild, "Manual category sync")
-        logger.info(f"Manual category sync | {interaction.guild.name} | {synced} synced, {skipped} skipped by {interaction.user}")
         await log_to_channel(
             interaction.guild,
-            f"🔄 **Manual Category Sync**\n"
-            f"**Triggered by:** {interaction.user.mention}\n"
-            f"**Channels synced:** {synced}\n"
-            f"**Skipped (excluded):** {skipped}",
+            f"📋 **Log Channel Configured**\n"
+            f"**Channel:** {channel.mention}\n"
+            f"**Set by:** {interaction.user.mention}\n"
+            f"Bot activity will now be logged here.",
             LOG_BLUE
         )
-        await interaction.followup.send(
-            f"Synced **{synced}** channels. Skipped **{skipped}** excluded.",
-            ephemeral=True
-        )
-
-    @discord.ui.button(label="Close", style=discord.ButtonStyle.danger, custom_id="home:close_unique")
-    async def close(self, interaction: discord.Interaction, _):
-        await interaction.response.defer()
+    finish_in_background(interaction, work(), "Failed to set log channel.", "log_channel_set")
 
 
-class LogChannelView(View):
-    def __init__(self, guild: discord.Guild):
-        super().__init__(timeout=180)
+async def exclude_channel(interaction: discord.Interaction, channel_id: int):
+    channel = interaction.guild.get_channel(channel_id)
+    name = channel.name if channel else "Unknown"
+    await interaction.response.send_message(f"✅ **#{name}** excluded from sync.", ephemeral=True)
 
-        text_channels = sorted(
-            [c for c in guild.text_channels],
-            key=lambda c: (c.category.name if c.category else "", c.name)
+    async def work():
+        await add_excluded_channel(interaction.guild.id, channel_id)
+        logger.info(
+            "Channel excluded from sync | #%s | %s | by %s", name, interaction.guild.name, interaction.user,
+            extra=log_fields("channel_excluded", interaction.guild.id, interaction.user.id)
         )
-        all_options = [
-            SelectOption(
-                label=f"#{c.name}"[:100],
-                value=str(c.id),
-                description=f"Category: {c.category.name if c.category else 'None'}"[:100]
-            )
-            for c in text_channels
-        ]
-
-        self.all_options = all_options
-        self.page = 0
-        paged_options, self.total_pages = paginate_options(all_options, 0)
-
-        self.channel_select = Select(
-            placeholder=f"Select log channel (page 1/{self.total_pages})...",
-            custom_id="log:channel_select",
-            min_values=1,
-            max_values=1,
-            options=paged_options or [SelectOption(label="No channels found", value="none")]
+        await log_to_channel(
+            interaction.guild,
+            f"🚫 **Channel Excluded from Sync**\n"
+            f"**Channel:** #{name}\n"
+            f"**By:** {interaction.user.mention}",
+            LOG_YELLOW
         )
-        self.channel_select.callback = self.channel_callback
-        self.add_item(self.channel_select)
-
-    @discord.ui.button(label="◀ Prev", style=discord.ButtonStyle.grey, custom_id="log:prev")
-    async def prev_page(self, interaction: discord.Interaction, _):
-        if self.page > 0:
-            self.page -= 1
-            await self._reload(interaction)
-        else:
-            await interaction.response.defer()
+    finish_in_background(interaction, work(), "Failed to exclude channel.", "channel_excluded")
 
-    @discord.ui.button(label="Next ▶", style=discord.ButtonStyle.grey, custom_id="log:next")
-    async def next_page(self, interaction: discord.Interaction, _):
-        if self.page < self.total_pages - 1:
-            self.page += 1
-            await self._reload(interaction)
-        else:
-            await interaction.response.defer()
 
-    @discord.ui.button(label="Clear Log Channel", style=discord.ButtonStyle.red, custom_id="log:clear")
-    async def clear_log(self, interaction: discord.Interaction, _):
-        await set_log_channel(interaction.guild.id, None)
-        logger.info(f"Log channel cleared | {interaction.guild.name} | by {interaction.user}")
-        await interaction.response.send_message("✅ Log channel cleared. No logs will be sent.", ephemeral=True)
+async def include_channel(interaction: discord.Interaction, channel_id: int):
+    channel = interaction.guild.get_channel(channel_id)
+    name = channel.name if channel else "Unknown"
+    await interaction.response.send_message(f"✅ **#{name}** will now be included in sync.", ephemeral=True)
 
-    @discord.ui.button(label="Back", style=discord.ButtonStyle.grey, custom_id="log:back")
-    async def back(self, interaction: discord.Interaction, _):
-        embed = discord.Embed(
-            title=f"⚙️ Settings — {interaction.guild.name}",
-            description="Navigate using the buttons below:",
-            color=0x5865f2
+    async def work():
+        await remove_excluded_channel(interaction.guild.id, channel_id)
+        logger.info(
+            "Channel exclusion removed | #%s | %s | by %s", name, interaction.guild.name, interaction.user,
+            extra=log_fields("channel_exclusion_removed", interaction.guild.id, interaction.user.id)
         )
-        await interaction.response.edit_message(embed=embed, view=HomeView())
-
-    async def channel_callback(self, interaction: discord.Interaction):
-        value = self.channel_select.values[0]
-        if value == "none":
-            await interaction.response.send_message("No channels available.", ephemeral=True)
-            return
-        try:
-            channel_id = int(value)
-            await set_log_channel(interaction.guild.id, channel_id)
-            channel = interaction.guild.get_channel(channel_id)
-            logger.info(f"Log channel set | {interaction.guild.name} | #{channel.name} | by {interaction.user}")
-            await interaction.response.send_message(
-                f"✅ Log channel set to {channel.mention}", ephemeral=True
-            )
-            await log_to_channel(
-                interaction.guild,
-                f"📋 **Log Channel Configured**\n"
-                f"**Channel:** {channel.mention}\n"
-                f"**Set by:** {interaction.user.mention}\n"
-                f"Bot activity will now be logged here.",
-                LOG_BLUE
-            )
-        except Exception as e:
-            logger.error(f"Set log channel failed: {e}")
-            await interaction.response.send_message("Failed to set log channel.", ephemeral=True)
-
-    async def _reload(self, interaction: discord.Interaction):
-        paged_options, self.total_pages = paginate_options(self.all_options, self.page)
-        self.channel_select.placeholder = f"Select log channel (page {self.page + 1}/{self.total_pages})..."
-        self.channel_select.options = paged_options
-        config = await get_guild_config(interaction.guild.id)
-        current = f"<#{config['log_channel_id']}>" if config and config.get("log_channel_id") else "Not set"
-        embed = discord.Embed(
-            title="Log Channel",
-            description=f"Current log channel: {current}\n\nSelect a channel below to receive bot activity logs.",
-            color=0x1abc9c,
-            timestamp=datetime.now(timezone.utc)
+        await log_to_channel(
+            interaction.guild,
+            f"✅ **Channel Exclusion Removed**\n"
+            f"**Channel:** #{name}\n"
+            f"**By:** {interaction.user.mention}",
+            LOG_GREEN
         )
-        await interaction.response.edit_message(embed=embed, view=self)
+    finish_in_background(interaction, work(), "Failed to remove exclusion.", "channel_exclusion_removed")
 
 
-class ExcludedChannelsView(View):
-    def __init__(self, guild: discord.Guild, excluded_channels: list, excluded_cats: list, page: int = 0):
-        super().__init__(timeout=180)
-        self.guild = guild
-        self.excluded_channels = excluded_channels
-        self.excluded_cats = excluded_cats
-        self.page = page
+async def exclude_category(interaction: discord.Interaction, category_id: int):
+    cat = interaction.guild.get_channel(category_id)
+    name = cat.name if cat else "Unknown"
+    await interaction.response.send_message(f"✅ Category **{name}** excluded from sync.", ephemeral=True)
 
-        all_channels = sorted(
-            [c for c in guild.channels if not isinstance(c, discord.CategoryChannel)],
-            key=lambda c: (c.category.name if c.category else "", c.name)
+    async def work():
+        await add_excluded_category(interaction.guild.id, category_id)
+        logger.info(
+            "Category excluded from sync | %s | %s | by %s", name, interaction.guild.name, interaction.user,
+            extra=log_fields("category_excluded", interaction.guild.id, interaction.user.id)
         )
-        all_channel_options = [
-            SelectOption(
-                label=f"#{c.name}"[:100],
-                value=str(c.id),
-                description=f"Category: {c.category.name if c.category else 'None'}"[:100]
-            )
-            for c in all_channels
-        ]
+        await log_to_channel(
+            interaction.guild,
+            f"🚫 **Category Excluded from Sync**\n"
+            f"**Category:** {name}\n"
+            f"**By:** {interaction.user.mention}",
+            LOG_YELLOW
+        )
+    finish_in_background(interaction, work(), "Failed to exclude category.", "category_excluded")
 
-        paged_options, self.total_pages = paginate_options(all_channel_options, page)
 
-        self.add_select = Select(
-            placeholder=f"Exclude channel (page {page + 1}/{self.total_pages})...",
-            custom_id="excluded:add_select",
-            min_values=1,
-            max_values=1,
-            options=paged_options
-        )
-        self.add_select.callback = self.add_channel_callback
-        self.add_item(self.add_select)
-
-        remove_ch_options = [
-            SelectOption(
-                label=f"#{c.name}"[:100],
-                value=str(c.id),
-                description=f"Category: {c.category.name if c.category else 'None'}"[:100]
-            )
-            for c in excluded_channels
-        ] or [SelectOption(label="No excluded channels", value="none")]
+async def include_category(interaction: discord.Interaction, category_id: int):
+    cat = interaction.guild.get_channel(category_id)
+    name = cat.name if cat else "Unknown"
+    await interaction.response.send_message(f"✅ Category **{name}** will now be synced.", ephemeral=True)
 
-        self.remove_ch_select = Select(
-            placeholder="Remove channel exclusion...",
-            custom_id="excluded:remove_ch_select",
-            min_values=1,
-            max_values=1,
-            options=remove_ch_options
+    async def work():
+        await remove_excluded_category(interaction.guild.id, category_id)
+        logger.info(
+            "Category exclusion removed | %s | %s | by %s", name, interaction.guild.name, interaction.user,
+            extra=log_fields("category_exclusion_removed", interaction.guild.id, interaction.user.id)
         )
-        self.remove_ch_select.callback = self.remove_channel_callback
-        self.add_item(self.remove_ch_select)
-
-        cat_options = [
-            SelectOption(
-                label=cat.name[:100],
-                value=str(cat.id),
-                description=f"{len(cat.channels)} channels"
-            )
-            for cat in guild.categories
-        ] or [SelectOption(label="No categories found", value="none")]
-
-        self.add_cat_select = Select(
-            placeholder="Exclude entire category...",
-            custom_id="excluded:add_cat_select",
-            min_values=1,
-            max_values=1,
-            options=cat_options[:25]
+        await log_to_channel(
+            interaction.guild,
+            f"✅ **Category Exclusion Removed**\n"
+            f"**Category:** {name}\n"
+            f"**By:** {interaction.user.mention}",
+            LOG_GREEN
         )
-        self.add_cat_select.callback = self.add_category_callback
-        self.add_item(self.add_cat_select)
-
-        remove_cat_options = [
-            SelectOption(
-                label=cat.name[:100],
-                value=str(cat.id),
-                description=f"{len(cat.channels)} channels"
-            )
-            for cat in excluded_cats if cat is not None
-        ] or [SelectOption(label="No excluded categories", value="none")]
+    finish_in_background(interaction, work(), "Failed to remove category exclusion.", "category_exclusion_removed")
 
-        self.remove_cat_select = Select(
-            placeholder="Remove category exclusion...",
-            custom_id="excluded:remove_cat_select",
-            min_values=1,
-            max_values=1,
-            options=remove_cat_options
-        )
-        self.remove_cat_select.callback = self.remove_category_callback
-        self.add_item(self.remove_cat_select)
 
-    @discord.ui.button(label="◀ Prev", style=discord.ButtonStyle.grey, custom_id="excluded:prev")
-    async def prev_page(self, interaction: discord.Interaction, _):
-        if self.page > 0:
-            await self._reload(interaction, self.page - 1)
-        else:
-            await interaction.response.defer()
+async def add_tag_role_choice(interaction: discord.Interaction, role_id: int):
+    role = interaction.guild.get_role(role_id)
+    name = role.name if role else "Unknown"
+    await interaction.response.send_message(f"Added **{name}** as tag role", ephemeral=True)
 
-    @discord.ui.button(label="Next ▶", style=discord.ButtonStyle.grey, custom_id="excluded:next")
-    async def next_page(self, interaction: discord.Interaction, _):
-        if self.page < self.total_pages - 1:
-            await self._reload(interaction, self.page + 1)
-        else:
-            await interaction.response.defer()
-
-    @discord.ui.button(label="List All Exclusions", style=discord.ButtonStyle.blurple, custom_id="excluded:list")
-    async def list_excluded(self, interaction: discord.Interaction, _):
-        excluded_ids = await get_excluded_channel_ids(interaction.guild.id)
-        excluded_cat_ids = await get_excluded_category_ids(interaction.guild.id)
-        channels = [interaction.guild.get_channel(cid) for cid in excluded_ids if interaction.guild.get_channel(cid)]
-        cats = [interaction.guild.get_channel(cid) for cid in excluded_cat_ids if interaction.guild.get_channel(cid)]
-        ch_list = "\n".join(f"- #{c.name}" for c in channels) or "None"
-        cat_list = "\n".join(f"- {c.name}" for c in cats) or "None"
-        await interaction.response.send_message(
-            f"**Excluded Channels:**\n{ch_list}\n\n**Excluded Categories:**\n{cat_list}",
-            ephemeral=True
+    async def work():
+        await add_tag_role(interaction.guild.id, role_id)
+        logger.info(
+            "Tag role added | %s | %s | by %s", name, interaction.guild.name, interaction.user,
+            extra=log_fields("tag_role_added", interaction.guild.id, interaction.user.id)
         )
-
-    @discord.ui.button(label="Back", style=discord.ButtonStyle.grey, custom_id="excluded:back")
-    async def back(self, interaction: discord.Interaction, _):
-        embed = discord.Embed(
-            title=f"⚙️ Settings — {interaction.guild.name}",
-            description="Navigate using the buttons below:",
-            color=0x5865f2
+        await log_to_channel(
+            interaction.guild,
+            f"🏷️ **Tag Role Added**\n"
+            f"**Role:** {role.mention if role else name}\n"
+            f"**By:** {interaction.user.mention}",
+            LOG_GREEN
         )
-        await interaction.response.edit_message(embed=embed, view=HomeView())
-
-    async def add_channel_callback(self, interaction: discord.Interaction):
-        value = self.add_select.values[0]
-        if value == "none":
-            await interaction.response.send_message("No channels available.", ephemeral=True)
-            return
-        try:
-            channel_id = int(value)
-            await add_excluded_channel(interaction.guild.id, channel_id)
-            channel = interaction.guild.get_channel(channel_id)
-            name = channel.name if channel else "Unknown"
-            logger.info(f"Channel excluded from sync | #{name} | {interaction.guild.name} | by {interaction.user}")
-            await log_to_channel(
-                interaction.guild,
-                f"🚫 **Channel Excluded from Sync**\n"
-                f"**Channel:** #{name}\n"
-                f"**By:** {interaction.user.mention}",
-                LOG_YELLOW
-            )
-            await interaction.response.send_message(f"✅ **#{name}** excluded from sync.", ephemeral=True)
-        except Exception as e:
-            logger.error(f"Exclude channel failed: {e}")
-            await interaction.response.send_message("Failed to exclude channel.", ephemeral=True)
+        refresh_queue.submit(interaction.guild, role_id, f"Tag role added: {name}", interaction)
+    finish_in_background(interaction, work(), "Failed to add role.", "tag_role_added")
 
-    async def remove_channel_callback(self, interaction: discord.Interaction):
-        value = self.remove_ch_select.values[0]
-        if value == "none":
-            await interaction.response.send_message("No exclusions to remove.", ephemeral=True)
-            return
-        try:
-            channel_id = int(value)
-            await remove_excluded_channel(interaction.guild.id, channel_id)
-            channel = interaction.guild.get_channel(channel_id)
-            name = channel.name if channel else "Unknown"
-            logger.info(f"Channel exclusion removed | #{name} | {interaction.guild.name} | by {interaction.user}")
-            await log_to_channel(
-                interaction.guild,
-                f"✅ **Channel Exclusion Removed**\n"
-                f"**Channel:** #{name}\n"
-                f"**By:** {interaction.user.mention}",
-                LOG_GREEN
-            )
-            await interaction.response.send_message(f"✅ **#{name}** will now be included in sync.", ephemeral=True)
-        except Exception as e:
-            logger.error(f"Remove channel exclusion failed: {e}")
-            await interaction.response.send_message("Failed to remove exclusion.", ephemeral=True)
 
-    async def add_category_callback(self, interaction: discord.Interaction):
-        value = self.add_cat_select.values[0]
-        if value == "none":
-            await interaction.response.send_message("No categories available.", ephemeral=True)
-            return
-        try:
-            category_id = int(value)
-            await add_excluded_category(interaction.guild.id, category_id)
-            cat = interaction.guild.get_channel(category_id)
-            name = cat.name if cat else "Unknown"
-            logger.info(f"Category excluded from sync | {name} | {interaction.guild.name} | by {interaction.user}")
-            await log_to_channel(
-                interaction.guild,
-                f"🚫 **Category Excluded from Sync**\n"
-                f"**Category:** {name}\n"
-                f"**By:** {interaction.user.mention}",
-                LOG_YELLOW
-            )
-            await interaction.response.send_message(f"✅ Category **{name}** excluded from sync.", ephemeral=True)
-        except Exception as e:
-            logger.error(f"Exclude category failed: {e}")
-            await interaction.response.send_message("Failed to exclude category.", ephemeral=True)
+async def remove_tag_role_choice(interaction: discord.Interaction, role_id: int):
+    role = interaction.guild.get_role(role_id)
+    name = role.name if role else "Unknown"
+    await interaction.response.send_message(f"Removed **{name}** from tag roles", ephemeral=True)
 
-    async def remove_category_callback(self, interaction: discord.Interaction):
-        value = self.remove_cat_select.values[0]
-        if value == "none":
-            await interaction.response.send_message("No category exclusions to remove.", ephemeral=True)
-            return
-        try:
-            category_id = int(value)
-            await remove_excluded_category(interaction.guild.id, category_id)
-            cat = interaction.guild.get_channel(category_id)
-            name = cat.name if cat else "Unknown"
-            logger.info(f"Category exclusion removed | {name} | {interaction.guild.name} | by {interaction.user}")
-            await log_to_channel(
-                interaction.guild,
-                f"✅ **Category Exclusion Removed**\n"
-                f"**Category:** {name}\n"
-                f"**By:** {interaction.user.mention}",
-                LOG_GREEN
-            )
-            await interaction.response.send_message(f"✅ Category **{name}** will now be synced.", ephemeral=True)
-        except Exception as e:
-            logger.error(f"Remove category exclusion failed: {e}")
-            await interaction.response.send_message("Failed to remove category exclusion.", ephemeral=True)
-
-    async def _reload(self, interaction: discord.Interaction, new_page: int):
-        excluded_ids = await get_excluded_channel_ids(interaction.guild.id)
-        excluded_cat_ids = await get_excluded_category_ids(interaction.guild.id)
-        excluded_channels = [interaction.guild.get_channel(cid) for cid in excluded_ids if interaction.guild.get_channel(cid)]
-        excluded_cats = [interaction.guild.get_channel(cid) for cid in excluded_cat_ids if interaction.guild.get_channel(cid)]
-        embed = discord.Embed(
-            title="Sync Exclusions",
-            description="Exclude individual channels or entire categories from permission sync.",
-            color=0x9b59b6,
-            timestamp=datetime.now(timezone.utc)
+    async def work():
+        await remove_tag_role(interaction.guild.id, role_id)
+        logger.info(
+            "Tag role removed | %s | %s | by %s", name, interaction.guild.name, interaction.user,
+            extra=log_fields("tag_role_removed", interaction.guild.id, interaction.user.id)
         )
-        await interaction.response.edit_message(
-            embed=embed,
-            view=ExcludedChannelsView(interaction.guild, excluded_channels, excluded_cats, page=new_page)
+        await log_to_channel(
+            interaction.guild,
+            f"🏷️ **Tag Role Removed**\n"
+            f"**Role:** {name}\n"
+            f"**By:** {interaction.user.mention}",
+            LOG_RED
         )
+        refresh_queue.submit(interaction.guild, role_id, f"Tag role removed: {name}", interaction)
+    finish_in_background(interaction, work(), "Failed to remove role.", "tag_role_removed")
 
 
-class StaffView(View):
-    def __init__(self):
-        super().__init__(timeout=None)
-
-    @discord.ui.button(label="Set Staff Role", style=discord.ButtonStyle.green, custom_id="staff:set")
-    async def set_staff(self, interaction: discord.Interaction, _):
-        try:
-            await interaction.response.send_modal(StaffModal())
-        except Exception as e:
-            logger.error(f"Modal send failed: {e}")
-            if not interaction.response.is_done():
-                await interaction.response.send_message("Failed to open modal.", ephemeral=True)
+# action → (handler, message when the select only holds its "none" placeholder)
+SELECT_ACTIONS = {
+    "log_channel": (set_log_channel_choice, "No channels available."),
+    "exclude_channel": (exclude_channel, "No channels available."),
+    "include_channel": (include_channel, "No exclusions to remove."),
+    "exclude_category": (exclude_category, "No categories available."),
+    "include_category": (include_category, "No category exclusions to remove."),
+    "tag_add": (add_tag_role_choice, "No roles to add."),
+    "tag_remove": (remove_tag_role_choice, "No tag roles to remove."),
+}
 
-    @discord.ui.button(label="Back", style=discord.ButtonStyle.grey, custom_id="staff:back_unique")
-    async def back(self, interaction: discord.Interaction, _):
-        embed = discord.Embed(title=f"⚙️ Settings — {interaction.guild.name}", description="...", color=0x5865f2)
-        await interaction.response.edit_message(embed=embed, view=HomeView())
 
+# ── Modals ──────────────────────────────────────
 
-class StaffModal(Modal, title="Set Staff Role"):
+class StaffModal(TimedModal, title="Set Staff Role"):
     role_id_input = TextInput(
         label="Staff Role ID",
         placeholder="Right-click role → Copy Role ID → paste here",
@@ -831,8 +3420,17 @@ class StaffModal(Modal, title="Set Staff Role"):
             role = interaction.guild.get_role(role_id)
             if not role:
                 raise ValueError("Role not found")
+        except ValueError as ve:
+            await interaction.response.send_message(f"Invalid: {str(ve)}", ephemeral=True)
+            return
+        await interaction.response.send_message(f"✅ Staff role set to **{role.name}** (`{role_id}`)", ephemeral=True)
+
+        async def work():
             await set_staff_role(interaction.guild.id, role_id)
-            logger.info(f"Staff role set | {role.name} ({role_id}) | {interaction.guild.name} | by {interaction.user}")
+            logger.info(
+                "Staff role set | %s (%d) | %s | by %s", role.name, role_id, interaction.guild.name, interaction.user,
+                extra=log_fields("staff_role_set", interaction.guild.id, interaction.user.id)
+            )
             await log_to_channel(
                 interaction.guild,
                 f"⚙️ **Staff Role Updated**\n"
@@ -840,114 +3438,113 @@ class StaffModal(Modal, title="Set Staff Role"):
                 f"**By:** {interaction.user.mention}",
                 LOG_BLUE
             )
-            await interaction.response.send_message(f"✅ Staff role set to **{role.name}** (`{role_id}`)", ephemeral=True)
-        except ValueError as ve:
-            await interaction.response.send_message(f"Invalid: {str(ve)}", ephemeral=True)
-        except Exception as e:
-            logger.error(f"Modal submit failed: {e}")
-            await interaction.response.send_message("Error saving role.", ephemeral=True)
-
-
-class TagView(View):
-    def __init__(self, guild: discord.Guild, current_roles: list[discord.Role]):
-        super().__init__(timeout=180)
-
-        add_options = []
-        for role in guild.roles:
-            if role.name.strip() and len(role.name) <= 100:
-                if role.is_default() or role.managed:
-                    continue
-                add_options.append(
-                    SelectOption(
-                        label=role.name,
-                        value=str(role.id),
-                        description=f"Members: {len(role.members)}"
-                    )
-                )
-        add_options = add_options[:25] or [SelectOption(label="No roles to add", value="none")]
-
-        self.add_select = Select(
-            placeholder="Add role as tag...",
-            custom_id="tag:add_select_unique",
-            min_values=1,
-            max_values=1,
-            options=add_options
-        )
-        self.add_select.callback = self.add_callback
-        self.add_item(self.add_select)
+        finish_in_background(interaction, work(), "Error saving role.", "staff_role_set")
+
+
+class TagFormatModal(TimedModal, title="Tag Format"):
+    prefix_input = TextInput(label="Opening text", placeholder="[", required=False, max_length=8)
+    suffix_input = TextInput(label="Closing text", placeholder="] ", required=False, max_length=8)
+    position_input = TextInput(label="Position (prefix / suffix)", placeholder="prefix", required=False, max_length=6)
+    truncate_input = TextInput(
+        label="Truncate (name / tag / ellipsis)",
+        placeholder="name",
+        required=False,
+        max_length=8
+    )
 
-        remove_options = [
-            SelectOption(label=role.name, value=str(role.id), description=f"Remove {role.name}")
-            for role in current_roles
-        ] or [SelectOption(label="No tag roles to remove", value="none")]
+    def __init__(self, config: dict | None):
+        super().__init__()
+        if config:
+            self.prefix_input.default = config["prefix"]
+            self.suffix_input.default = config["suffix"]
+            self.position_input.default = config["position"]
+            self.truncate_input.default = config["truncate"]
 
-        self.remove_select = Select(
-            placeholder="Remove tag role...",
-            custom_id="tag:remove_select_unique",
-            min_values=1,
-            max_values=1,
-            options=remove_options
+    async def on_submit(self, interaction: discord.Interaction):
+        prefix = self.prefix_input.value
+        suffix = self.suffix_input.value
+        position = (self.position_input.value.strip() or "prefix").lower()
+        truncate = (self.truncate_input.value.strip() or "name").lower()
+        try:
+            if not prefix.strip() and not suffix.strip():
+                raise ValueError("Opening or closing text is required")
+            if position not in TAG_POSITIONS:
+                raise ValueError(f"Position must be one of: {', '.join(TAG_POSITIONS)}")
+            if position == "prefix" and not suffix.strip():
+                raise ValueError("Closing text is required when the tag goes before the name")
+            if truncate not in TAG_TRUNCATE_MODES:
+                raise ValueError(f"Truncate must be one of: {', '.join(TAG_TRUNCATE_MODES)}")
+        except ValueError as ve:
+            await interaction.response.send_message(f"Invalid: {str(ve)}", ephemeral=True)
+            return
+        example = TagFormatter(prefix, suffix, position, truncate, {}, []).render("TAG", interaction.user.display_name)
+        await interaction.response.send_message(
+            f"✅ Tag format set. Example: `{example}`\nUse **Refresh All** to migrate existing nicknames.",
+            ephemeral=True
         )
-        self.remove_select.callback = self.remove_callback
-        self.add_item(self.remove_select)
 
-    async def add_callback(self, interaction: discord.Interaction):
-        value = self.add_select.values[0]
-        if value == "none":
-            await interaction.response.send_message("No roles to add.", ephemeral=True)
-            return
-        try:
-            role_id = int(value)
-            await add_tag_role(interaction.guild.id, role_id)
-            role = interaction.guild.get_role(role_id)
-            name = role.name if role else "Unknown"
-            logger.info(f"Tag role added | {name} | {interaction.guild.name} | by {interaction.user}")
+        async def work():
+            await set_tag_format(interaction.guild.id, prefix, suffix, position, truncate)
+            logger.info(
+                "Tag format set | %r | %s | by %s", example, interaction.guild.name, interaction.user,
+                extra=log_fields("tag_format_set", interaction.guild.id, interaction.user.id)
+            )
             await log_to_channel(
                 interaction.guild,
-                f"🏷️ **Tag Role Added**\n"
-                f"**Role:** {role.mention if role else name}\n"
+                f"🏷️ **Tag Format Updated**\n"
+                f"**Example:** `{example}`\n"
+                f"**Truncate:** {truncate}\n"
                 f"**By:** {interaction.user.mention}",
-                LOG_GREEN
+                LOG_BLUE
             )
-            await interaction.response.send_message(f"Added **{name}** as tag role", ephemeral=True)
-        except Exception as e:
-            logger.error(f"Add tag role failed: {e}")
-            await interaction.response.send_message("Failed to add role.", ephemeral=True)
+        finish_in_background(interaction, work(), "Error saving tag format.", "tag_format_set")
 
-    async def remove_callback(self, interaction: discord.Interaction):
-        value = self.remove_select.values[0]
-        if value == "none":
-            await interaction.response.send_message("No tag roles to remove.", ephemeral=True)
-            return
+
+class TagLabelModal(TimedModal, title="Tag Label"):
+    role_id_input = TextInput(
+        label="Tag Role ID",
+        placeholder="Right-click role → Copy Role ID → paste here",
+        style=discord.TextStyle.short,
+        required=True,
+        min_length=17,
+        max_length=20
+    )
+    abbreviation_input = TextInput(label="Abbreviation (blank = role name)", required=False, max_length=16)
+    emoji_input = TextInput(label="Emoji (optional)", required=False, max_length=64)
+
+    async def on_submit(self, interaction: discord.Interaction):
+        abbreviation = self.abbreviation_input.value.strip() or None
+        emoji = self.emoji_input.value.strip() or None
         try:
-            role_id = int(value)
-            await remove_tag_role(interaction.guild.id, role_id)
+            role_id = int(self.role_id_input.value.strip())
             role = interaction.guild.get_role(role_id)
-            name = role.name if role else "Unknown"
-            logger.info(f"Tag role removed | {name} | {interaction.guild.name} | by {interaction.user}")
+            if not role:
+                raise ValueError("Role not found")
+            formatter = await get_tag_formatter(interaction.guild.id)
+            if not formatter or role_id not in formatter.labels:
+                raise ValueError(f"{role.name} is not a tag role")
+        except ValueError as ve:
+            await interaction.response.send_message(f"Invalid: {str(ve)}", ephemeral=True)
+            return
+        label = format_tag_label(role.name, abbreviation, emoji)
+        await interaction.response.send_message(f"✅ **{role.name}** will be shown as `{label}`", ephemeral=True)
+
+        async def work():
+            if not await set_tag_label(interaction.guild.id, role_id, abbreviation, emoji):
+                raise ValueError(f"{role.name} is no longer a tag role")
+            logger.info(
+                "Tag label set | %s → %r | %s | by %s", role.name, label, interaction.guild.name, interaction.user,
+                extra=log_fields("tag_label_set", interaction.guild.id, interaction.user.id)
+            )
             await log_to_channel(
                 interaction.guild,
-                f"🏷️ **Tag Role Removed**\n"
-                f"**Role:** {name}\n"
+                f"🏷️ **Tag Label Updated**\n"
+                f"**Role:** {role.mention}\n"
+                f"**Label:** `{label}`\n"
                 f"**By:** {interaction.user.mention}",
-                LOG_RED
+                LOG_BLUE
             )
-            await interaction.response.send_message(f"Removed **{name}** from tag roles", ephemeral=True)
-        except Exception as e:
-            logger.error(f"Remove tag role failed: {e}")
-            await interaction.response.send_message("Failed to remove role.", ephemeral=True)
-
-    @discord.ui.button(label="List Current Tags", style=discord.ButtonStyle.blurple, custom_id="tag:list_current_unique")
-    async def list_tags(self, interaction: discord.Interaction, _):
-        allowed_ids = await get_tag_role_ids(interaction.guild.id)
-        roles = [interaction.guild.get_role(rid) for rid in allowed_ids if interaction.guild.get_role(rid)]
-        content = "Current tag roles:\n" + ("\n".join(f"- {r.name}" for r in roles) or "None set")
-        await interaction.response.send_message(content, ephemeral=True)
-
-    @discord.ui.button(label="Back", style=discord.ButtonStyle.grey, custom_id="tag:back_unique")
-    async def back(self, interaction: discord.Interaction, _):
-        embed = discord.Embed(title=f"⚙️ Settings — {interaction.guild.name}", description="...", color=0x5865f2)
-        await interaction.response.edit_message(embed=embed, view=HomeView())
+        finish_in_background(interaction, work(), "Error saving tag label.", "tag_label_set")
 
 
 # ────────────────────────────────────────────────
@@ -955,57 +3552,134 @@ class TagView(View):
 # ────────────────────────────────────────────────
 
 @bot.event
-async def on_ready():
+async def setup_hook():
+    # Before any loop starts: wait_until_ready() returns before on_ready has run
     await init_db()
-    logger.info(f"Logged in as {bot.user}")
-    bot.add_view(HomeView())
-    bot.add_view(StaffView())
+    # Settings menus are routed by custom_id, so they survive restarts
+    bot.add_dynamic_items(NavButton, ActionButton, ChoiceSelect, JobControlButton)
+    if DRIFT_SCAN_MINUTES > 0:
+        drift_scan.start()
+    if API_STATS_INTERVAL > 0:
+        api_stats_report.start()
+    if DB_MAINTENANCE_HOURS > 0:
+        db_maintenance.start()
+    if PROFILE_ENABLED:
+        enable_profiling(asyncio.get_running_loop())
+
+
+@bot.event
+@timed("event")
+async def on_ready():
+    drift_detector.hashes.clear()  # The guild cache was rebuilt
+    display_resolver.clear()
+    # Other processes may be running the remaining shards against the same database
+    shard_ids = getattr(bot, "shard_ids", None) or [bot.shard_id or 0]
+    marked, restored = await reconcile_guilds({g.id for g in bot.guilds}, bot.shard_count or 1, shard_ids)
+    if marked or restored:
+        logger.info(
+            "Guilds reconciled | %d left while offline, %d back", marked, restored, extra=log_fields("guild_reconcile")
+        )
+    logger.info("Logged in as %s", bot.user, extra=log_fields("ready"))
     await tree.sync()
-    logger.info("Command tree synced — Ready")
+    logger.info("Command tree synced — Ready", extra=log_fields("ready"))
 
 
 @bot.event
+@timed("event")
 async def on_guild_join(guild):
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute("INSERT OR IGNORE INTO guilds (guild_id) VALUES (?)", (guild.id,))
-        await db.commit()
-    logger.info(f"Joined guild: {guild.name} ({guild.id})")
+    await ensure_guild(guild.id)
+    logger.info("Joined guild: %s (%d)", guild.name, guild.id, extra=log_fields("guild_join", guild.id))
+
+
+@bot.event
+@timed("event")
+async def on_guild_remove(guild):
+    forget_guild(guild)
+    await mark_guild_removed(guild.id)
+    logger.info(
+        "Left guild: %s (%d) — data kept for %gh", guild.name, guild.id, GUILD_GRACE_HOURS,
+        extra=log_fields("guild_remove", guild.id)
+    )
 
 
 @bot.event
+@timed("event")
 async def on_member_join(member):
-    logger.info(f"Member joined | {member} | {member.guild.name}")
+    if trace_recorder:
+        await trace_recorder.member_join(member)
+    logger.info(
+        "Member joined | %s | %s", member, member.guild.name,
+        extra=log_fields("member_join", member.guild.id, member.id)
+    )
     await update_nickname(member, reason="Member joined")
 
 
 @bot.event
+@timed("event")
 async def on_member_update(before, after):
+    if trace_recorder:
+        await trace_recorder.member_update(after)
     if set(r.id for r in before.roles) != set(r.id for r in after.roles):
         added = [r for r in after.roles if r not in before.roles]
         removed = [r for r in before.roles if r not in after.roles]
         if added:
-            logger.info(f"Role added | {after} | {[r.name for r in added]} | {after.guild.name}")
+            logger.info(
+                "Role added | %s | %s | %s", after, [r.name for r in added], after.guild.name,
+                extra=log_fields("role_change", after.guild.id, after.id)
+            )
         if removed:
-            logger.info(f"Role removed | {after} | {[r.name for r in removed]} | {after.guild.name}")
+            logger.info(
+                "Role removed | %s | %s | %s", after, [r.name for r in removed], after.guild.name,
+                extra=log_fields("role_change", after.guild.id, after.id)
+            )
+        if after.id == bot.user.id:
+            drift_detector.forgive(after.guild.id)  # The bot may be able to sync channels now
         await update_nickname(after, reason="Role change")
+    elif before.nick != after.nick:
+        formatter = await get_tag_formatter(after.guild.id)
+        if formatter and nick_enforcer.check(after, formatter):
+            logger.info(
+                "Nickname edited off-format | %s | '%s' — queueing correction", after, after.nick or after.display_name,
+                extra=log_fields("nick_enforce", after.guild.id, after.id)
+            )
 
 
 @bot.event
+@timed("event")
 async def on_guild_channel_update(before: discord.abc.GuildChannel, after: discord.abc.GuildChannel):
+    if trace_recorder:
+        await trace_recorder.channel_update(after)
+    display_resolver.channel_updated(before, after)
+    before_hash = drift_detector.hashes.get(after.id)
+    if before_hash is None:
+        before_hash = overwrite_hash(before)
+    after_hash = drift_detector.update(after)
+
     if not isinstance(after, discord.CategoryChannel):
+        await check_channel_drift(before, after, before_hash != after_hash)
         return
-    if before.overwrites == after.overwrites:
+    if before_hash == after_hash:
         return
 
     excluded_cat_ids = await get_excluded_category_ids(after.guild.id)
     if after.id in excluded_cat_ids:
-        logger.info(f"Category '{after.name}' is excluded — skipping auto-sync")
+        logger.info(
+            "Category '%s' is excluded — skipping auto-sync", after.name,
+            extra=log_fields("category_sync_skipped", after.guild.id)
+        )
         return
 
-    logger.info(f"Category permissions changed | '{after.name}' | {after.guild.name} — auto-syncing")
+    logger.info(
+        "Category permissions changed | '%s' | %s — auto-syncing", after.name, after.guild.name,
+        extra=log_fields("auto_category_sync", after.guild.id)
+    )
+    started = time.perf_counter()
     excluded_ids = await get_excluded_channel_ids(after.guild.id)
     synced, skipped = await sync_category_channels(after, excluded_ids, f"Auto-sync: category '{after.name}' updated")
-    logger.info(f"Auto-sync complete | '{after.name}' | {synced} synced, {skipped} skipped")
+    logger.info(
+        "Auto-sync complete | '%s' | %d synced, %d skipped", after.name, synced, skipped,
+        extra=log_fields("auto_category_sync", after.guild.id, latency_ms=(time.perf_counter() - started) * 1000)
+    )
     await log_to_channel(
         after.guild,
         f"🔒 **Auto Category Sync**\n"
@@ -1016,6 +3690,55 @@ async def on_guild_channel_update(before: discord.abc.GuildChannel, after: disco
     )
 
 
+async def check_channel_drift(before: discord.abc.GuildChannel, after: discord.abc.GuildChannel, changed: bool):
+    if not changed and before.category == after.category:
+        return
+    if not drift_detector.is_drifted(after):
+        return
+    if after.id in await get_excluded_channel_ids(after.guild.id):
+        return
+    if after.category.id in await get_excluded_category_ids(after.guild.id):
+        return
+    logger.info(
+        "Channel drifted | #%s | '%s' — queueing resync", after.name, after.category.name,
+        extra=log_fields("channel_drift", after.guild.id)
+    )
+    resync_queue.submit(after, f"Drift: #{after.name} out of sync with '{after.category.name}'")
+
+
+@bot.event
+@timed("event")
+async def on_guild_channel_create(channel: discord.abc.GuildChannel):
+    drift_detector.update(channel)
+    display_resolver.forget_channel(channel)
+
+
+@bot.event
+@timed("event")
+async def on_guild_channel_delete(channel: discord.abc.GuildChannel):
+    drift_detector.forget(channel.id)
+    display_resolver.forget_channel(channel)
+
+
+@bot.event
+@timed("event")
+async def on_guild_role_create(role: discord.Role):
+    display_resolver.forget_roles(role.guild)
+
+
+@bot.event
+@timed("event")
+async def on_guild_role_update(before: discord.Role, after: discord.Role):
+    display_resolver.forget_roles(after.guild)
+    drift_detector.forgive(after.guild.id)  # The bot may be able to sync channels now
+
+
+@bot.event
+@timed("event")
+async def on_guild_role_delete(role: discord.Role):
+    display_resolver.forget_roles(role.guild)
+
+
 @tree.command(name="role_settings", description="Open role & tag settings (staff only)")
 async def role_settings(interaction: discord.Interaction):
     if not interaction.guild:
@@ -1025,19 +3748,76 @@ async def role_settings(interaction: discord.Interaction):
 
     if not config or not config.get("staff_role_id"):
         embed = discord.Embed(title="Initial Setup Required", description="Please set the Staff role first.", color=0xff0000)
-        return await interaction.response.send_message(embed=embed, view=StaffView(), ephemeral=True)
+        return await interaction.response.send_message(embed=embed, view=StaffView(interaction.guild.id), ephemeral=True)
 
     if not any(r.id == config["staff_role_id"] for r in interaction.user.roles):
         return await interaction.response.send_message("Staff only.", ephemeral=True)
 
-    logger.info(f"Settings opened | {interaction.guild.name} | by {interaction.user}")
+    logger.info(
+        "Settings opened | %s | by %s", interaction.guild.name, interaction.user,
+        extra=log_fields("settings_opened", interaction.guild.id, interaction.user.id)
+    )
+    embed, view = await home_screen(interaction.guild)
+    await interaction.response.send_message(embed=embed, view=view, ephemeral=True)
+
+
+@tree.command(name="db_stats", description="Show database size, row counts and cache sizes (bot owner only)")
+@app_commands.guild_only()
+@app_commands.default_permissions(administrator=True)
+async def db_stats(interaction: discord.Interaction):
+    # Counts cover every guild, so server admins are not enough
+    if not await bot.is_owner(interaction.user):
+        return await interaction.response.send_message("Bot owner only.", ephemeral=True)
+    stats = await get_db_stats()
+    tables = "\n".join(f"`{table}`: {count:,}" for table, count in stats["tables"].items())
+    caches = (
+        f"**Tag formatters:** {len(_tag_formatters):,}\n"
+        f"**Member snapshots:** {len(_member_snapshots):,}\n"
+        f"**Channel hashes:** {len(drift_detector.hashes):,}\n"
+        f"**Display labels:** {len(display_resolver.labels):,}\n"
+        f"**Nickname cooldowns:** {len(nick_enforcer.last_corrected):,}"
+    )
     embed = discord.Embed(
-        title=f"⚙️ {interaction.guild.name} Settings",
-        description="Navigate using the buttons below:",
-        color=0x5865f2,
-        timestamp=datetime.now(timezone.utc)
+        title="Database",
+        description=(
+            f"**Backend:** {'PostgreSQL' if DATABASE_URL else 'SQLite'}\n"
+            f"**Size:** {stats['size'] / 2**20:.2f} MB\n"
+            f"**Guilds pending purge:** {stats['pending_purge']} (after {GUILD_GRACE_HOURS:g}h)"
+        ),
+        color=LOG_BLUE
     )
-    await interaction.response.send_message(embed=embed, view=HomeView(), ephemeral=True)
+    embed.add_field(name="Rows", value=tables, inline=True)
+    embed.add_field(name="Caches", value=caches, inline=True)
+    await interaction.response.send_message(embed=embed, ephemeral=True)
+
+
+if PROFILE_ENABLED:
+    @tree.command(name="profile_report", description="Show the slowest handlers and DB calls (bot owner only)")
+    @app_commands.guild_only()
+    @app_commands.default_permissions(administrator=True)
+    async def profile_report(interaction: discord.Interaction):
+        # Timings cover every guild, so server admins are not enough
+        if not await bot.is_owner(interaction.user):
+            return await interaction.response.send_message("Bot owner only.", ephemeral=True)
+        report = profiler.report()
+        logger.info("Profile report\n%s", report, extra=log_fields("profile_report", interaction.guild_id))
+        await interaction.response.send_message(report[:2000], ephemeral=True)
+
+
+async def run_bot():
+    async with bot:
+        try:
+            # docker stop sends SIGTERM; shut down cleanly so DB connections are released
+            asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, lambda: spawn(bot.close(), "shutdown"))
+        except (NotImplementedError, AttributeError):
+            pass  # No SIGTERM handler on this platform
+        try:
+            await bot.start(TOKEN)
+        finally:
+            await close_db()
 
 
-bot.run(TOKEN)
\ No newline at end of file
+if __name__ == "__main__":
+    # discord.py logs go through the queued root handler, so bot.run()'s log setup is not needed
+    with contextlib.suppress(KeyboardInterrupt):
+        asyncio.run(run_bot())
\ No newline at end of file
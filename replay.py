@@ -0,0 +1,282 @@
+"""Replay a recorded event trace against the bot's handlers, offline.
+
+    TRACE_PATH=trace.jsonl python main.py            # record in production
+    python replay.py trace.jsonl [--speed 10] [--latency 80]
+
+Events are fed to on_member_join, on_member_update and on_guild_channel_update
+the way discord.py would dispatch them: the cached object is updated first and
+the handler runs as its own task. Discord's HTTP API is replaced by an in-memory
+fake that applies edits to the cache and counts calls. Tag config comes from the
+trace and is loaded into a throwaway SQLite database.
+
+--speed 1 keeps the recorded timing, 10 plays ten times faster, 0 (default)
+plays as fast as the handlers allow. Background queues (targeted refresh,
+channel resync, nickname enforcement) keep their real-time pacing at every
+speed and are drained before the report. Enforcement rechecks still waiting out
+a member's cooldown are run straight away, as if the cooldown had passed.
+"""
+import argparse
+import asyncio
+import copy
+import json
+import os
+import tempfile
+import time
+from collections import Counter, defaultdict
+
+os.environ["DB_PATH"] = os.path.join(tempfile.mkdtemp(prefix="rolebot-replay-"), "bot.db")
+os.environ.pop("DATABASE_URL", None)
+os.environ.pop("TRACE_PATH", None)
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+import discord  # noqa: E402
+
+import main  # noqa: E402
+
+VOICE_TYPES = (discord.ChannelType.voice.value, discord.ChannelType.stage_voice.value)
+
+HANDLERS = {
+    "member_join": main.on_member_join,
+    "member_update": main.on_member_update,
+    "channel_update": main.on_guild_channel_update,
+}
+
+
+class FakeHTTP:
+    """Stands in for discord.py's HTTPClient for the calls the handlers make.
+
+    Edits are applied to the cached objects on the next loop iteration, standing
+    in for the gateway event Discord would send back.
+    """
+
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.calls: Counter[str] = Counter()
+        self.state = None
+        self.members: dict[tuple[int, int], dict] = {}
+        self.channels: dict[int, dict] = {}
+        self.messages = 0
+
+    async def _call(self, name: str):
+        self.calls[name] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    async def edit_member(self, guild_id, user_id, *, reason=None, **fields):
+        await self._call("edit_member")
+        guild_id, user_id = int(guild_id), int(user_id)
+        data = self.members[(guild_id, user_id)]
+        data.update(fields)
+        asyncio.get_running_loop().call_soon(self.state._get_guild(guild_id).get_member(user_id)._update, data)
+        return data
+
+    async def edit_channel(self, channel_id, *, reason=None, **options):
+        await self._call("edit_channel")
+        data = self.channels[int(channel_id)]
+        data.update(options)
+        channel = self.state._get_guild(int(data["guild_id"])).get_channel(int(channel_id))
+        channel._update(channel.guild, data)
+        return data
+
+    async def send_message(self, channel_id, *, params):
+        await self._call("send_message")
+        self.messages += 1
+        return {
+            "id": str(self.messages),
+            "channel_id": str(channel_id),
+            "author": {"id": "1", "username": "bot", "discriminator": "0", "avatar": None, "bot": True},
+            "content": "",
+            "timestamp": "2024-01-01T00:00:00+00:00",
+            "edited_timestamp": None,
+            "tts": False,
+            "mention_everyone": False,
+            "mentions": [],
+            "mention_roles": [],
+            "attachments": [],
+            "embeds": [],
+            "pinned": False,
+            "type": 0,
+        }
+
+
+def fill_channel_defaults(data: dict):
+    """Add fields discord.py requires that traces from older versions did not record."""
+    if data["type"] in VOICE_TYPES:
+        data.setdefault("bitrate", 64000)
+        data.setdefault("user_limit", 0)
+
+
+def load_trace(path: str) -> list[dict]:
+    with open(path, encoding="utf-8") as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    records.sort(key=lambda r: r["t"])  # Guild records are written after their config reads
+    return records
+
+
+async def load_guild(record: dict, state, http: FakeHTTP) -> discord.Guild:
+    data = record["guild"]
+    guild_id = int(data["id"])
+    for channel in data["channels"]:
+        channel["guild_id"] = data["id"]
+        fill_channel_defaults(channel)
+        http.channels[int(channel["id"])] = channel
+    for member in data["members"]:
+        http.members[(guild_id, int(member["user"]["id"]))] = member
+    guild = discord.Guild(data=data, state=state)
+    state._add_guild(guild)
+
+    config = record["config"]
+    await main.ensure_guild(guild_id)
+    if config["prefix"] is not None:
+        for prefix, suffix, position in config["formats"]:
+            await main.set_tag_format(guild_id, prefix, suffix, position, config["truncate"])
+        await main.set_tag_format(guild_id, config["prefix"], config["suffix"], config["position"], config["truncate"])
+    for role_id, (abbreviation, emoji) in config["tag_roles"].items():
+        await main.add_tag_role(guild_id, int(role_id))
+        if abbreviation or emoji:
+            await main.set_tag_label(guild_id, int(role_id), abbreviation, emoji)
+    if config["log_channel_id"]:
+        await main.set_log_channel(guild_id, int(config["log_channel_id"]))
+    for channel_id in config["excluded_channels"]:
+        await main.add_excluded_channel(guild_id, int(channel_id))
+    for category_id in config["excluded_categories"]:
+        await main.add_excluded_category(guild_id, int(category_id))
+    return guild
+
+
+def apply_event(record: dict, state, http: FakeHTTP) -> tuple | None:
+    """Update the cache for one event and return the handler's arguments."""
+    guild = state._get_guild(int(record["guild_id"]))
+    if guild is None:
+        return None
+    event = record["event"]
+    if event == "channel_update":
+        data = record["channel"]
+        data["guild_id"] = record["guild_id"]
+        fill_channel_defaults(data)
+        channel = guild.get_channel(int(data["id"]))
+        if channel is None:
+            return None
+        http.channels[channel.id] = data
+        before = copy.copy(channel)
+        channel._update(guild, data)
+        return before, channel
+
+    data = record["member"]
+    member_id = int(data["user"]["id"])
+    http.members[(guild.id, member_id)] = data
+    member = guild.get_member(member_id)
+    if event == "member_join" or member is None:
+        member = discord.Member(data=data, guild=guild, state=state)
+        guild._add_member(member)
+        return (member,) if event == "member_join" else None
+    before = discord.Member._copy(member)
+    member._update(data)
+    return before, member
+
+
+def percentile(values: list[float], pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct))]
+
+
+async def replay(path: str, speed: float, latency: float, show: int):
+    http = FakeHTTP(latency)
+    state = main.bot._connection
+    state.http = http
+    main.bot.http = http
+    http.state = state
+    await main.init_db()
+
+    records = load_trace(path)
+    guild_records = [r for r in records if r["event"] == "guild"]
+    events = [r for r in records if r["event"] in HANDLERS]
+    for record in guild_records:
+        await load_guild(record, state, http)
+    start_nicks = {
+        (guild.id, member.id): member.nick for guild in state.guilds for member in guild.members
+    }
+
+    timings: dict[str, list[float]] = defaultdict(list)
+    failures: Counter[str] = Counter()
+
+    async def run(event: str, args: tuple):
+        started = time.perf_counter()
+        try:
+            await HANDLERS[event](*args)
+        except Exception:
+            failures[event] += 1
+        timings[event].append(time.perf_counter() - started)
+
+    tasks = []
+    origin = events[0]["t"] if events else 0.0
+    started = time.perf_counter()
+    for record in events:
+        if speed:
+            delay = (record["t"] - origin) / speed - (time.perf_counter() - started)
+            if delay > 0:
+                await asyncio.sleep(delay)
+        args = apply_event(record, state, http)
+        if args is not None:
+            if record["event"] == "member_join":
+                start_nicks.setdefault((args[0].guild.id, args[0].id), args[0].nick)
+            tasks.append(asyncio.create_task(run(record["event"], args)))
+    await asyncio.gather(*tasks)
+    handled = time.perf_counter() - started
+    await main.refresh_queue.queue.join()
+    await main.resync_queue.queue.join()
+    await main.nick_enforcer.queue.join()
+    deferred = list(main.nick_enforcer.deferred.items())
+    for (guild_id, member_id), handle in deferred:
+        handle.cancel()
+        main.nick_enforcer._recheck(state._get_guild(guild_id), member_id)
+    await main.nick_enforcer.queue.join()
+    elapsed = time.perf_counter() - started
+
+    print(f"Replayed {len(tasks)} events from {len(guild_records)} guild(s) at "
+          f"{'max speed' if not speed else f'{speed:g}x'}")
+    print(f"Handlers done in {handled:.2f}s ({len(tasks) / handled if handled else 0:.0f} events/s), "
+          f"queues drained at {elapsed:.2f}s")
+    if deferred:
+        print(f"Ran {len(deferred)} enforcement recheck(s) early that were waiting out a cooldown")
+    print(f"\n{'handler':<16} {'count':>7} {'failed':>7} {'mean ms':>9} {'p95 ms':>9} {'max ms':>9}")
+    for event, values in sorted(timings.items()):
+        print(f"{event:<16} {len(values):>7} {failures[event]:>7} {sum(values) / len(values) * 1000:>9.2f} "
+              f"{percentile(values, 0.95) * 1000:>9.2f} {max(values) * 1000:>9.2f}")
+
+    print("\nAPI calls")
+    for name, count in http.calls.most_common():
+        print(f"  {name:<14} {count:>7}")
+    if not http.calls:
+        print("  none")
+
+    changed, off_spec = [], []
+    for guild in state.guilds:
+        formatter = await main.get_tag_formatter(guild.id)
+        for member in guild.members:
+            before = start_nicks.get((guild.id, member.id))
+            if before != member.nick:
+                changed.append(f"{member.id}: {before!r} → {member.nick!r}")
+            current = member.nick or member.display_name
+            if formatter and not member.bot and formatter.expected_nick(member)[:main.NICK_MAX] != current:
+                off_spec.append(f"{member.id}: {current!r}, expected {formatter.expected_nick(member)[:main.NICK_MAX]!r}")
+    print(f"\nNicknames: {len(changed)} changed during replay, {len(off_spec)} not matching their tag at the end")
+    for title, lines in (("Changed", changed), ("Not matching", off_spec)):
+        if lines and show:
+            print(f"  {title}:")
+            for line in lines[:show]:
+                print(f"    {line}")
+
+
+def cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("trace", help="JSONL trace recorded with TRACE_PATH")
+    parser.add_argument("--speed", type=float, default=0, help="playback speed, 0 = max (default)")
+    parser.add_argument("--latency", type=float, default=0, help="simulated API latency in ms (default 0)")
+    parser.add_argument("--show", type=int, default=10, help="nickname diffs to print (default 10)")
+    args = parser.parse_args()
+    asyncio.run(replay(args.trace, args.speed, args.latency / 1000, args.show))
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,69 @@
+"""Settings components must only answer staff, however the menu was reached."""
+import asyncio
+import os
+import sys
+import tempfile
+from pathlib import Path
+from types import SimpleNamespace
+
+os.environ.setdefault("DB_PATH", os.path.join(tempfile.mkdtemp(prefix="rolebot-test-"), "bot.db"))
+os.environ.pop("DATABASE_URL", None)
+os.environ.pop("TRACE_PATH", None)
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import pytest  # noqa: E402
+
+import main  # noqa: E402
+
+GUILD_ID = 1
+STAFF_ROLE_ID = 555
+
+
+def fake_interaction(role_ids: set[int], guild_id: int = GUILD_ID) -> SimpleNamespace:
+    guild = SimpleNamespace(id=guild_id)
+    user = SimpleNamespace(guild=guild, get_role=lambda role_id: role_id if role_id in role_ids else None)
+    return SimpleNamespace(guild_id=guild_id, user=user)
+
+
+def components() -> list:
+    return [
+        main.NavButton(GUILD_ID, "home"),
+        main.ActionButton(GUILD_ID, "refresh_all"),
+        main.ActionButton(GUILD_ID, "staff_modal"),
+        main.ChoiceSelect(GUILD_ID, "tag_add"),
+    ]
+
+
+@pytest.fixture
+def staff_role(monkeypatch):
+    config = {"staff_role_id": STAFF_ROLE_ID}
+
+    async def get_guild_config(guild_id):
+        return config if guild_id == GUILD_ID else None
+    monkeypatch.setattr(main, "get_guild_config", get_guild_config)
+    return config
+
+
+def check(component, interaction) -> bool:
+    return asyncio.run(component.interaction_check(interaction))
+
+
+@pytest.mark.parametrize("index", range(4))
+def test_staff_pass(staff_role, index):
+    assert check(components()[index], fake_interaction({STAFF_ROLE_ID}))
+
+
+@pytest.mark.parametrize("index", range(4))
+def test_non_staff_rejected(staff_role, index):
+    assert not check(components()[index], fake_interaction(set()))
+
+
+@pytest.mark.parametrize("index", range(4))
+def test_other_guild_rejected(staff_role, index):
+    assert not check(components()[index], fake_interaction({STAFF_ROLE_ID}, guild_id=2))
+
+
+def test_only_staff_setup_before_staff_role(staff_role):
+    staff_role["staff_role_id"] = None
+    allowed = [check(c, fake_interaction(set())) for c in components()]
+    assert allowed == [False, False, True, False]
@@ -0,0 +1,118 @@
+"""Settings callbacks must answer the interaction before their DB write and log send.
+
+The writes and log sends are stubbed to be slow; the response has to go out first
+and well inside Discord's 3 second window.
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+os.environ.setdefault("DB_PATH", os.path.join(tempfile.mkdtemp(prefix="rolebot-test-"), "bot.db"))
+os.environ.pop("DATABASE_URL", None)
+os.environ.pop("TRACE_PATH", None)
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import pytest  # noqa: E402
+
+import main  # noqa: E402
+
+RESPONSE_BUDGET = 0.1  # seconds; Discord allows 3
+SLOW = 0.5  # seconds each stubbed write / log send takes
+ROLE_ID = 123456789012345678
+
+
+class FakeResponse:
+    def __init__(self, events: list, started: float):
+        self.events = events
+        self.started = started
+        self.latency: float | None = None
+
+    def is_done(self) -> bool:
+        return self.latency is not None
+
+    async def send_message(self, *args, **kwargs):
+        self.latency = time.perf_counter() - self.started
+        self.events.append("response")
+
+
+def fake_interaction(events: list) -> SimpleNamespace:
+    role = SimpleNamespace(id=ROLE_ID, name="Alliance", mention=f"<@&{ROLE_ID}>")
+    guild = SimpleNamespace(id=1, name="Guild", get_role=lambda role_id: role if role_id == ROLE_ID else None)
+
+    async def followup_send(*args, **kwargs):
+        events.append("followup")
+
+    return SimpleNamespace(
+        id=42,
+        guild=guild,
+        guild_id=guild.id,
+        user=SimpleNamespace(id=7, mention="<@7>"),
+        response=FakeResponse(events, time.perf_counter()),
+        followup=SimpleNamespace(send=followup_send),
+    )
+
+
+@pytest.fixture
+def events(monkeypatch) -> list:
+    events = []
+
+    def slow(name):
+        async def stub(*args, **kwargs):
+            events.append(name)
+            await asyncio.sleep(SLOW)
+        return stub
+
+    for name in ("add_tag_role", "remove_tag_role", "set_staff_role", "log_to_channel"):
+        monkeypatch.setattr(main, name, slow(name))
+    monkeypatch.setattr(main.refresh_queue, "submit", lambda *args, **kwargs: events.append("refresh"))
+    return events
+
+
+def run_callback(callback, events: list) -> SimpleNamespace:
+    async def go():
+        interaction = fake_interaction(events)
+        await callback(interaction)
+        await asyncio.gather(*main.background_tasks)  # Let the deferred work finish
+        return interaction
+    return asyncio.run(go())
+
+
+def assert_fast_then_written(interaction, events: list, write: str):
+    assert interaction.response.latency is not None, "interaction was never answered"
+    assert interaction.response.latency < RESPONSE_BUDGET
+    assert events.index("response") < events.index(write) < events.index("log_to_channel")
+    assert "followup" not in events  # The background work succeeded
+
+
+@pytest.mark.parametrize("action, write", [("tag_add", "add_tag_role"), ("tag_remove", "remove_tag_role")])
+def test_tag_select_answers_before_write(events, action, write):
+    handler, _ = main.SELECT_ACTIONS[action]
+    interaction = run_callback(lambda i: handler(i, ROLE_ID), events)
+    assert_fast_then_written(interaction, events, write)
+    assert events[-1] == "refresh"
+
+
+def test_staff_modal_answers_before_write(events):
+    async def submit(interaction):
+        modal = main.StaffModal()
+        modal.role_id_input._value = str(ROLE_ID)
+        await modal.on_submit(interaction)
+
+    interaction = run_callback(submit, events)
+    assert_fast_then_written(interaction, events, "set_staff_role")
+
+
+def test_failed_write_is_reported_by_followup(events, monkeypatch):
+    async def failing(*args, **kwargs):
+        events.append("add_tag_role")
+        raise RuntimeError("database is locked")
+
+    monkeypatch.setattr(main, "add_tag_role", failing)
+    handler, _ = main.SELECT_ACTIONS["tag_add"]
+    interaction = run_callback(lambda i: handler(i, ROLE_ID), events)
+    assert interaction.response.latency < RESPONSE_BUDGET
+    assert events == ["response", "add_tag_role", "followup"]
@@ -0,0 +1,52 @@
+"""Nicknames the TagFormatter expects must be stable and never empty."""
+import os
+import sys
+import tempfile
+from array import array
+from pathlib import Path
+
+os.environ.setdefault("DB_PATH", os.path.join(tempfile.mkdtemp(prefix="rolebot-test-"), "bot.db"))
+os.environ.pop("DATABASE_URL", None)
+os.environ.pop("TRACE_PATH", None)
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import pytest  # noqa: E402
+
+import main  # noqa: E402
+
+ROLE_ID = 123456789012345678
+
+
+def formatter(position: str = "prefix") -> main.TagFormatter:
+    return main.TagFormatter("[", "] ", position, "name", {}, [])
+
+
+@pytest.mark.parametrize("position, current, label, expected", [
+    # Nothing but a stale tag left: fall back to the member's own name
+    ("prefix", "[Old]", None, "alice"),
+    ("prefix", "[Old] [Older]", None, "alice"),
+    ("suffix", "[Old]", None, "alice"),
+    ("prefix", "[Old]", "Mod", "[Mod] alice"),
+    # Nick is only the member's own tag
+    ("prefix", "[Mod] ", "Mod", "[Mod] alice"),
+    ("prefix", "[Mod]", "Mod", "[Mod] alice"),
+    ("suffix", " [Mod]", "Mod", "alice [Mod]"),
+    # Ordinary nicknames are left to the name
+    ("prefix", "bob", "Mod", "[Mod] bob"),
+    ("prefix", "[Old] bob", None, "bob"),
+])
+def test_empty_name_falls_back(position, current, label, expected):
+    fmt = formatter(position)
+    assert fmt.expected(current, label, "alice") == expected
+    assert fmt.expected(expected, label, "alice") == expected  # Reapplying changes nothing
+
+
+@pytest.mark.parametrize("position", ["prefix", "suffix"])
+def test_rendered_tag_has_no_dangling_separator(position):
+    assert formatter(position).expected("[Mod]", "Mod") == "[Mod]"
+
+
+def test_worker_batch_uses_packed_names():
+    spec = ("[", "] ", "prefix", "name", (), {ROLE_ID: "Mod"}, {ROLE_ID: (1, ROLE_ID)})
+    batch = (array("Q", [1, 2]), ["[Mod]", "[Old]"], ["alice", "bob"], array("Q", [ROLE_ID]), array("I", [0, 1, 1]))
+    assert main.compute_nick_batch(spec, *batch) == [(1, "[Mod] alice"), (2, "bob")]